@@ -5,9 +5,11 @@ from __future__ import annotations
 import json
 import math
 import re
-from dataclasses import dataclass
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone, date
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
@@ -15,10 +17,28 @@ import requests
 import yfinance as yf
 from bs4 import BeautifulSoup
 
+from endpoint_health import default_ledger
+from http_client import http_get as shared_http_get
+from indicator_state import DEFAULT_STATE_PATH, IndicatorState, sync_state
+from market_amount import MarketAmountProvider
+from ohlcv_warehouse import default_warehouse
+from tw_parse import coerce_numeric_columns
+from twse_stock_day_all import get_stock_day_all
+
 TZ_TAIPEI = timezone(timedelta(hours=8))
 
 EPS = 1e-4
 DEFAULT_DYNAMIC_VIX_THRESHOLD = 35.0
+YF_BATCH_CHUNK = 50  # 多檔下載每批檔數（避免單一 request 過大被擋）
+
+# parallel 模式各 stage 截止時間（秒，自 build 開始起算）
+STAGE_DEADLINE_SEC = {
+    "context": 25.0,
+    "market": 35.0,
+    "amount": 45.0,
+    "topn": 90.0,
+    "institutional": 10.0,
+}
 
 # ---------------------------
 # Helpers
@@ -69,6 +89,10 @@ def pct(a: float, b: float) -> float:
 # Market Meta (Index / MA / SMR / Regime)
 # ---------------------------
 def fetch_yf_history(symbol: str, period: str, interval: str) -> pd.DataFrame:
+    # 日K 走本地倉庫（只補缺的尾段）；其他 interval 直接打 yfinance
+    if interval == "1d":
+        df = default_warehouse().history(symbol, period)
+        return df if not df.empty else pd.DataFrame()
     t = yf.Ticker(symbol)
     df = t.history(period=period, interval=interval, auto_adjust=False)
     if df is None or df.empty:
@@ -77,15 +101,78 @@ def fetch_yf_history(symbol: str, period: str, interval: str) -> pd.DataFrame:
     df.index = pd.to_datetime(df.index)
     return df
 
-def latest_trading_day_from_yfinance() -> Optional[date]:
+# symbols → {"Close": date×symbol, "Volume": date×symbol, ...}
+PanelLoader = Callable[[Sequence[str]], Dict[str, pd.DataFrame]]
+
+def _period_offset(period: str) -> pd.DateOffset:
+    # yfinance period 字串（10d / 1mo / 2y ...）→ 日曆位移
+    m = re.fullmatch(r"(\d+)(d|wk|mo|y)", period.strip())
+    if not m:
+        raise ValueError(f"unsupported period: {period}")
+    n, unit = int(m.group(1)), m.group(2)
+    if unit == "d":
+        return pd.DateOffset(days=n)
+    if unit == "wk":
+        return pd.DateOffset(weeks=n)
+    if unit == "mo":
+        return pd.DateOffset(months=n)
+    return pd.DateOffset(years=n)
+
+@dataclass
+class MarketContext:
+    """
+    單次執行共用的 ^TWII 日K：只抓一次 5y，其餘視窗都從這份切片
+    - window(period): 對應原本各函數的 period（10d/15d/40d/1y/2y）
+    - monthly(): 月K 由日K 本地重採樣（取代 interval=1mo 的第二次下載）
+    - indicators(): MA200/SMR/Slope5 增量狀態（indicator_state；state_path=None → 不落地）
+    """
+    symbol: str = "^TWII"
+    daily: pd.DataFrame = field(default_factory=pd.DataFrame)
+    state_path: Optional[str] = DEFAULT_STATE_PATH
+    _indicators: Optional[IndicatorState] = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def load(cls, symbol: str = "^TWII", period: str = "5y") -> "MarketContext":
+        return cls(symbol=symbol, daily=fetch_yf_history(symbol, period=period, interval="1d"))
+
+    def window(self, period: str) -> pd.DataFrame:
+        if self.daily.empty:
+            return pd.DataFrame()
+        start = self.daily.index[-1] - _period_offset(period)
+        return self.daily[self.daily.index > start]
+
+    def monthly(self) -> pd.DataFrame:
+        if self.daily.empty:
+            return pd.DataFrame()
+        df = self.daily
+        idx = df.index.tz_localize(None) if df.index.tz is not None else df.index
+        months = idx.to_period("M")
+        agg = {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}
+        agg = {k: v for k, v in agg.items() if k in df.columns}
+        out = df.groupby(months).agg(agg)
+        out.index = out.index.to_timestamp()
+        return out
+
+    def indicators(self) -> IndicatorState:
+        if self._indicators is None:
+            self._indicators = sync_state(self.daily, symbol=self.symbol, path=self.state_path)
+        return self._indicators
+
+def _twii_daily(ctx: Optional[MarketContext], period: str) -> pd.DataFrame:
+    # 有 ctx 就切片；沒有就維持原本單次下載（函數可獨立呼叫）
+    if ctx is not None:
+        return ctx.window(period)
+    return fetch_yf_history("^TWII", period=period, interval="1d")
+
+def latest_trading_day_from_yfinance(ctx: Optional[MarketContext] = None) -> Optional[date]:
     # 以 ^TWII 最近可用收盤日做「官方交易日代理」
-    df = fetch_yf_history("^TWII", period="10d", interval="1d")
+    df = _twii_daily(ctx, "10d")
     if df.empty:
         return None
     last_dt = df.index[-1].to_pydatetime().date()
     return last_dt
 
-def compute_index_meta(session: str) -> Dict[str, Any]:
+def compute_index_meta(session: str, ctx: Optional[MarketContext] = None) -> Dict[str, Any]:
     """
     session:
       PREOPEN: 顯示「上一交易日收盤」
@@ -102,7 +189,7 @@ def compute_index_meta(session: str) -> Dict[str, Any]:
         "error": None,
     }
 
-    df = fetch_yf_history("^TWII", period="15d", interval="1d")
+    df = _twii_daily(ctx, "15d")
     if df.empty or len(df) < 2:
         out["error"] = "YF_TWII_EMPTY"
         return out
@@ -134,7 +221,7 @@ def compute_index_meta(session: str) -> Dict[str, Any]:
     out["chg_pct"] = round(chg_pct, 4)
     return out
 
-def compute_ma200_and_smr() -> Dict[str, Any]:
+def compute_ma200_and_smr(ctx: Optional[MarketContext] = None) -> Dict[str, Any]:
     out = {
         "ma200": None,
         "smr": None,
@@ -142,30 +229,32 @@ def compute_ma200_and_smr() -> Dict[str, Any]:
         "slope5": None,
         "error": None,
     }
-    df = fetch_yf_history("^TWII", period="2y", interval="1d")
-    if df.empty or len(df) < 210:
+    # MA200 / SMR / SMR_MA5 / Slope5 由增量狀態讀取（每根新 K 棒 O(1) 更新，不再整段 rolling）
+    if ctx is None:
+        ctx = MarketContext(daily=fetch_yf_history("^TWII", period="2y", interval="1d"))
+    st = ctx.indicators()
+    if st.n_bars < 210 or st.ma200 is None:
         out["error"] = "YF_TWII_INSUFFICIENT"
         return out
 
-    close = df["Close"].astype(float)
-    ma200 = close.rolling(200).mean().iloc[-1]
-    last_close = close.iloc[-1]
-    smr = (last_close - ma200) / ma200 if ma200 and ma200 != 0 else 0.0
-
-    smr_series = (close - close.rolling(200).mean()) / close.rolling(200).mean()
-    smr_ma5 = smr_series.rolling(5).mean()
-    slope5 = smr_ma5.iloc[-1] - smr_ma5.iloc[-2] if len(smr_ma5.dropna()) >= 2 else 0.0
+    ma200 = st.ma200
+    smr = st.smr if st.smr is not None else 0.0
+    slope5 = st.slope5 if len(st.slopes) >= 1 else 0.0
 
     out["ma200"] = float(ma200)
     out["smr"] = float(smr)
-    out["smr_ma5"] = float(smr_ma5.iloc[-1]) if not math.isnan(float(smr_ma5.iloc[-1])) else None
+    out["smr_ma5"] = float(st.smr_ma5) if st.smr_ma5 is not None else None
     out["slope5"] = float(slope5)
     return out
 
-def compute_ma14_monthly() -> Dict[str, Any]:
+def compute_ma14_monthly(ctx: Optional[MarketContext] = None) -> Dict[str, Any]:
     # 以 yfinance 1mo 取月K，MA14_monthly = 14 個完整月份 close 平均
+    # 有 ctx 時月K 由共用日K 重採樣，不另外下載
     out = {"ma14_monthly": None, "error": None}
-    df = fetch_yf_history("^TWII", period="5y", interval="1mo")
+    if ctx is not None:
+        df = ctx.monthly()
+    else:
+        df = fetch_yf_history("^TWII", period="5y", interval="1mo")
     if df.empty or len(df) < 15:
         out["error"] = "YF_TWII_1MO_INSUFFICIENT"
         return out
@@ -184,13 +273,15 @@ def compute_vix() -> Dict[str, Any]:
     out["date"] = str(df.index[-1].date())
     return out
 
-def compute_boolean_status(smr: float, slope5: float) -> Dict[str, str]:
+def compute_boolean_status(smr: float, slope5: float, ctx: Optional[MarketContext] = None) -> Dict[str, str]:
     # 你 V15.6.5 要求 Yes/No 形式
     SMR_OVER_0_25 = (smr is not None and smr > 0.25)
     # 連續性判定（NEGATIVE_SLOPE_5D / SLOPE5_4DAY_LOCK / MOMENTUM_LOCK_ACTIVE）
-    # 這裡用近 10 日 SMR_MA5 斜率簡化；要更嚴格可再擴窗
-    df = fetch_yf_history("^TWII", period="40d", interval="1d")
-    if df.empty or len(df) < 12:
+    # 近 10 日 SMR_MA5 斜率：取自增量狀態（MA200 視窗完整）；舊版 40 日K 永遠湊不滿 rolling(200)
+    if ctx is None:
+        ctx = MarketContext(daily=fetch_yf_history("^TWII", period="2y", interval="1d"))
+    last10 = ctx.indicators().last_slopes(10)
+    if not last10:
         return {
             "SMR_OVER_0.25": yesno(SMR_OVER_0_25),
             "NEGATIVE_SLOPE_5D": "No",
@@ -199,16 +290,8 @@ def compute_boolean_status(smr: float, slope5: float) -> Dict[str, str]:
             "CREDIT_STRESS": "No",
         }
 
-    close = df["Close"].astype(float)
-    ma200 = close.rolling(200).mean()
-    smr_series = (close - ma200) / ma200
-    smr_ma5 = smr_series.rolling(5).mean()
-    # slope series
-    slope = smr_ma5.diff()
-
-    last10 = slope.dropna().tail(10)
-    NEGATIVE_SLOPE_5D = (len(last10) >= 5 and all(last10.tail(5) < -EPS))
-    SLOPE5_4DAY_LOCK = (len(last10) >= 4 and all(last10.tail(4) > EPS))
+    NEGATIVE_SLOPE_5D = (len(last10) >= 5 and all(x < -EPS for x in last10[-5:]))
+    SLOPE5_4DAY_LOCK = (len(last10) >= 4 and all(x > EPS for x in last10[-4:]))
     MOMENTUM_LOCK_ACTIVE = SLOPE5_4DAY_LOCK  # 先用同義（你定義是 4 consecutive days）
 
     # CREDIT_STRESS: 若沒有 HY spread 就只能 No + 註記（在 risk_alerts）
@@ -239,8 +322,8 @@ def compute_regime(smr: float, slope5: float, vix: float, drawdown_pct: float, m
         return "OVERHEAT"
     return "NORMAL"
 
-def compute_drawdown_pct() -> float:
-    df = fetch_yf_history("^TWII", period="1y", interval="1d")
+def compute_drawdown_pct(ctx: Optional[MarketContext] = None) -> float:
+    df = _twii_daily(ctx, "1y")
     if df.empty:
         return 0.0
     close = df["Close"].astype(float)
@@ -264,26 +347,45 @@ def http_get(url: str, verify_ssl: bool, timeout: int = 15) -> requests.Response
     headers = {
         "User-Agent": "Mozilla/5.0 (compatible; Sunhero-Predator/1.0; +https://streamlit.app)"
     }
-    return requests.get(url, headers=headers, timeout=timeout, verify=verify_ssl)
+    # 共用連線池（http_client）：keep-alive + 統一 retry/backoff + certifi verify
+    return shared_http_get(url, headers=headers, timeout=timeout, verify_ssl=verify_ssl)
 
-def fetch_twse_stock_day_all(verify_ssl: bool) -> SourceResult:
+def fetch_twse_stock_day_all(verify_ssl: bool, trade_date: Optional[date] = None,
+                             latest_fallback: bool = True) -> SourceResult:
     # TWSE 全市場日行情 (上市)
+    # 有交易日 → 走 twse_stock_day_all 共用快取（同一交易日整個 process 只下載一次）
+    # 指定日期抓不到（盤中 / 尚未公布 → TWSE_EMPTY 或例外）→ 退回 OpenAPI 最新一日（與原行為相同）
+    # latest_fallback=False（回放）：OpenAPI 只有最新一日，不能冒充歷史日期 → 直接回報失敗
+    if trade_date is not None:
+        try:
+            sda = get_stock_day_all(trade_date.strftime("%Y%m%d"), verify=verify_ssl, timeout=20)
+            if not sda.table.empty:
+                # table 為共用唯讀；使用端要改欄位請先 copy
+                return SourceResult(True, sda.table, "TWSE_STOCK_DAY_ALL", None, sda.date)
+            dated = SourceResult(False, pd.DataFrame(), "TWSE_STOCK_DAY_ALL", "TWSE_EMPTY")
+        except Exception as e:
+            dated = SourceResult(False, pd.DataFrame(), "TWSE_STOCK_DAY_ALL", f"TWSE_ERR:{type(e).__name__}")
+        if not latest_fallback:
+            return dated
+
     url = "https://openapi.twse.com.tw/v1/exchangeReport/STOCK_DAY_ALL"
     try:
-        r = http_get(url, verify_ssl=verify_ssl, timeout=20)
-        r.raise_for_status()
-        data = r.json()
+        def get_json():
+            r = http_get(url, verify_ssl=verify_ssl, timeout=20)
+            r.raise_for_status()
+            return r.json()
+
+        # 端點熔斷中 → CircuitOpenError（TWSE_ERR:CircuitOpenError），不付 timeout
+        data = default_ledger().call("TWSE_OPENAPI", get_json)
         df = pd.DataFrame(data)
         if df.empty:
             return SourceResult(False, pd.DataFrame(), "TWSE_OPENAPI", "TWSE_EMPTY")
         # 欄位整理
         # 常見欄位：Code, Name, TradeVolume, TradeValue, Open, High, Low, Close, Change, Transaction
         # 轉成 numeric
-        for c in ["TradeVolume", "TradeValue", "Open", "High", "Low", "Close", "Change", "Transaction"]:
-            if c in df.columns:
-                df[c] = df[c].apply(lambda x: safe_float(x, np.nan))
+        coerce_numeric_columns(df, ["TradeVolume", "TradeValue", "Open", "High", "Low", "Close", "Change", "Transaction"])
         # 日期不一定在這個 endpoint 給；用 yfinance 最近日當作 official_date 代理
-        return SourceResult(True, df, "TWSE_OPENAPI", None, None, None)
+        return SourceResult(True, df, "TWSE_OPENAPI", None, None)
     except Exception as e:
         return SourceResult(False, pd.DataFrame(), "TWSE_OPENAPI", f"TWSE_ERR:{type(e).__name__}")
 
@@ -301,15 +403,19 @@ def fetch_tpex_pricing_html(verify_ssl: bool) -> SourceResult:
             return SourceResult(False, pd.DataFrame(), "TPEX_HTML", "TPEX_PRICING_NOT_FOUND")
         amt_yi = safe_float(m.group(1), None)
         df = pd.DataFrame([{"amount_tpex_yi": amt_yi}])
-        return SourceResult(True, df, "TPEX_HTML", None, None, None)
+        return SourceResult(True, df, "TPEX_HTML", None, None)
     except Exception as e:
         return SourceResult(False, pd.DataFrame(), "TPEX_HTML", f"TPEX_ERR:{type(e).__name__}")
 
-def compute_amount_total_best_effort(verify_ssl: bool) -> Dict[str, Any]:
+def compute_amount_total_best_effort(verify_ssl: bool, trade_date: Optional[date] = None,
+                                     tpex_latest: bool = True,
+                                     tpex_provider: Optional[MarketAmountProvider] = None) -> Dict[str, Any]:
     """
     目標：TWSE amount + TPEx amount（億）+ total
     - TWSE：若抓得到 STOCK_DAY_ALL，sum TradeValue / 1e8 = 億（TradeValue 常是元）
     - TPEx：pricing.html 只能拿到彙總（億）
+    tpex_latest=False（回放）：pricing.html 只有「最新」沒有歷史日期
+      → 改用 tpex_provider 的 TPEX ST43（指定日期）；沒有 provider → 標示 TPEX_NO_HISTORY
     """
     out = {
         "twse_yi": None,
@@ -320,7 +426,7 @@ def compute_amount_total_best_effort(verify_ssl: bool) -> Dict[str, Any]:
         "error": None,
     }
 
-    twse = fetch_twse_stock_day_all(verify_ssl=verify_ssl)
+    twse = fetch_twse_stock_day_all(verify_ssl=verify_ssl, trade_date=trade_date, latest_fallback=tpex_latest)
     if twse.ok:
         # TradeValue 若是元，換算億：/1e8
         if "TradeValue" in twse.df.columns:
@@ -333,12 +439,23 @@ def compute_amount_total_best_effort(verify_ssl: bool) -> Dict[str, Any]:
     else:
         out["sources"]["twse"] = twse.error
 
-    tpex = fetch_tpex_pricing_html(verify_ssl=verify_ssl)
-    if tpex.ok:
-        out["tpex_yi"] = safe_float(tpex.df.iloc[0].get("amount_tpex_yi"), None)
-        out["sources"]["tpex"] = tpex.source
+    if not tpex_latest:
+        if tpex_provider is None or trade_date is None:
+            out["sources"]["tpex"] = "TPEX_NO_HISTORY"
+            return out
+        st43 = tpex_provider.fetch_tpex(datetime(trade_date.year, trade_date.month, trade_date.day, tzinfo=TZ_TAIPEI))
+        if st43.ok:
+            out["tpex_yi"] = round(st43.value / 1e8, 2)
+            out["sources"]["tpex"] = st43.source
+        else:
+            out["sources"]["tpex"] = f"TPEX_ERR:{st43.error}"
     else:
-        out["sources"]["tpex"] = tpex.error
+        tpex = fetch_tpex_pricing_html(verify_ssl=verify_ssl)
+        if tpex.ok:
+            out["tpex_yi"] = safe_float(tpex.df.iloc[0].get("amount_tpex_yi"), None)
+            out["sources"]["tpex"] = tpex.source
+        else:
+            out["sources"]["tpex"] = tpex.error
 
     if out["twse_yi"] is not None and out["tpex_yi"] is not None:
         out["total_yi"] = round(out["twse_yi"] + out["tpex_yi"], 2)
@@ -347,17 +464,26 @@ def compute_amount_total_best_effort(verify_ssl: bool) -> Dict[str, Any]:
 # ---------------------------
 # Top20 ranking (true market ranking by turnover)
 # ---------------------------
-def build_topn_by_turnover(topn: int, verify_ssl: bool, min_price: float = 1.0) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+def build_topn_by_turnover(topn: int, verify_ssl: bool, min_price: float = 1.0,
+                           extra_symbols: Sequence[str] = (),
+                           trade_date: Optional[date] = None,
+                           panel_loader: Optional[PanelLoader] = None,
+                           latest_fallback: bool = True) -> Tuple[pd.DataFrame, Dict[str, Any]]:
     """
     True ranking definition:
       TopN = 全市場(上市)當日成交金額 TradeValue 排序前 N
     若 TWSE API 失敗 → 回傳空 DF，並標示 error，使上層 Gate 降級
+    extra_symbols（例如孤兒持股）與 TopN 併成同一批多檔下載，結果放 meta["extra_tech"]
+    panel_loader：技術面日K 來源（回放時由 ReplayData 提供截斷後的 panel；None → 下載 60d）
+    latest_fallback：指定日期抓不到時是否退回 OpenAPI 最新一日（回放傳 False）
     """
-    meta = {"source": None, "error": None, "note": None}
-    twse = fetch_twse_stock_day_all(verify_ssl=verify_ssl)
+    meta = {"source": None, "error": None, "note": None, "extra_tech": {}}
+    twse = fetch_twse_stock_day_all(verify_ssl=verify_ssl, trade_date=trade_date, latest_fallback=latest_fallback)
     if not twse.ok:
         meta["source"] = twse.source
         meta["error"] = twse.error
+        if extra_symbols:
+            meta["extra_tech"] = compute_stock_tech_batch(list(dict.fromkeys(extra_symbols)), panel_loader=panel_loader)
         return pd.DataFrame(), meta
 
     df = twse.df.copy()
@@ -367,10 +493,13 @@ def build_topn_by_turnover(topn: int, verify_ssl: bool, min_price: float = 1.0)
     # 只保留 4~6 位數代碼（台股常見），可再依你的需求精煉
     if "Code" not in df.columns or "TradeValue" not in df.columns or "Close" not in df.columns:
         meta["error"] = "TWSE_SCHEMA_CHANGED"
+        if extra_symbols:
+            meta["extra_tech"] = compute_stock_tech_batch(list(dict.fromkeys(extra_symbols)), panel_loader=panel_loader)
         return pd.DataFrame(), meta
 
     df = df[df["Code"].astype(str).str.match(r"^\d{4}$")]
-    df = df[df["Close"].apply(lambda x: safe_float(x, np.nan)).notna()]
+    # Close / TradeValue 已在 fetch 階段數值化（tw_parse），這裡只做過濾
+    df = df[df["Close"].notna()]
     df = df[df["Close"] >= min_price]
     df = df[df["TradeValue"].notna()]
 
@@ -381,10 +510,15 @@ def build_topn_by_turnover(topn: int, verify_ssl: bool, min_price: float = 1.0)
     df["volume"] = df.get("TradeVolume", np.nan)
     df["turnover"] = df["TradeValue"].astype(float)
 
-    # 附加少量技術欄位：只對 TopN 個股用 yfinance 計算（成本可控）
+    # 附加少量技術欄位：TopN + extra 一次批次下載、向量化計算
+    top_syms = df["symbol"].tolist()
+    extra = [x for x in dict.fromkeys(extra_symbols) if x and x not in set(top_syms)]
+    tech_map = compute_stock_tech_batch(top_syms + extra, panel_loader=panel_loader)
+    meta["extra_tech"] = {sym: tech_map[sym] for sym in extra}
+
     rows = []
     for sym, nm in zip(df["symbol"], df["name"]):
-        tech = compute_stock_tech(sym)
+        tech = tech_map[sym]
         row = {
             "symbol": sym,
             "name": nm,
@@ -454,6 +588,116 @@ def compute_stock_tech(symbol: str) -> Dict[str, Any]:
     out["ma_bias_pct"] = round(float(ma_bias), 4) if ma_bias is not None else None
     return out
 
+def fetch_yf_panel(symbols: Sequence[str], period: str, interval: str,
+                   chunk_size: int = YF_BATCH_CHUNK) -> Dict[str, pd.DataFrame]:
+    """
+    多檔批次下載：每 chunk 一個 yf.download request
+    回傳 {"Close": date×symbol, "Volume": date×symbol, ...}；下載失敗的 symbol 欄位不存在
+    """
+    frames: Dict[str, List[pd.DataFrame]] = {}
+    syms = list(dict.fromkeys(s for s in symbols if s))
+    if interval == "1d":
+        # 日K：倉庫 read-through（磁碟已有的不發 request，缺的尾段仍是 chunk 批次下載）
+        hist = default_warehouse().history_many(syms, period, chunk_size=chunk_size)
+        for sym, df in hist.items():
+            if df.empty:
+                continue
+            for fld in df.columns:
+                frames.setdefault(fld, []).append(df[fld].rename(sym))
+        return {fld: pd.concat(parts, axis=1).sort_index() for fld, parts in frames.items()}
+
+    for i in range(0, len(syms), max(1, int(chunk_size))):
+        chunk = syms[i:i + chunk_size]
+        try:
+            raw = yf.download(chunk, period=period, interval=interval, auto_adjust=False,
+                              group_by="column", progress=False, threads=True)
+        except Exception:
+            continue
+        if raw is None or raw.empty:
+            continue
+        if not isinstance(raw.columns, pd.MultiIndex):
+            # 舊版 yfinance 單檔下載回傳單層欄位
+            raw.columns = pd.MultiIndex.from_product([raw.columns, chunk[:1]])
+        for fld in raw.columns.get_level_values(0).unique():
+            frames.setdefault(fld, []).append(raw[fld])
+
+    panel: Dict[str, pd.DataFrame] = {}
+    for fld, parts in frames.items():
+        df = pd.concat(parts, axis=1).sort_index()
+        df.index = pd.to_datetime(df.index)
+        panel[fld] = df.loc[:, ~df.columns.duplicated()]
+    return panel
+
+def compute_stock_tech_batch(symbols: Sequence[str], chunk_size: int = YF_BATCH_CHUNK,
+                             panel_loader: Optional[PanelLoader] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    compute_stock_tech 的批次版（欄位/口徑相同）：
+    - 一次（分 chunk）多檔下載 60d（panel_loader 有給 → 改用它回傳的 panel，例如回放）
+    - 在 date×symbol 的 Close/Volume 矩陣上一次算完 ret20 / vol_ratio / ma_bias
+    - 每檔只用自己的有效列（停牌日 NaN 不計），等同單檔 history 的結果
+    """
+    syms = list(dict.fromkeys(s for s in symbols if s))
+    out: Dict[str, Dict[str, Any]] = {
+        sym: {
+            "symbol": sym,
+            "date": None,
+            "close": None,
+            "volume": None,
+            "ret20_pct": None,
+            "vol_ratio": None,
+            "ma_bias_pct": None,
+            "error": "YF_STOCK_INSUFFICIENT",
+        }
+        for sym in syms
+    }
+    if not syms:
+        return out
+
+    if panel_loader is not None:
+        panel = panel_loader(syms)
+    else:
+        panel = fetch_yf_panel(syms, period="60d", interval="1d", chunk_size=chunk_size)
+    if "Close" not in panel or "Volume" not in panel:
+        return out
+
+    cols = [c for c in syms if c in panel["Close"].columns and c in panel["Volume"].columns]
+    close = panel["Close"][cols].astype(float)
+    vol = panel["Volume"][cols].astype(float)
+
+    valid = close.notna()
+    # k = 該列（含）之後的有效列數：最後一筆有效列 k==1，往前第 21 筆 k==21
+    k = valid[::-1].cumsum()[::-1]
+    n_valid = valid.sum()
+
+    last_close = close.where(valid & (k == 1)).max()
+    last_vol = vol.where(valid & (k == 1)).max()
+    close_21 = close.where(valid & (k == 21)).max()
+    ma20 = close.where(valid & (k <= 20)).mean()
+    vol20 = vol.where(valid & (k <= 20)).mean()
+    last_date = valid[::-1].idxmax()
+
+    ret20 = (last_close / close_21.replace(0.0, np.nan) - 1.0) * 100.0
+    ret20 = ret20.where(close_21 != 0, 0.0)
+    vol_ratio = last_vol / vol20.replace(0.0, np.nan)
+    ma_bias = (last_close - ma20) / ma20.replace(0.0, np.nan) * 100.0
+
+    for sym in cols:
+        if n_valid[sym] < 25:
+            continue
+        vr = vol_ratio[sym]
+        mb = ma_bias[sym]
+        lv = last_vol[sym]
+        out[sym].update({
+            "date": str(pd.Timestamp(last_date[sym]).date()),
+            "close": round(float(last_close[sym]), 4),
+            "volume": int(lv) if not math.isnan(lv) else None,
+            "ret20_pct": round(float(ret20[sym]), 4),
+            "vol_ratio": round(float(vr), 4) if not math.isnan(vr) else None,
+            "ma_bias_pct": round(float(mb), 4) if not math.isnan(mb) else None,
+            "error": None,
+        })
+    return out
+
 # ---------------------------
 # Institutional (best-effort placeholder)
 # ---------------------------
@@ -539,32 +783,22 @@ def enforce_decision_action_consistency(decision: str, action_size_pct: int) ->
         return "WATCH", 0, err
     return d, action_size_pct, None
 
-def build_arbiter_input(
-    session: str,
-    topn: int,
-    positions: List[Dict[str, Any]],
-    cash_balance: int,
-    total_equity: int,
-    verify_ssl: bool,
-    sim_free: bool = True,
-) -> Dict[str, Any]:
-
-    ts_now = now_taipei()
-    latest_trade_day = latest_trading_day_from_yfinance()
-
-    # 1) Index / VIX / SMR / MA
-    twii = compute_index_meta(session=session)
-    ma = compute_ma200_and_smr()
-    ma14 = compute_ma14_monthly()
-    vix = compute_vix()
-    drawdown = compute_drawdown_pct()
+# ---------------------------
+# Stage execution (sequential / parallel)
+# ---------------------------
+def _stage_market(session: str, ctx: MarketContext, vix: Dict[str, Any]) -> Dict[str, Any]:
+    # Step 1 衍生指標：只用 ctx（已下載）與 vix，不再發 request
+    twii = compute_index_meta(session=session, ctx=ctx)
+    ma = compute_ma200_and_smr(ctx)
+    ma14 = compute_ma14_monthly(ctx)
+    drawdown = compute_drawdown_pct(ctx)
 
     smr = ma.get("smr", 0.0) if ma.get("smr") is not None else 0.0
     slope5 = ma.get("slope5", 0.0) if ma.get("slope5") is not None else 0.0
     vix_val = vix.get("vix", None)
     twii_close = twii.get("close", None)
 
-    boolean_status = compute_boolean_status(smr=smr, slope5=slope5)
+    boolean_status = compute_boolean_status(smr=smr, slope5=slope5, ctx=ctx)
 
     current_regime = compute_regime(
         smr=smr,
@@ -574,15 +808,306 @@ def build_arbiter_input(
         ma14_monthly=ma14.get("ma14_monthly", None),
         twii_close=twii_close,
     )
+    return {
+        "twii": twii,
+        "ma": ma,
+        "ma14": ma14,
+        "vix": vix,
+        "drawdown": drawdown,
+        "boolean_status": boolean_status,
+        "current_regime": current_regime,
+    }
+
+def _stage_fallback(stage: str, session: str, error: str, sim_free: bool = True) -> Any:
+    # stage 逾時/失敗的替代值：與各函數「資料不可得」時的輸出一致，讓 Gate 照常降級
+    if stage == "context":
+        return MarketContext()
+    if stage == "vix":
+        return {"vix": None, "date": None, "source": "yfinance", "error": error}
+    if stage == "amount":
+        return {
+            "twse_yi": None,
+            "tpex_yi": None,
+            "total_yi": None,
+            "sources": {"twse": error, "tpex": error},
+            "warning": None,
+            "error": error,
+        }
+    if stage == "topn":
+        return pd.DataFrame(), {"source": None, "error": error, "note": None, "extra_tech": {}}
+    if stage == "institutional":
+        return compute_institutional_stub(sim_free=sim_free)
+    raise ValueError(stage)
+
+def _run_stages_sequential(session: str, topn: int, pos_symbols: List[str], verify_ssl: bool,
+                           sim_free: bool) -> Tuple[Dict[str, Any], Dict[str, int], Dict[str, str]]:
+    latency: Dict[str, int] = {}
+
+    def timed(name, fn):
+        t0 = time.time()
+        out = fn()
+        latency[name] = int((time.time() - t0) * 1000)
+        return out
+
+    # ^TWII 只抓一次（5y 日K），Step 1 六項指標都從同一份 context 推導
+    ctx = timed("context", MarketContext.load)
+    latest_trade_day = latest_trading_day_from_yfinance(ctx)
+    vix = timed("vix", compute_vix)
+    res: Dict[str, Any] = {"latest_trade_day": latest_trade_day}
+    res["market"] = timed("market", lambda: _stage_market(session, ctx, vix))
+    # STOCK_DAY_ALL 與 TopN 共用同一份快取（同交易日只下載一次）
+    res["amount"] = timed("amount", lambda: compute_amount_total_best_effort(verify_ssl=verify_ssl, trade_date=latest_trade_day))
+    res["topn"] = timed("topn", lambda: build_topn_by_turnover(topn=topn, verify_ssl=verify_ssl, extra_symbols=pos_symbols,
+                                                                trade_date=latest_trade_day))
+    res["institutional"] = timed("institutional", lambda: compute_institutional_stub(sim_free=sim_free))
+    return res, latency, {}
+
+def _run_stages_parallel(session: str, topn: int, pos_symbols: List[str], verify_ssl: bool, sim_free: bool,
+                         deadlines: Dict[str, float]) -> Tuple[Dict[str, Any], Dict[str, int], Dict[str, str]]:
+    """
+    Step 1~4 同時發出：
+    - context（^TWII 5y）/ vix / institutional 立即開始
+    - amount / topn 需要交易日當 STOCK_DAY_ALL 快取 key → context 一完成就開始（兩者共用同一個 in-flight 下載）
+      context 失敗/逾時 → 以無交易日模式（OpenAPI）繼續，不整批放棄
+    - 每個 stage 有自己的截止時間（自開始起算）；逾時改用 _stage_fallback 並記錄 STAGE_TIMEOUT
+    - 合併順序固定（與 sequential 相同），結果與完成先後無關
+    """
+    t_start = time.time()
+    latency: Dict[str, int] = {}
+    errors: Dict[str, str] = {}
+
+    def remaining(key: str) -> float:
+        return max(0.0, t_start + deadlines[key] - time.time())
+
+    def timed(name, fn):
+        t0 = time.time()
+        try:
+            return fn()
+        finally:
+            latency[name] = int((time.time() - t0) * 1000)
+
+    ex = ThreadPoolExecutor(max_workers=5, thread_name_prefix="arbiter-stage")
+    f_ctx = ex.submit(timed, "context", MarketContext.load)
+    f_vix = ex.submit(timed, "vix", compute_vix)
+    f_inst = ex.submit(timed, "institutional", lambda: compute_institutional_stub(sim_free=sim_free))
+
+    def trade_day_after_ctx() -> Optional[date]:
+        try:
+            return latest_trading_day_from_yfinance(f_ctx.result(timeout=remaining("context")))
+        except Exception:
+            return None
+
+    def run_amount() -> Dict[str, Any]:
+        td = trade_day_after_ctx()
+        return timed("amount", lambda: compute_amount_total_best_effort(verify_ssl=verify_ssl, trade_date=td))
+
+    def run_topn() -> Tuple[pd.DataFrame, Dict[str, Any]]:
+        td = trade_day_after_ctx()
+        return timed("topn", lambda: build_topn_by_turnover(topn=topn, verify_ssl=verify_ssl,
+                                                            extra_symbols=pos_symbols, trade_date=td))
+
+    f_amount = ex.submit(run_amount)
+    f_topn = ex.submit(run_topn)
+
+    def collect(name: str, fut, deadline_key: str) -> Any:
+        try:
+            return fut.result(timeout=remaining(deadline_key))
+        except FutureTimeout:
+            errors[name] = "STAGE_TIMEOUT"
+            latency[name] = int((time.time() - t_start) * 1000)
+        except Exception as e:
+            errors[name] = f"STAGE_ERR:{type(e).__name__}"
+        return _stage_fallback(name, session, errors[name], sim_free=sim_free)
+
+    try:
+        ctx = collect("context", f_ctx, "context")
+        vix = collect("vix", f_vix, "market")
+        res: Dict[str, Any] = {"latest_trade_day": latest_trading_day_from_yfinance(ctx)}
+        res["market"] = timed("market", lambda: _stage_market(session, ctx, vix))
+        res["amount"] = collect("amount", f_amount, "amount")
+        res["topn"] = collect("topn", f_topn, "topn")
+        res["institutional"] = collect("institutional", f_inst, "institutional")
+    finally:
+        # 逾時的 stage 不等它結束（thread 自行跑完後丟棄結果）
+        ex.shutdown(wait=False, cancel_futures=True)
+    return res, dict(latency), dict(errors)
+
+# ---------------------------
+# Historical replay (asof)
+# ---------------------------
+CONTEXT_YEARS = 5      # 與 MarketContext.load 的 5y 一致
+TECH_LOOKBACK_DAYS = 60  # 與 compute_stock_tech_batch 的 60d 一致
+# 回放 payload 的 timestamp：該日對應排程 run 的時刻（workflow 08:30 / 11:00 / 16:30）
+REPLAY_SESSION_HHMM = {"PREOPEN": (8, 30), "INTRADAY": (11, 0), "EOD": (16, 30)}
+
+def _days_back(since: date) -> str:
+    # 從今天回推到 since 的 yfinance period 字串（倉庫以日曆天切起點）
+    return f"{max(1, (now_taipei().date() - since).days + 1)}d"
+
+@dataclass
+class ReplayData:
+    """
+    回放用的日K（一次載入、逐日截斷）
+    - twii / vix：涵蓋 [start - 5y, end]，asof 時只取 <= asof 的部分（^TWII 再截成 5y，與即時口徑相同）
+    - panel：個股 Close/Volume（date×symbol）；新出現的 symbol 才補載，其餘重用
+    - indicators：MA200/SMR 狀態在記憶體中逐日推進（不寫 data/indicator_state_twii.json）
+    TWSE STOCK_DAY_ALL 走 twse_stock_day_all 的日期快取 + 落地檔（data/stock_day_all）：每個交易日只下載一次，跨執行重用
+    TPEX 成交額走 ST43 指定日期（MarketAmountProvider 回應快取落地），與即時 payload 同樣有 total
+    """
+    start: date
+    end: date
+    twii: pd.DataFrame = field(default_factory=pd.DataFrame)
+    vix: pd.DataFrame = field(default_factory=pd.DataFrame)
+    panel: Dict[str, pd.DataFrame] = field(default_factory=dict)
+    _state: Optional[IndicatorState] = field(default=None, init=False, repr=False)
+    _amount: Optional[MarketAmountProvider] = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def load(cls, start: date, end: date) -> "ReplayData":
+        ctx_since = (pd.Timestamp(start) - pd.DateOffset(years=CONTEXT_YEARS)).date()
+        return cls(
+            start=start,
+            end=end,
+            twii=fetch_yf_history("^TWII", period=_days_back(ctx_since), interval="1d"),
+            vix=fetch_yf_history("^VIX", period=_days_back(start - timedelta(days=15)), interval="1d"),
+        )
+
+    def trade_days(self) -> List[date]:
+        if self.twii.empty:
+            return []
+        days = [ts.date() for ts in self.twii.index]
+        return [d for d in days if self.start <= d <= self.end]
+
+    def context(self, asof: date) -> MarketContext:
+        if self.twii.empty:
+            return MarketContext(state_path=None)
+        end = pd.Timestamp(asof) + pd.Timedelta(days=1)
+        daily = self.twii[(self.twii.index < end) & (self.twii.index > end - pd.DateOffset(years=CONTEXT_YEARS))]
+        ctx = MarketContext(daily=daily, state_path=None)
+        self._state = sync_state(daily, symbol=ctx.symbol, path=None, state=self._state)
+        ctx._indicators = self._state
+        return ctx
+
+    def amount_provider(self) -> MarketAmountProvider:
+        if self._amount is None:
+            self._amount = MarketAmountProvider()
+        return self._amount
+
+    def vix_asof(self, asof: date) -> Dict[str, Any]:
+        # 美股 VIX 日期 D 於台北 D+1 清晨才收盤 → asof 當天任何時段能看到的最新值是 < asof
+        out = {"vix": None, "date": None, "source": "yfinance", "error": None}
+        df = self.vix[self.vix.index < pd.Timestamp(asof)] if not self.vix.empty else self.vix
+        if df.empty:
+            out["error"] = "YF_VIX_EMPTY"
+            return out
+        out["vix"] = float(df["Close"].iloc[-1])
+        out["date"] = str(df.index[-1].date())
+        return out
+
+    def panel_asof(self, symbols: Sequence[str], asof: date) -> Dict[str, pd.DataFrame]:
+        have = set(self.panel["Close"].columns) if "Close" in self.panel else set()
+        missing = [x for x in dict.fromkeys(symbols) if x and x not in have]
+        if missing:
+            since = self.start - timedelta(days=TECH_LOOKBACK_DAYS)
+            fresh = fetch_yf_panel(missing, period=_days_back(since), interval="1d")
+            for fld in ("Close", "Volume"):
+                if fld not in fresh:
+                    continue
+                parts = [self.panel[fld], fresh[fld]] if fld in self.panel else [fresh[fld]]
+                self.panel[fld] = pd.concat(parts, axis=1).sort_index()
+
+        lo = pd.Timestamp(asof) - pd.Timedelta(days=TECH_LOOKBACK_DAYS)
+        hi = pd.Timestamp(asof)
+        out: Dict[str, pd.DataFrame] = {}
+        for fld, df in self.panel.items():
+            cols = [x for x in symbols if x in df.columns]
+            out[fld] = df.loc[(df.index >= lo) & (df.index <= hi), cols]
+        return out
+
+def _run_stages_replay(session: str, topn: int, pos_symbols: List[str], verify_ssl: bool, sim_free: bool,
+                       replay: ReplayData, asof: date) -> Tuple[Dict[str, Any], Dict[str, int], Dict[str, str]]:
+    # 與 sequential 相同的 stage 順序；日K 全部來自 replay（截斷到 asof），TWSE 以 asof 交易日為快取 key
+    latency: Dict[str, int] = {}
+
+    def timed(name, fn):
+        t0 = time.time()
+        out = fn()
+        latency[name] = int((time.time() - t0) * 1000)
+        return out
+
+    ctx = timed("context", lambda: replay.context(asof))
+    latest_trade_day = latest_trading_day_from_yfinance(ctx)
+    vix = timed("vix", lambda: replay.vix_asof(asof))
+    res: Dict[str, Any] = {"latest_trade_day": latest_trade_day}
+    res["market"] = timed("market", lambda: _stage_market(session, ctx, vix))
+    res["amount"] = timed("amount", lambda: compute_amount_total_best_effort(verify_ssl=verify_ssl, trade_date=latest_trade_day,
+                                                                              tpex_latest=False,
+                                                                              tpex_provider=replay.amount_provider()))
+    res["topn"] = timed("topn", lambda: build_topn_by_turnover(topn=topn, verify_ssl=verify_ssl, extra_symbols=pos_symbols,
+                                                                trade_date=latest_trade_day,
+                                                                panel_loader=lambda syms: replay.panel_asof(syms, asof),
+                                                                latest_fallback=False))
+    res["institutional"] = timed("institutional", lambda: compute_institutional_stub(sim_free=sim_free))
+    return res, latency, {}
+
+def build_arbiter_input(
+    session: str,
+    topn: int,
+    positions: List[Dict[str, Any]],
+    cash_balance: int,
+    total_equity: int,
+    verify_ssl: bool,
+    sim_free: bool = True,
+    parallel: bool = False,
+    stage_deadlines: Optional[Dict[str, float]] = None,
+    asof: Optional[date] = None,
+    replay: Optional[ReplayData] = None,
+) -> Dict[str, Any]:
+    """
+    parallel=False：Step 1~4 依序執行（原行為）
+    parallel=True ：Step 1~4 以 thread pool 同時抓取，各 stage 有截止時間（STAGE_DEADLINE_SEC，可用 stage_deadlines 覆寫）
+                   呼叫端自行選用（opt-in）；預設維持依序執行
+    asof=date     ：回放模式，產生該日當時會看到的 payload（日K 截斷到 asof；replay 可傳入共用的 ReplayData）
+    各模式的合併結果欄位相同；各 stage 耗時寫入 meta.stage_latency_ms
+    """
+
+    if asof is not None:
+        # 回放：payload 時間戳記為該日排程 run 的時刻，而非實際執行時間
+        hh, mm = REPLAY_SESSION_HHMM.get(session, REPLAY_SESSION_HHMM["EOD"])
+        ts_now = datetime(asof.year, asof.month, asof.day, hh, mm, tzinfo=TZ_TAIPEI)
+    else:
+        ts_now = now_taipei()
+    pos_symbols = sorted(set([p.get("symbol") for p in positions if p.get("symbol")]))
+
+    if asof is not None:
+        replay = replay or ReplayData.load(asof, asof)
+        stages, stage_latency, stage_errors = _run_stages_replay(session, topn, pos_symbols, verify_ssl, sim_free, replay, asof)
+    elif parallel:
+        deadlines = {**STAGE_DEADLINE_SEC, **(stage_deadlines or {})}
+        stages, stage_latency, stage_errors = _run_stages_parallel(session, topn, pos_symbols, verify_ssl, sim_free, deadlines)
+    else:
+        stages, stage_latency, stage_errors = _run_stages_sequential(session, topn, pos_symbols, verify_ssl, sim_free)
+
+    latest_trade_day = stages["latest_trade_day"]
+
+    # 1) Index / VIX / SMR / MA
+    mkt = stages["market"]
+    twii = mkt["twii"]
+    ma = mkt["ma"]
+    ma14 = mkt["ma14"]
+    vix = mkt["vix"]
+    drawdown = mkt["drawdown"]
+    boolean_status = mkt["boolean_status"]
+    current_regime = mkt["current_regime"]
 
     # 2) amount_total (best-effort)
-    amount = compute_amount_total_best_effort(verify_ssl=verify_ssl)
+    amount = stages["amount"]
 
-    # 3) TopN by turnover
-    top_df, top_meta = build_topn_by_turnover(topn=topn, verify_ssl=verify_ssl)
+    # 3) TopN by turnover（持股一起批次下載技術面）
+    top_df, top_meta = stages["topn"]
 
     # 4) Institutional (SIM-FREE stub)
-    inst = compute_institutional_stub(sim_free=sim_free)
+    inst = stages["institutional"]
 
     # 5) Gate
     gate = data_health_gate(
@@ -600,7 +1125,7 @@ def build_arbiter_input(
     top_symbols = set(top_df["symbol"].tolist()) if not top_df.empty else set()
 
     # Orphan holding: in positions but not in topN
-    pos_symbols = set([p.get("symbol") for p in positions if p.get("symbol")])
+    orphan_tech = top_meta.get("extra_tech") or {}
 
     # TopN stocks
     for _, r in top_df.iterrows():
@@ -626,8 +1151,9 @@ def build_arbiter_input(
         })
 
     # Orphan holdings appended (not counted in topN ranking)
-    for sym in sorted(list(pos_symbols - top_symbols)):
-        tech = compute_stock_tech(sym)
+    for sym in sorted(set(pos_symbols) - top_symbols):
+        # 批次結果涵蓋所有持股；topn stage 逾時時不再逐檔補抓（避免破壞截止時間）
+        tech = orphan_tech.get(sym) or {}
         stocks.append({
             "symbol": sym,
             "name": "",
@@ -660,6 +1186,10 @@ def build_arbiter_input(
             "snapshot_date": twii.get("date"),
             "snapshot_source": top_meta.get("source"),
             "verify_ssl": bool(verify_ssl),
+            "execution_mode": "replay" if asof is not None else ("parallel" if parallel else "sequential"),
+            "asof": str(asof) if asof is not None else None,
+            "stage_latency_ms": stage_latency,
+            "stage_errors": stage_errors,
         },
         "market_meta": {
             "taiex": {
@@ -741,4 +1271,32 @@ def build_arbiter_input(
     if top_meta.get("error"):
         arb["risk_alerts"].append(f"TOPN_BUILD_FAILED({top_meta.get('error')})")
 
+    # stage 逾時/失敗 → 提醒（固定順序）
+    for name in ("context", "vix", "amount", "topn", "institutional"):
+        if stage_errors.get(name):
+            arb["risk_alerts"].append(f"STAGE_FAILED({name}:{stage_errors[name]})")
+
     return arb
+
+def replay_arbiter_inputs(
+    start: date,
+    end: date,
+    session: str,
+    topn: int,
+    positions: List[Dict[str, Any]],
+    cash_balance: int,
+    total_equity: int,
+    verify_ssl: bool,
+    sim_free: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    批次回放 [start, end] 內每個交易日（以 ^TWII 日K 為交易日曆）
+    日K / 個股 panel 只載入一次，逐日截斷重用；回傳 payload 依日期排序
+    """
+    replay = ReplayData.load(start, end)
+    return [
+        build_arbiter_input(session=session, topn=topn, positions=positions, cash_balance=cash_balance,
+                            total_equity=total_equity, verify_ssl=verify_ssl, sim_free=sim_free,
+                            asof=d, replay=replay)
+        for d in replay.trade_days()
+    ]
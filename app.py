@@ -3,19 +3,21 @@
 import json
 import time
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Tuple, Optional
+from typing import Any, Callable, Dict, List, Tuple, Optional
 import concurrent.futures
 
 import streamlit as st
 import requests
 
-try:
-    import certifi  # 建議 requirements.txt 有 certifi
-except Exception:
-    certifi = None
-
 # 你 repo 內的統一裁決入口
 from arbiter import arbiter_run
+from downloader_tw import fetch_twse_t86  # T86 summary + 個股買賣超落地（與資料層引擎共用）
+from http_client import shared_session, verify_policy
+from snapshot_cache import default_snapshot_cache
+from stock_layer import build_stock_layer
+from tw_parse import int_sum, trade_value_column
+from twii_provider import default_twii_provider
+from twse_stock_day_all import get_stock_day_all
 
 
 # =========================
@@ -28,14 +30,9 @@ TZ_TPE = timezone(timedelta(hours=8))
 # Stable HTTP Session
 # =========================
 def build_session() -> requests.Session:
-    s = requests.Session()
-    s.headers.update({
-        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121 Safari/537.36",
-        "Accept": "application/json,text/plain,*/*",
-        "Accept-Language": "zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7",
-        "Connection": "keep-alive",
-    })
-    return s
+    # 共用連線池（http_client）：Streamlit 每次 rerun 不再重建 session，熱連線跨 run 重用
+    # retries=0：儀表板走短 timeout + fallback，不在 adapter 內重試
+    return shared_session(retries=0)
 
 
 # =========================
@@ -54,165 +51,87 @@ def safe_json(obj: Any) -> Any:
     """確保可被 st.json 顯示（避免 Streamlit renderer 內部炸）"""
     return json.loads(json.dumps(obj, ensure_ascii=False, default=str))
 
-def run_with_timeout(fn, timeout_sec: float, fallback, tag: str) -> Tuple[Any, Dict[str, Any]]:
-    """硬 timeout：永遠回傳 (data, audit)"""
+def run_all_with_deadline(tasks: List[Tuple[str, Callable[[], Any], Any]], deadline_sec: float) -> Dict[str, Tuple[Any, Dict[str, Any]]]:
+    """
+    多來源同時發出、共用一個總截止時間：永遠回傳 {tag: (data, audit)}
+    - 一個 executor 一次 submit 全部來源 → 總耗時 ≈ 最慢的那支（上限 deadline_sec）
+    - 截止時仍未完成 → fallback + TIMEOUT；executor 不等它（thread 自行跑完後丟棄結果）
+    """
     t0 = time.time()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
-        fut = ex.submit(fn)
-        try:
-            data = fut.result(timeout=timeout_sec)
-            return data, {
-                "name": tag,
-                "status": "OK",
-                "confidence": "HIGH",
-                "error": None,
-                "latency_ms": int((time.time() - t0) * 1000),
-            }
-        except concurrent.futures.TimeoutError:
-            return fallback, {
-                "name": tag,
-                "status": "FAIL",
-                "confidence": "LOW",
-                "error": "TIMEOUT",
-                "latency_ms": int((time.time() - t0) * 1000),
-            }
-        except Exception as e:
-            return fallback, {
-                "name": tag,
-                "status": "FAIL",
-                "confidence": "LOW",
-                "error": type(e).__name__,
-                "error_detail": str(e)[:200],
-                "latency_ms": int((time.time() - t0) * 1000),
-            }
-
-def http_get_json(sess: requests.Session, url: str, params: Dict[str, Any], timeout=(2, 3)) -> Dict[str, Any]:
-    """短 timeout + 可選 certifi verify"""
-    verify = certifi.where() if certifi else True
-    r = sess.get(url, params=params, timeout=timeout, verify=verify)
-    r.raise_for_status()
-    return r.json()
+    done_ms: Dict[str, int] = {}
 
+    def timed(tag: str, fn: Callable[[], Any]) -> Any:
+        try:
+            return fn()
+        finally:
+            done_ms[tag] = int((time.time() - t0) * 1000)
+
+    ex = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(tasks)), thread_name_prefix="snapshot")
+    try:
+        futs = {tag: ex.submit(timed, tag, fn) for tag, fn, _ in tasks}
+        concurrent.futures.wait(list(futs.values()), timeout=deadline_sec)
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+
+    out: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+    for tag, _, fallback in tasks:
+        fut = futs[tag]
+        audit: Dict[str, Any] = {"name": tag, "status": "FAIL", "confidence": "LOW", "error": None}
+        if not fut.done():
+            audit["error"] = "TIMEOUT"
+            audit["latency_ms"] = int((time.time() - t0) * 1000)
+            out[tag] = (fallback, audit)
+            continue
+        e = fut.exception()
+        if e is not None:
+            audit["error"] = type(e).__name__
+            audit["error_detail"] = str(e)[:200]
+            audit["latency_ms"] = done_ms.get(tag)
+            out[tag] = (fallback, audit)
+            continue
+        audit.update({"status": "OK", "confidence": "HIGH", "latency_ms": done_ms.get(tag)})
+        out[tag] = (fut.result(), audit)
+    return out
 
 # =========================
 # Data Layer (Stable / Tiered)
 # =========================
 TPEX_SAFE_AMOUNT = 200_000_000_000  # 2000 億（你既定 Safe Mode）
-
-def fetch_twse_t86(sess: requests.Session, trade_date_yyyymmdd: str) -> Dict[str, Any]:
-    """
-    TWSE T86（三大法人）- 只回傳 summary（穩定/輕量）
-    """
-    url = "https://www.twse.com.tw/rwd/zh/fund/T86"
-    params = {"response": "json", "date": trade_date_yyyymmdd, "selectType": "ALL"}
-    j = http_get_json(sess, url, params, timeout=(2, 3))
-
-    rows = j.get("data") or []
-    fields = j.get("fields") or []
-    if not rows or not fields:
-        raise RuntimeError("T86_EMPTY")
-
-    # 欄位名稱可能會變，做關鍵字匹配
-    idx_map = {name: i for i, name in enumerate(fields)}
-
-    def find_col_idx(kw_list):
-        for name, idx in idx_map.items():
-            ok = True
-            for kw in kw_list:
-                if kw not in name:
-                    ok = False
-                    break
-            if ok:
-                return idx
-        return None
-
-    # 常見欄位口徑（股數/張數口徑；你 UI 目前只顯示「買超 xx 億」那是金額口徑，這裡先以淨買賣超合計數字呈現）
-    i_total = find_col_idx(["三大法人", "買賣超"])
-    i_foreign = find_col_idx(["外", "買賣超"])
-    i_trust = find_col_idx(["投信", "買賣超"])
-    i_dealer = find_col_idx(["自營商", "買賣超"])
-
-    def to_int(x):
-        try:
-            s = str(x).replace(",", "").replace("--", "0").strip()
-            return int(float(s))
-        except:
-            return 0
-
-    summary = {}
-    if i_foreign is not None:
-        summary["外資"] = sum(to_int(r[i_foreign]) for r in rows)
-    if i_trust is not None:
-        summary["投信"] = sum(to_int(r[i_trust]) for r in rows)
-    if i_dealer is not None:
-        summary["自營商"] = sum(to_int(r[i_dealer]) for r in rows)
-    if i_total is not None:
-        summary["合計"] = sum(to_int(r[i_total]) for r in rows)
-
-    return {"summary": summary, "asof": trade_date_yyyymmdd}
+SNAPSHOT_DEADLINE_SEC = 4.5  # 快照整體截止時間（所有來源同時發出）
+SNAPSHOT_SOURCES = ["TWSE_TWII_INDEX", "TWSE_STOCK_DAY_ALL", "TWSE_T86"]
 
 def fetch_twse_amount_stock_day_all(sess: requests.Session, trade_date_yyyymmdd: str) -> Dict[str, Any]:
     """
     TWSE 成交額：用 STOCK_DAY_ALL，做「總成交額加總」。
     注意：此 endpoint 偶發 SSL / 風控，故上層會短 timeout + fallback。
     """
-    url = "https://www.twse.com.tw/exchangeReport/STOCK_DAY_ALL"
-    params = {"response": "json", "date": trade_date_yyyymmdd}
-    j = http_get_json(sess, url, params, timeout=(2, 3))
+    # 與 analyzer / MarketAmountProvider 共用同一份 STOCK_DAY_ALL（同交易日只下載一次）
+    verify = verify_policy(True)
+    sda = get_stock_day_all(trade_date_yyyymmdd, session=sess, verify=verify, timeout=(2, 3))
+    rows = sda.rows
 
-    rows = j.get("data") or []
-    if not rows:
-        raise RuntimeError("STOCK_DAY_ALL_EMPTY")
-
-    # 保守：從尾端找可解析的大整數當「交易金額」
-    def safe_int(x):
-        try:
-            s = str(x).replace(",", "").strip()
-            return int(float(s))
-        except:
-            return None
-
-    amount_sum = 0
-    ok_rows = 0
-    for row in rows:
-        best = None
-        for cell in reversed(row):
-            v = safe_int(cell)
-            if v is not None and v > 0:
-                best = v
-                break
-        if best is not None:
-            amount_sum += best
-            ok_rows += 1
+    # 依 fields 表頭定位成交金額欄；表頭缺失才退回尾端掃描
+    best, method = trade_value_column(sda.fields, rows)
+    amount_sum = int_sum(best)
+    ok_rows = int(best.notna().sum())
 
     # 合理性底線：1000 億（你之前也用過類似檢查）
     if amount_sum < 100_000_000_000:
         raise RuntimeError("AMOUNT_TOO_LOW")
 
-    return {"amount_twse": amount_sum, "rows": len(rows), "ok_rows": ok_rows, "asof": trade_date_yyyymmdd}
+    return {"amount_twse": amount_sum, "rows": len(rows), "ok_rows": ok_rows, "parse": method, "asof": trade_date_yyyymmdd}
 
-def fetch_twii_via_yfinance_like(sess: requests.Session) -> Dict[str, Any]:
+def fetch_twii_close(effective_date_iso: str) -> Dict[str, Any]:
     """
-    最穩的指數抓法本來應該用 TWSE 指數 endpoint，但你在 Cloud 上遇到 SSL，
-    先給「穩定可用」方案：用 Stooq 的 TWII 指數（不保證永遠有，但常常比 TWSE 穩）
-    你若已有 downloader_tw.py 的指數抓取函數，可直接替換這支。
+    TWII 收盤：twii_provider 競速（TWSE MI_INDEX / yfinance / Stooq / 倉庫），先到且通過前收盤檢查者勝出
+    - 比快照整體截止時間短一點，留時間給組裝
+    - 全部失敗 → raise，上層 audit 記 FAIL，L1 會擋下（符合稽核哲學）
     """
-    # Stooq: Taiwan index 可能是 ^TWII 不一定，這裡做最保守：不硬依賴
-    # => 若失敗，上層會 fallback 成 None，L1 就會 fail（符合你的稽核哲學）
-    url = "https://stooq.com/q/l/?s=%5ETWII&i=d"
-    # 這支回 CSV，不是 JSON，這裡簡化：只求能不 hang；若你要完全可靠請改你自家 TWSE index endpoint。
-    r = sess.get(url, timeout=(2, 3))
-    r.raise_for_status()
-    text = r.text.strip().splitlines()
-    if len(text) < 2:
-        raise RuntimeError("TWII_CSV_EMPTY")
-    # header: Date,Open,High,Low,Close,Volume
-    parts = text[1].split(",")
-    if len(parts) < 5:
-        raise RuntimeError("TWII_CSV_BAD")
-    close = float(parts[4])
-    dt = parts[0]
-    return {"twii_close": close, "asof": dt}
+    out = default_twii_provider().get(effective_date_iso, deadline_sec=SNAPSHOT_DEADLINE_SEC - 0.5)
+    if not out.get("ok"):
+        raise RuntimeError(out.get("error") or "TWII_UNAVAILABLE")
+    data = out["data"]
+    return {"twii_close": data["close"], "asof": data["date"], "source": out["source"], "stale": out["stale"]}
 
 def resolve_effective_trade_date(target_date: datetime, session: str) -> Tuple[str, bool]:
     """
@@ -230,39 +149,49 @@ def resolve_effective_trade_date(target_date: datetime, session: str) -> Tuple[s
 # =========================
 # Build Snapshot (Parallel + Fast Fail)
 # =========================
-def get_snapshot_cached(sess: requests.Session, target_date: datetime, session: str, top_n: int) -> Dict[str, Any]:
+def get_snapshot_cached(sess: requests.Session, target_date: datetime, session: str, top_n: int,
+                        refresh_sources: Optional[List[str]] = None) -> Dict[str, Any]:
     """
     最穩定版本：
     - 只做「市場快照」(TWII / TWSE amount / TPEX amount / T86 summary)
-    - 並行抓取
-    - 每支硬 timeout（避免一直 run）
+    - 並行抓取（同一個 executor 一次發出，SNAPSHOT_DEADLINE_SEC 為整體截止時間）
     - 任何失敗都寫進 audit_modules
+    - 每個來源獨立快取（snapshot_cache；key = 交易日 + session + topN，落地、跨重啟）
+      refresh_sources 只清指定來源；成功的來源才快取，失敗的下次自動重抓
     """
     effective_date_iso, is_using_prev = resolve_effective_trade_date(target_date, session)
     trade_date = effective_date_iso.replace("-", "")
 
+    cache = default_snapshot_cache()
+    cache_key = (effective_date_iso, session.upper(), int(top_n))
+    if refresh_sources:
+        cache.invalidate(cache_key, refresh_sources)
+
     # --- parallel fetch ---
     # 注意：TWSE SSL 常掛，這裡每支都短 timeout + 上層 fallback
-    twii_data, twii_audit = run_with_timeout(
-        lambda: fetch_twii_via_yfinance_like(sess),
-        timeout_sec=4.5,
-        fallback=None,
-        tag="TWSE_TWII_INDEX"
-    )
-
-    twse_amt, twse_audit = run_with_timeout(
-        lambda: fetch_twse_amount_stock_day_all(sess, trade_date),
-        timeout_sec=4.5,
-        fallback=None,
-        tag="TWSE_STOCK_DAY_ALL"
-    )
-
-    t86_data, t86_audit = run_with_timeout(
-        lambda: fetch_twse_t86(sess, trade_date),
-        timeout_sec=4.5,
-        fallback=None,
-        tag="TWSE_T86"
+    fetchers = {
+        "TWSE_TWII_INDEX": lambda: fetch_twii_close(effective_date_iso),
+        "TWSE_STOCK_DAY_ALL": lambda: fetch_twse_amount_stock_day_all(sess, trade_date),
+        "TWSE_T86": lambda: fetch_twse_t86(sess, trade_date),
+    }
+    hits = {tag: cache.peek(cache_key, tag) for tag in SNAPSHOT_SOURCES}
+    res = run_all_with_deadline(
+        [(tag, fetchers[tag], None) for tag in SNAPSHOT_SOURCES if hits[tag] is None],
+        deadline_sec=SNAPSHOT_DEADLINE_SEC,
     )
+    for tag in SNAPSHOT_SOURCES:
+        if hits[tag] is not None:
+            res[tag] = (hits[tag]["value"], {**(hits[tag].get("audit") or {}), "from_cache": True})
+            continue
+        data, audit = res[tag]
+        # stale（非當日）TWII 不快取：下次重抓有機會拿到當日收盤
+        if audit.get("status") == "OK" and not (isinstance(data, dict) and data.get("stale")):
+            cache.put(cache_key, tag, data, audit)
+        res[tag] = (data, {**audit, "from_cache": False})
+
+    twii_data, twii_audit = res["TWSE_TWII_INDEX"]
+    twse_amt, twse_audit = res["TWSE_STOCK_DAY_ALL"]
+    t86_data, t86_audit = res["TWSE_T86"]
 
     # TPEX 仍採 Safe Mode（秒回）
     tpex_amount = TPEX_SAFE_AMOUNT
@@ -324,8 +253,8 @@ def get_snapshot_cached(sess: requests.Session, target_date: datetime, session:
 # =========================
 def build_arbiter_payload(snapshot: Dict[str, Any], top_n: int) -> Dict[str, Any]:
     """
-    產出「最小可運行 JSON」：先把 macro + meta + system_params 填好
-    stocks 先留空（你可後續接 TopN 個股資料層再補）
+    產出「最小可運行 JSON」：macro + meta + system_params
+    stocks：stock_layer（快取的 STOCK_DAY_ALL TopN + 倉庫技術面 + 本地 T86 個股法人）
     """
     meta = snapshot.get("meta", {})
     ov = snapshot.get("macro", {}).get("overview", {}) or {}
@@ -336,6 +265,13 @@ def build_arbiter_payload(snapshot: Dict[str, Any], top_n: int) -> Dict[str, Any
 
     twii_close = snapshot.get("macro", {}).get("overview", {}).get("twii_close")
 
+    stocks: List[Dict[str, Any]] = []
+    stock_audit: Dict[str, Any] = {"name": "TOPN_STOCK_LAYER", "status": "FAIL", "confidence": "LOW",
+                                   "error": "NO_EFFECTIVE_TRADE_DATE"}
+    if meta.get("effective_trade_date"):
+        stocks, stock_audit = build_stock_layer(meta["effective_trade_date"], int(top_n),
+                                                session=build_session(), verify=verify_policy(True))
+
     payload = {
         "meta": {
             "timestamp": meta.get("timestamp"),
@@ -345,7 +281,7 @@ def build_arbiter_payload(snapshot: Dict[str, Any], top_n: int) -> Dict[str, Any
             "is_using_previous_day": meta.get("is_using_previous_day", False),
             "effective_trade_date": meta.get("effective_trade_date"),
             "war_time_override": meta.get("war_time_override", False),
-            "audit_modules": meta.get("audit_modules", []),
+            "audit_modules": list(meta.get("audit_modules", [])) + [stock_audit],
         },
         "macro": {
             "integrity": {"kill": False},
@@ -385,7 +321,7 @@ def build_arbiter_payload(snapshot: Dict[str, Any], top_n: int) -> Dict[str, Any
             "ai_enabled": True,
             "ai_confidence_threshold": 0.70
         },
-        "stocks": []  # TopN 個股資料層之後再接
+        "stocks": stocks,
     }
     return payload
 
@@ -417,11 +353,15 @@ def main():
 
         top_n = st.slider("TopN（上市成交額排序）", min_value=5, max_value=50, value=20, step=1)
 
+        # 快取命中的來源不重抓；只勾選的來源強制重抓（例如只刷新 T86）
+        refresh_sources = st.multiselect("強制重抓來源", SNAPSHOT_SOURCES, default=[])
+
         if st.button("立即更新", type="primary"):
             # 只在按鈕時抓資料，避免每次 rerun 都打 API
             with st.spinner("更新市場快照中（短 timeout + fallback，最差也會很快回來）..."):
                 target_dt = datetime(d.year, d.month, d.day, tzinfo=TZ_TPE)
-                snap = get_snapshot_cached(sess, target_dt, session=session, top_n=top_n)
+                snap = get_snapshot_cached(sess, target_dt, session=session, top_n=top_n,
+                                           refresh_sources=refresh_sources)
                 st.session_state["snapshot"] = snap
 
                 # 同步生成 payload（避免 UI 另外再跑一次）
@@ -0,0 +1,126 @@
+# date_cache.py
+# -*- coding: utf-8 -*-
+"""
+Date-Keyed Cache (process-wide / single-flight)
+
+規則
+- key 綁定交易日：過去交易日的官方資料不會再變 → 永不過期
+- 今日（或未來）→ 短 TTL（盤中/收盤前資料仍可能更新）
+- 同一 key 同時多個呼叫者 → 只發一次 request，其餘等待同一結果（single-flight）
+- fetch 丟例外 → 不快取，例外傳給所有等待者
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, Union
+
+TZ_TPE = timezone(timedelta(hours=8))
+
+DateLike = Union[str, date, datetime]
+
+
+def _today_tpe() -> date:
+    return datetime.now(TZ_TPE).date()
+
+
+def to_date(d: DateLike) -> date:
+    """接受 YYYYMMDD / YYYY-MM-DD / date / datetime"""
+    if isinstance(d, datetime):
+        return d.astimezone(TZ_TPE).date() if d.tzinfo else d.date()
+    if isinstance(d, date):
+        return d
+    s = str(d).strip()
+    if len(s) == 8 and s.isdigit():
+        return datetime.strptime(s, "%Y%m%d").date()
+    return datetime.strptime(s[:10], "%Y-%m-%d").date()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.exc: Optional[BaseException] = None
+
+
+class DateKeyedCache:
+    """
+    get_or_fetch(key, trade_date, fetch)
+    - key: 任意 hashable（通常含 endpoint 名稱 + 日期）
+    - trade_date: 決定是否為「已封存」的過去交易日
+    """
+
+    def __init__(self, today_ttl_sec: float = 300.0):
+        self.today_ttl_sec = float(today_ttl_sec)
+        self._lock = threading.Lock()
+        self._store: Dict[Hashable, Tuple[Any, Optional[float]]] = {}  # key -> (value, expires_at|None)
+        self._inflight: Dict[Hashable, _Flight] = {}
+
+    def _expiry_for(self, trade_date: DateLike) -> Optional[float]:
+        if to_date(trade_date) < _today_tpe():
+            return None
+        return time.time() + self.today_ttl_sec
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            hit = self._store.get(key)
+            if hit is None:
+                return None
+            value, exp = hit
+            if exp is not None and exp < time.time():
+                self._store.pop(key, None)
+                return None
+            return value
+
+    def get_or_fetch(
+        self,
+        key: Hashable,
+        trade_date: DateLike,
+        fetch: Callable[[], Any],
+        should_cache: Callable[[Any], bool] = lambda v: True,
+    ) -> Any:
+        with self._lock:
+            hit = self._store.get(key)
+            if hit is not None:
+                value, exp = hit
+                if exp is None or exp >= time.time():
+                    return value
+                self._store.pop(key, None)
+
+            flight = self._inflight.get(key)
+            owner = flight is None
+            if owner:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if not owner:
+            flight.done.wait()
+            if flight.exc is not None:
+                raise flight.exc
+            return flight.value
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            flight.exc = e
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+            raise
+
+        with self._lock:
+            if should_cache(value):
+                self._store[key] = (value, self._expiry_for(trade_date))
+            self._inflight.pop(key, None)
+        flight.value = value
+        flight.done.set()
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._store.clear()
+            else:
+                self._store.pop(key, None)
@@ -1,16 +1,23 @@
 # -*- coding: utf-8 -*-
-import os, io, time, random, sqlite3, requests
+import os, io, time, random, sqlite3, queue, threading
+import numpy as np
 import pandas as pd
 import yfinance as yf
+from yfinance.exceptions import YFPricesMissingError, YFTzMissingError
 from io import StringIO
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 import urllib3
 
+from http_client import shared_session
+
 # 忽略 SSL 警告 (港交所官網有時會報憑證錯誤)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Yahoo 明確回覆「沒有資料」（下市 / 停牌 / 區間內無成交）；其餘例外一律視為抓取失敗
+NO_DATA_ERRORS = (YFPricesMissingError, YFTzMissingError)
+
 # ========== 1. 環境判斷與參數設定 ==========
 MARKET_CODE = "hk-share"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -19,6 +26,29 @@ IS_GITHUB_ACTIONS = os.getenv('GITHUB_ACTIONS') == 'true'
 
 # ✅ 效能調優
 MAX_WORKERS = 3 if IS_GITHUB_ACTIONS else 5 
+BULK_CHUNK = 100      # bulk 模式：每個 yf.download 請求的代號數
+BULK_RETRIES = 3      # bulk 模式：缺漏代號的重試輪數
+HOT_START = "2020-01-01"    # hot 模式：庫中沒有該代號時的起點
+FULL_START = "2000-01-01"
+HOT_OVERLAP_DAYS = 5        # hot 模式：從高水位往回重疊天數（比對用；盤後修正直接覆寫）
+ADJ_TOLERANCE = 1e-4        # 重疊區收盤與庫存相對差超過此值 → 視為除權息/分割回溯調整，整檔重抓
+WRITE_QUEUE_MAX = 64        # 寫入佇列上限（DataFrame 個數；滿了才對下載端施加背壓）
+COMMIT_ROWS = 50_000        # 單一交易累積列數
+COMMIT_SEC = 2.0            # 或距上次 commit 秒數
+
+# 維護策略：量空頁/碎片比例才整理，不再每次 VACUUM 整個檔案
+INCR_VACUUM_RATIO = 0.05    # 空頁比例 >= 5% → incremental_vacuum（只歸還空頁，不重寫）
+FULL_VACUUM_RATIO = 0.30    # 空頁比例 >= 30% → 完整 VACUUM
+MIN_FILL_RATIO = 0.55       # stock_prices 頁面填充率 < 55%（B-tree 分裂碎片）→ 完整 VACUUM
+FULL_VACUUM_DAYS = 7        # 距上次完整 VACUUM 滿 7 天 → 例行完整 VACUUM
+
+# 寫入連線 pragma：WAL 讓讀取不擋寫入；NORMAL 在 WAL 下只在 checkpoint fsync
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+)
 
 def log(msg: str):
     print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
@@ -31,7 +61,8 @@ def init_db():
         conn.execute('''CREATE TABLE IF NOT EXISTS stock_prices (
                             date TEXT, symbol TEXT, open REAL, high REAL, 
                             low REAL, close REAL, volume INTEGER,
-                            PRIMARY KEY (date, symbol))''')
+                            PRIMARY KEY (symbol, date)) WITHOUT ROWID''')
+        _migrate_symbol_first(conn)
         conn.execute('''CREATE TABLE IF NOT EXISTS stock_info (
                             symbol TEXT PRIMARY KEY, 
                             name TEXT, 
@@ -46,9 +77,93 @@ def init_db():
             log("🔧 正在升級 HK 資料庫：新增 'market' 欄位...")
             conn.execute("ALTER TABLE stock_info ADD COLUMN market TEXT")
             conn.commit()
+        # WAL 寫在檔頭，之後所有連線沿用
+        conn.execute("PRAGMA journal_mode=WAL")
     finally:
         conn.close()
 
+def _migrate_symbol_first(conn):
+    """
+    舊庫主鍵為 (date, symbol)：查單檔歷史要掃全表
+    → 重建為 WITHOUT ROWID、主鍵 (symbol, date)（與 ohlcv_warehouse 同），單檔/高水位查詢變成索引範圍掃描
+    """
+    pk = {row[1]: row[5] for row in conn.execute("PRAGMA table_info(stock_prices)").fetchall()}
+    if pk.get('symbol') == 1:
+        return
+    log("🔧 正在升級 HK 資料庫：stock_prices 主鍵改為 (symbol, date)...")
+    # sqlite3 對 DDL 不會自動開交易 → 明確 BEGIN，建表/複製/改名全在同一交易（失敗整段回滾，不留半成品）
+    # 先清掉更早版本中斷時可能留下的 stock_prices_v2
+    with conn:
+        conn.execute("BEGIN")
+        conn.execute("DROP TABLE IF EXISTS stock_prices_v2")
+        conn.execute('''CREATE TABLE stock_prices_v2 (
+                            date TEXT, symbol TEXT, open REAL, high REAL, 
+                            low REAL, close REAL, volume INTEGER,
+                            PRIMARY KEY (symbol, date)) WITHOUT ROWID''')
+        conn.execute('''INSERT OR REPLACE INTO stock_prices_v2 (date, symbol, open, high, low, close, volume)
+                        SELECT date, symbol, open, high, low, close, volume FROM stock_prices''')
+        conn.execute("DROP TABLE stock_prices")
+        conn.execute("ALTER TABLE stock_prices_v2 RENAME TO stock_prices")
+
+def load_high_water_marks():
+    """一次 GROUP BY 取每檔最後日期 → {symbol: 'YYYY-MM-DD'}"""
+    conn = sqlite3.connect(DB_PATH, timeout=60)
+    try:
+        return dict(conn.execute("SELECT symbol, MAX(date) FROM stock_prices GROUP BY symbol").fetchall())
+    finally:
+        conn.close()
+
+def load_stored_closes(symbols, since):
+    """{symbol: {date: close}}（since 之後；hot 模式比對重疊區用）"""
+    syms = list(symbols)
+    if not syms:
+        return {}
+    conn = sqlite3.connect(DB_PATH, timeout=60)
+    try:
+        rows = conn.execute(
+            f"SELECT symbol, date, close FROM stock_prices WHERE symbol IN ({','.join('?' * len(syms))}) AND date >= ?",
+            syms + [since]).fetchall()
+    finally:
+        conn.close()
+    out = {}
+    for sym, d, c in rows:
+        out.setdefault(sym, {})[d] = c
+    return out
+
+def is_rebased(df_final, stored):
+    """
+    auto_adjust=True 的價格在除權息/分割後會整段回溯調整
+    → 重疊區任何一天的收盤與庫存不同，代表庫存整段都在舊基準上，只補尾段會在高水位處出現假跳空
+    只比對庫存高水位「之前」的 K 棒：高水位那根可能是盤中寫入的未定值（本來就會被覆寫），不能當成回溯調整
+    """
+    if not stored:
+        return False
+    hwm = max(stored)
+    for d, c in zip(df_final['date'], df_final['close']):
+        old = stored.get(d)
+        if d < hwm and old is not None and c is not None and abs(c - old) > ADJ_TOLERANCE * max(abs(old), 1e-9):
+            return True
+    return False
+
+def plan_start_dates(symbols, mode):
+    """
+    每檔下載起點
+    - full：一律 FULL_START
+    - hot：高水位 - HOT_OVERLAP_DAYS；庫中沒有 → HOT_START
+    """
+    if mode != 'hot':
+        return {s: FULL_START for s in symbols}
+    hwm = load_high_water_marks()
+    out = {}
+    for s in symbols:
+        last = hwm.get(s)
+        if last:
+            since = pd.Timestamp(last) - pd.Timedelta(days=HOT_OVERLAP_DAYS)
+            out[s] = max(since.strftime('%Y-%m-%d'), HOT_START)
+        else:
+            out[s] = HOT_START
+    return out
+
 # ========== 3. 獲取港股清單 (強化穩定性) ==========
 
 def get_hk_stock_list():
@@ -64,7 +179,7 @@ def get_hk_stock_list():
     log(f"📡 正在從港交所獲取名單...")
     try:
         # 使用 verify=False 避免 SSL 阻擋
-        r = requests.get(url, headers=headers, timeout=20, verify=False)
+        r = shared_session().get(url, headers=headers, timeout=20, verify=False)
         r.raise_for_status()
         
         # 讀取 Excel
@@ -121,44 +236,334 @@ def get_hk_stock_list():
 
 # ========== 4. 下載邏輯 ==========
 
-def download_one(args):
-    symbol, name, mode = args
-    start_date = "2020-01-01" if mode == 'hot' else "2000-01-01"
+def _to_price_rows(hist, symbol, start_date=None):
+    """yfinance 日K → stock_prices 欄位（date 為 YYYY-MM-DD 字串；只保留 start_date 之後）"""
+    hist = hist.reset_index()
+    hist.columns = [str(c).lower() for c in hist.columns]
+    if 'date' in hist.columns:
+        hist['date'] = pd.to_datetime(hist['date']).dt.tz_localize(None).dt.strftime('%Y-%m-%d')
+    df_final = hist[['date', 'open', 'high', 'low', 'close', 'volume']].dropna(subset=['close']).copy()
+    if start_date:
+        df_final = df_final[df_final['date'] >= start_date]
+    df_final['symbol'] = symbol
+    return df_final
+
+_UPSERT_SQL = ("INSERT OR REPLACE INTO stock_prices (date, open, high, low, close, volume, symbol) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+def _price_records(df_final):
+    return [(r.date, r.open, r.high, r.low, r.close, None if pd.isna(r.volume) else int(r.volume), r.symbol)
+            for r in df_final.itertuples(index=False)]
+
+def _write_prices(df_final):
+    """單次寫入（逐檔模式 / 獨立呼叫）；run_sync 內改走 PriceWriter"""
+    conn = sqlite3.connect(DB_PATH, timeout=60)
+    try:
+        with conn:
+            conn.executemany(_UPSERT_SQL, _price_records(df_final))
+    finally:
+        conn.close()
+
+class PriceWriter:
+    """
+    單一寫入執行緒
+    - 下載端只 put(DataFrame) 進有界佇列，不碰資料庫鎖
+    - 寫入端持有唯一連線，累積到 COMMIT_ROWS 列或 COMMIT_SEC 秒才 commit 一次（跨多檔的大交易）
+    - 任何例外（連線 / 轉換 / 寫入）→ 記錄錯誤並持續清空佇列（下載端不會卡在 put），close() 回報
+    - failed_symbols：沒有寫進資料庫的代號（run_sync 移進 fail_list）
+    """
+
+    _STOP = object()
+
+    def __init__(self, db_path=None, maxsize=WRITE_QUEUE_MAX, commit_rows=COMMIT_ROWS, commit_sec=COMMIT_SEC):
+        self.db_path = db_path or DB_PATH
+        self.commit_rows = commit_rows
+        self.commit_sec = commit_sec
+        self.rows_written = 0
+        self.commits = 0
+        self.error = None
+        self.failed_symbols = set()
+        self._q = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name="hk-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def put(self, df_final):
+        if df_final is not None and not df_final.empty:
+            self._q.put(df_final)
+
+    def close(self):
+        self._q.put(self._STOP)
+        self._thread.join()
+        return {"rows_written": self.rows_written, "commits": self.commits, "error": self.error,
+                "failed_symbols": sorted(self.failed_symbols)}
+
+    def _fail(self, e, symbols):
+        if self.error is None:
+            self.error = f"{type(e).__name__}: {e}"
+        self.failed_symbols.update(symbols)
+
+    def _run(self):
+        conn = None
+        buf, last_commit = [], time.time()
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            for p in WRITER_PRAGMAS:
+                conn.execute(p)
+        except Exception as e:
+            self._fail(e, ())
+
+        def flush():
+            nonlocal buf, last_commit
+            if buf:
+                try:
+                    if self.error is not None:
+                        raise RuntimeError(self.error)
+                    with conn:
+                        conn.executemany(_UPSERT_SQL, buf)
+                    self.rows_written += len(buf)
+                    self.commits += 1
+                except Exception as e:
+                    self._fail(e, {r[-1] for r in buf})
+            buf, last_commit = [], time.time()
+
+        while True:
+            try:
+                item = self._q.get(timeout=self.commit_sec)
+            except queue.Empty:
+                flush()
+                continue
+            if item is self._STOP:
+                break
+            # 整個處理都在 try 內：任何例外都不能讓寫入執行緒死掉（否則佇列滿 → 下載端與 close() 全部卡住）
+            try:
+                if self.error is not None:
+                    self.failed_symbols.update(item['symbol'].unique())
+                    continue
+                buf.extend(_price_records(item))
+                if len(buf) >= self.commit_rows or time.time() - last_commit >= self.commit_sec:
+                    flush()
+            except Exception as e:
+                try:
+                    symbols = set(item['symbol'].unique())
+                except Exception:
+                    symbols = set()
+                self._fail(e, symbols)
+        flush()
+        if conn is not None:
+            conn.close()
+
+def download_one(args, write=_write_prices, max_retries=3):
+    """
+    單檔下載；raise_errors=True 讓網路 / 限流失敗以例外浮出（預設會被 yfinance 吞成空表）
+    - NO_DATA_ERRORS 或空表 → empty；其他例外重試用盡 → error
+    """
+    symbol, name, start_date = args
     
-    max_retries = 3
     for attempt in range(max_retries):
         try:
             wait_time = random.uniform(2.0, 4.0) if IS_GITHUB_ACTIONS else random.uniform(0.2, 0.5)
             time.sleep(wait_time)
             
             tk = yf.Ticker(symbol)
-            hist = tk.history(start=start_date, timeout=25, auto_adjust=True)
+            hist = tk.history(start=start_date, timeout=25, auto_adjust=True, raise_errors=True)
             
             if hist is None or hist.empty:
                 return {"symbol": symbol, "status": "empty"}
-                
-            hist.reset_index(inplace=True)
-            hist.columns = [c.lower() for c in hist.columns]
-            if 'date' in hist.columns:
-                hist['date'] = pd.to_datetime(hist['date']).dt.tz_localize(None).dt.strftime('%Y-%m-%d')
             
-            df_final = hist[['date', 'open', 'high', 'low', 'close', 'volume']].copy()
-            df_final['symbol'] = symbol
-            
-            conn = sqlite3.connect(DB_PATH, timeout=60)
-            df_final.to_sql('stock_prices', conn, if_exists='append', index=False, 
-                            method=lambda table, conn, keys, data_iter: 
-                            conn.executemany(f"INSERT OR REPLACE INTO {table.name} ({', '.join(keys)}) VALUES ({', '.join(['?']*len(keys))})", data_iter))
-            conn.close()
+            df_final = _to_price_rows(hist, symbol, start_date)
+            if start_date != FULL_START and is_rebased(df_final, load_stored_closes([symbol], start_date).get(symbol)):
+                # 回溯調整 → 改抓完整歷史，整段換成新基準
+                log(f"♻️ {symbol} 價格基準變動，重抓完整歷史")
+                return download_one((symbol, name, FULL_START), write)
+            write(df_final)
             
             return {"symbol": symbol, "status": "success"}
+        except NO_DATA_ERRORS:
+            return {"symbol": symbol, "status": "empty"}
         except Exception:
             if attempt < max_retries - 1:
                 time.sleep(random.uniform(5, 12))
                 continue
             return {"symbol": symbol, "status": "error"}
 
-def run_sync(mode='hot'):
+def download_chunk(symbols, start_date):
+    """
+    一次 yf.download 抓多檔 → {symbol: 日K}（只含真的有 K 棒的代號）；整包請求失敗直接 raise
+    沒有 K 棒的代號無法從回應判斷原因：yfinance 會把單檔例外換成全 NaN 欄位，和下市代號長得一樣
+    """
+    raw = yf.download(symbols, start=start_date, interval="1d", auto_adjust=True,
+                      group_by="ticker", threads=True, progress=False, timeout=25)
+    out = {}
+    if raw is None or raw.empty:
+        return out
+    if not isinstance(raw.columns, pd.MultiIndex):
+        # 單一代號時 yfinance 回傳單層欄位
+        raw = pd.concat({symbols[0]: raw}, axis=1)
+    tickers = set(raw.columns.get_level_values(0))
+    for s in symbols:
+        if s not in tickers:
+            continue
+        hist = raw[s].dropna(how='all')
+        if not hist.empty and hist['Close'].notna().any():
+            out[s] = hist
+    return out
+
+def download_bulk(args, write=_write_prices):
+    """
+    bulk 模式：一個 chunk 一個請求，在記憶體中拆成各檔寫入
+    只重試缺漏的代號；重試用盡後仍缺的代號逐檔以 download_one 確認（單次，不再重試）：
+    例外 → error（進 fail_list）；Yahoo 回覆沒有資料 → empty（下市/停牌）；有 K 棒 → 照常寫入
+    """
+    symbols, start_date = args
+    results = {}
+    pending = list(symbols)
+    rebased = []
+    
+    for attempt in range(BULK_RETRIES):
+        if not pending:
+            break
+        try:
+            time.sleep(random.uniform(1.0, 2.0) if IS_GITHUB_ACTIONS else random.uniform(0.1, 0.3))
+            got = download_chunk(pending, start_date)
+        except Exception:
+            if attempt < BULK_RETRIES - 1:
+                time.sleep(random.uniform(5, 12))
+            continue
+        
+        frames = {s: _to_price_rows(hist, s, start_date) for s, hist in got.items()}
+        if start_date != FULL_START:
+            stored = load_stored_closes(list(frames), start_date)
+            for s in [s for s, df in frames.items() if is_rebased(df, stored.get(s))]:
+                rebased.append(s)
+                del frames[s]
+        if frames:
+            write(pd.concat(frames.values(), ignore_index=True))
+        for s in got:
+            results[s] = "success"
+        pending = [s for s in pending if s not in got]
+        if pending and attempt < BULK_RETRIES - 1:
+            time.sleep(random.uniform(2, 5))
+    
+    for s in pending:
+        results[s] = download_one((s, None, start_date), write, max_retries=1)["status"]
+    if rebased:
+        # 回溯調整過的代號：改抓完整歷史（FULL_START 不再比對，不會遞迴）
+        log(f"♻️ {len(rebased)} 檔價格基準變動，重抓完整歷史")
+        for r in download_bulk((rebased, FULL_START), write):
+            results[r["symbol"]] = r["status"]
+    return [{"symbol": s, "status": results[s]} for s in symbols]
+
+# ========== 5. 資料庫維護 ==========
+
+def _fill_ratio(conn):
+    """stock_prices 頁面實際使用比例（需 SQLite 編譯含 dbstat；沒有 → None）"""
+    try:
+        used, size = conn.execute(
+            "SELECT SUM(pgsize - unused), SUM(pgsize) FROM dbstat WHERE name = 'stock_prices'").fetchone()
+        return (used / size) if size else None
+    except sqlite3.Error:
+        return None
+
+def maintain_db(db_path=None, now=None):
+    """
+    依空頁 / 碎片比例決定整理方式（回傳量測值與採取的動作）
+    - full：空頁 >= FULL_VACUUM_RATIO、填充率 < MIN_FILL_RATIO、或距上次完整 VACUUM >= FULL_VACUUM_DAYS
+    - incremental：空頁 >= INCR_VACUUM_RATIO 且 auto_vacuum=INCREMENTAL
+    - 其他 → skip
+    舊庫 auto_vacuum 不是 INCREMENTAL → 先設定，於下一次完整 VACUUM 生效
+    """
+    now = now or datetime.now()
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=60)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS db_maintenance (task TEXT PRIMARY KEY, ran_at TEXT)")
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        free_ratio = freelist / page_count if page_count else 0.0
+        fill = _fill_ratio(conn)
+        row = conn.execute("SELECT ran_at FROM db_maintenance WHERE task = 'full_vacuum'").fetchone()
+        last_full = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S") if row else None
+        
+        if auto_vacuum != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        
+        due = last_full is None or (now - last_full).days >= FULL_VACUUM_DAYS
+        if free_ratio >= FULL_VACUUM_RATIO or (fill is not None and fill < MIN_FILL_RATIO) or due:
+            action = "full"
+            conn.execute("VACUUM")
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO db_maintenance (task, ran_at) VALUES ('full_vacuum', ?)",
+                             (now.strftime("%Y-%m-%d %H:%M:%S"),))
+        elif free_ratio >= INCR_VACUUM_RATIO and auto_vacuum == 2:
+            action = "incremental"
+            # executescript 會把 pragma step 到底；execute 只 step 一次 → 每次只歸還一頁
+            conn.executescript("PRAGMA incremental_vacuum;")
+        else:
+            action = "skip"
+        if action != "skip":
+            # WAL 內容併回主檔並截斷，檔案大小才會真的縮小
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {"action": action, "page_count": page_count, "freelist": freelist,
+                "free_ratio": round(free_ratio, 4), "fill_ratio": None if fill is None else round(fill, 4)}
+    finally:
+        conn.close()
+
+# ========== 6. 讀取 API ==========
+
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+def _bars_from_rows(rows):
+    """[(date, o, h, l, c, v), ...] → {"date": datetime64[D], "open"...: float64}"""
+    if not rows:
+        return {"date": np.array([], dtype='datetime64[D]'), **{f: np.array([], dtype=float) for f in BAR_FIELDS}}
+    cols = list(zip(*rows))
+    out = {"date": np.array(cols[0], dtype='datetime64[D]')}
+    for f, col in zip(BAR_FIELDS, cols[1:]):
+        out[f] = np.array(col, dtype=float)
+    return out
+
+def read_bars(symbol, start=None, end=None, db_path=None):
+    """單檔日K（主鍵範圍掃描）→ {"date", "open", "high", "low", "close", "volume"} NumPy 陣列，依日期遞增"""
+    return read_bars_many([symbol], start, end, db_path).get(symbol) or _bars_from_rows([])
+
+def read_bars_many(symbols, start=None, end=None, db_path=None):
+    """
+    多檔日K，一次查詢 → {symbol: bars}（庫中沒有的代號不回傳）
+    start / end 為 'YYYY-MM-DD'（含），None 表示不限
+    """
+    syms = list(dict.fromkeys(s for s in symbols if s))
+    if not syms:
+        return {}
+    q = (f"SELECT symbol, date, open, high, low, close, volume FROM stock_prices "
+         f"WHERE symbol IN ({','.join('?' * len(syms))})")
+    args = list(syms)
+    if start:
+        q += " AND date >= ?"
+        args.append(str(start))
+    if end:
+        q += " AND date <= ?"
+        args.append(str(end))
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=60)
+    try:
+        rows = conn.execute(q + " ORDER BY symbol, date", args).fetchall()
+    finally:
+        conn.close()
+    out = {}
+    i = 0
+    while i < len(rows):
+        j = i
+        while j < len(rows) and rows[j][0] == rows[i][0]:
+            j += 1
+        out[rows[i][0]] = _bars_from_rows([r[1:] for r in rows[i:j]])
+        i = j
+    return out
+
+# ========== 7. 同步主流程 ==========
+
+def run_sync(mode='hot', bulk=True, chunk_size=BULK_CHUNK):
     start_time = time.time()
     init_db()
     
@@ -166,23 +571,54 @@ def run_sync(mode='hot'):
     if not items:
         return {"fail_list": [], "success": 0, "has_changed": False}
 
-    log(f"🚀 開始港股同步 | 目標: {len(items)} 檔")
+    log(f"🚀 開始港股同步 | 目標: {len(items)} 檔 | {'bulk x' + str(chunk_size) if bulk else '逐檔'}")
 
     stats = {"success": 0, "empty": 0, "error": 0}
     fail_list = []
+
+    def tally(res):
+        s = res.get("status", "error")
+        stats[s if s in stats else 'error'] += 1
+        if s == "error": fail_list.append(res.get("symbol"))
     
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_one, (it[0], it[1], mode)): it[0] for it in items}
-        for f in tqdm(as_completed(futures), total=len(items), desc="HK同步"):
-            res = f.result()
-            s = res.get("status", "error")
-            stats[s if s in stats else 'error'] += 1
-            if s == "error": fail_list.append(res.get("symbol"))
-
-    log("🧹 資料庫 VACUUM...")
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("VACUUM")
-    conn.close()
+    # hot：依高水位決定每檔起點，同起點的代號才併進同一個請求
+    starts = plan_start_dates([it[0] for it in items], mode)
+    groups = {}
+    for it in items:
+        groups.setdefault(starts[it[0]], []).append(it[0])
+    if mode == 'hot':
+        log(f"📐 高水位分組：{len(groups)} 個起點（最早 {min(groups)}）")
+    
+    writer = PriceWriter().start()
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            if bulk:
+                chunks = [(since, syms[i:i + chunk_size])
+                          for since, syms in sorted(groups.items()) for i in range(0, len(syms), chunk_size)]
+                futures = [executor.submit(download_bulk, (c, since), writer.put) for since, c in chunks]
+                with tqdm(total=len(items), desc="HK同步") as bar:
+                    for f in as_completed(futures):
+                        for res in f.result():
+                            tally(res)
+                            bar.update(1)
+            else:
+                futures = {executor.submit(download_one, (it[0], it[1], starts[it[0]]), writer.put): it[0] for it in items}
+                for f in tqdm(as_completed(futures), total=len(items), desc="HK同步"):
+                    tally(f.result())
+    finally:
+        wstats = writer.close()
+    log(f"💾 寫入 {wstats['rows_written']} 列 / {wstats['commits']} 次 commit")
+    if wstats['error']:
+        # 下載成功但沒寫進資料庫的代號 → 視為失敗
+        lost = [sym for sym in wstats['failed_symbols'] if sym not in fail_list]
+        stats['success'] -= len(lost)
+        stats['error'] += len(lost)
+        fail_list.extend(lost)
+        log(f"❌ 寫入失敗：{wstats['error']}（{len(wstats['failed_symbols'])} 檔未寫入）")
+
+    m = maintain_db()
+    fill = "n/a" if m['fill_ratio'] is None else f"{m['fill_ratio']:.0%}"
+    log(f"🧹 資料庫維護：{m['action']}（空頁 {m['free_ratio']:.1%}、填充率 {fill}）")
 
     duration = (time.time() - start_time) / 60
     log(f"📊 同步完成！費時: {duration:.1f} 分鐘")
@@ -192,7 +628,9 @@ def run_sync(mode='hot'):
         "error": stats['error'],
         "total": len(items),
         "fail_list": fail_list,
-        "has_changed": stats['success'] > 0
+        "rows_written": wstats['rows_written'],
+        "write_error": wstats['error'],
+        "has_changed": wstats['rows_written'] > 0
     }
 
 if __name__ == "__main__":
@@ -1,80 +1,513 @@
-# 只列出修改重點區塊，其餘保留
+# downloader_tw.py
+# -*- coding: utf-8 -*-
+"""
+TW Data-Layer Engine — main.py / workflow_master.py 的單一快照入口
 
-# ------------- 修正 1：market amount -------------
-def get_market_amount_safe() -> Dict[str, Any]:
+入口
+- build_snapshot(target_dt, session_name=, top_n=)：workflow_master（recency / integrity / market_amount / twii / top）
+- build_v203_min_json(snapshot=, system_params=, portfolio=, monitoring=, session=)：Arbiter payload
+- get_market_snapshot(target_iso, session=, topn=)：main.py（macro.overview / audit / arb_input）
+- get_twii_with_fallback(trade_date)：TWII 收盤（twii_provider 多來源競速）
+
+來源（同一個 executor 一次發出，整體 deadline_sec 截止；每個來源各自 fallback chain）
+- TWII：get_twii_with_fallback
+- MARKET_AMOUNT：MarketAmountProvider（TWSE STOCK_DAY_ALL/FMTQIK × TPEX ST43/比例估算/保守常數）
+- T86：TWSE T86 → FinMind 市場法人淨額
+- TOPN：stock_layer（快取 STOCK_DAY_ALL + 倉庫技術面 + T86 個股法人；等 T86 落地後才 join）
+        → analyzer.build_topn_by_turnover（STOCK_DAY_ALL / OpenAPI + yfinance）
+- MACRO_RISK：倉庫 ^TWII 2y → SMR（indicator_state）、^VIX
+
+快取
+- snapshot_cache，key = (有效交易日, session, topN)；與 topN 無關的來源 topN 固定 0
+- 只快取主來源成功的結果（降級結果下次自動重抓，有機會升級）
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+import requests
+
+from date_cache import TZ_TPE, to_date
+from endpoint_health import default_ledger
+from http_client import shared_session, verify_policy
+from indicator_state import sync_state
+from market_amount import MarketAmountProvider
+from ohlcv_warehouse import default_warehouse
+from snapshot_cache import default_snapshot_cache
+from stock_layer import build_stock_layer, save_t86_net, t86_net_by_code
+from tw_parse import column_values, int_sum, resolve_column
+from twii_provider import default_twii_provider
+
+EOD_PUBLISH_HHMM = (15, 30)
+DEADLINE_SEC = 45.0
+T86_URL = "https://www.twse.com.tw/rwd/zh/fund/T86"
+
+_PROVIDER: Optional[MarketAmountProvider] = None
+_PROVIDER_LOCK = threading.Lock()
+
+
+def now_tpe() -> datetime:
+    return datetime.now(TZ_TPE)
+
+
+def _ms(t0: float) -> int:
+    return int((time.time() - t0) * 1000)
+
+
+def _amount_provider() -> MarketAmountProvider:
+    global _PROVIDER
+    with _PROVIDER_LOCK:
+        if _PROVIDER is None:
+            _PROVIDER = MarketAmountProvider()
+        return _PROVIDER
+
+
+def resolve_trade_date(target_dt: datetime, session: str, now: Optional[datetime] = None) -> Tuple[date, bool]:
+    """
+    EOD guard：目標日為今日且 15:30 前 → 資料未公布，回退前一日；週末 → 回退到週五
+    回傳 (有效交易日, is_using_previous_day)
+    """
+    t = now or now_tpe()
+    target = to_date(target_dt)
+    d = target
+    if session.upper() == "EOD" and d >= t.date() and (t.hour, t.minute) < EOD_PUBLISH_HHMM:
+        d = t.date() - timedelta(days=1)
+    while d.weekday() >= 5:
+        d -= timedelta(days=1)
+    return d, d != target
+
+
+# =========================
+# TWII
+# =========================
+def get_twii_with_fallback(trade_date: Any, deadline_sec: Optional[float] = None) -> Dict[str, Any]:
+    """
+    twii_provider 競速（TWSE MI_INDEX / yfinance 倉庫 / Stooq / 倉庫磁碟）；結果依交易日快取在行程內
+    回傳 {"ok", "data": {date, close, chg, chg_pct, prev_close, chg_pct_prev}, "source", "error", "stale", "latency_ms"}
+    """
+    return default_twii_provider().get(to_date(trade_date), deadline_sec=deadline_sec)
+
+
+# =========================
+# T86
+# =========================
+def fetch_twse_t86(sess: requests.Session, trade_date_yyyymmdd: str, timeout: Any = (2, 3)) -> Dict[str, Any]:
+    """
+    TWSE T86（三大法人）- 回傳 summary（穩定/輕量）；個股買賣超同時落地給 stock_layer
+    """
+    params = {"response": "json", "date": trade_date_yyyymmdd, "selectType": "ALL"}
+
+    def get_json() -> Dict[str, Any]:
+        r = sess.get(T86_URL, params=params, timeout=timeout, verify=verify_policy(True))
+        r.raise_for_status()
+        return r.json()
+
+    # 端點熔斷中 → 直接丟 CircuitOpenError（不付 timeout）
+    j = default_ledger().call("TWSE_T86", get_json)
+
+    rows = j.get("data") or []
+    fields = j.get("fields") or []
+    if not rows or not fields:
+        raise RuntimeError("T86_EMPTY")
+
+    # 欄位名稱可能會變，做關鍵字匹配
+    # 常見欄位口徑（股數/張數口徑；你 UI 目前只顯示「買超 xx 億」那是金額口徑，這裡先以淨買賣超合計數字呈現）
+    cols = {
+        "外資": resolve_column(fields, ["外", "買賣超"]),
+        "投信": resolve_column(fields, ["投信", "買賣超"]),
+        # 「外陸資買賣超股數(不含外資自營商)」也含「自營商」字樣 → 排除「外」
+        "自營商": resolve_column(fields, ["自營商", "買賣超"], exclude=["外"]),
+        "合計": resolve_column(fields, ["三大法人", "買賣超"]),
+    }
+
+    # 每欄一次向量化解析（"--"/空值視為 0）
+    summary = {}
+    for label, idx in cols.items():
+        if idx is not None:
+            summary[label] = int_sum(column_values(rows, idx))
+
+    # 個股三大法人買賣超落地（stock_layer 的 TopN 法人欄位只讀本地）
+    save_t86_net(trade_date_yyyymmdd, t86_net_by_code(fields, rows))
+
+    return {"summary": summary, "asof": trade_date_yyyymmdd}
+
+
+def get_t86_with_fallback(trade_day: date) -> Dict[str, Any]:
+    """TWSE T86 → FinMind 市場法人淨額（A=三大法人、B=外資；金額口徑）"""
+    t0 = time.time()
+    yyyymmdd = trade_day.strftime("%Y%m%d")
+    errors = []
+    try:
+        out = fetch_twse_t86(shared_session(retries=1), yyyymmdd, timeout=(3, 8))
+        return {"ok": True, "source": "TWSE_T86", "error": None, "latency_ms": _ms(t0), **out}
+    except Exception as e:
+        errors.append(f"TWSE_T86:{type(e).__name__}:{e}")
+    try:
+        from finmind_institutional import fetch_finmind_market_inst_net_ab
+
+        ab = fetch_finmind_market_inst_net_ab(trade_day.isoformat(), token=os.getenv("FINMIND_TOKEN") or None)
+        if not (ab.get("A") or ab.get("B")):
+            raise RuntimeError("FINMIND_EMPTY")
+        return {"ok": True, "source": "FINMIND_TOTAL_INST", "error": " | ".join(errors), "latency_ms": _ms(t0),
+                "summary": {"合計": ab.get("A"), "外資": ab.get("B")}, "asof": yyyymmdd}
+    except Exception as e:
+        errors.append(f"FINMIND:{type(e).__name__}:{e}")
+    return {"ok": False, "source": "FAIL", "error": " | ".join(errors), "latency_ms": _ms(t0),
+            "summary": {}, "asof": yyyymmdd}
+
+
+# =========================
+# Market amount / TopN / macro risk
+# =========================
+def _tpex_tier(source_tpex: str) -> Optional[int]:
+    s = source_tpex or ""
+    if "ST43" in s:
+        return 1
+    if "RATIO_ESTIMATE" in s:
+        return 2
+    if "SAFE_CONSTANT" in s:
+        return 3
+    return None
+
+
+def get_market_amount(trade_day: date) -> Dict[str, Any]:
+    t0 = time.time()
+    try:
+        out = _amount_provider().fetch(datetime(trade_day.year, trade_day.month, trade_day.day, tzinfo=TZ_TPE),
+                                       concurrent=True)
+    except Exception as e:
+        out = {"amount_twse": None, "amount_tpex": None, "amount_total": None,
+               "source_twse": f"TWSE_FAIL:{type(e).__name__}", "source_tpex": f"TPEX_FAIL:{type(e).__name__}",
+               "status_twse": "FAIL", "status_tpex": "FAIL", "audit_modules": []}
+    out["tpex_tier"] = _tpex_tier(out.get("source_tpex"))
+    # 與 app.py 的 error_twse 同口徑：TWSE 成功 → None；失敗 → 各層錯誤（沒有 → source_twse）
+    tier_errors = [f"{m.get('name')}:{m.get('error')}" for m in out.get("audit_modules") or []
+                   if str(m.get("name", "")).startswith("TWSE") and m.get("error")]
+    out["error_twse"] = None if out.get("status_twse") == "OK" else (" | ".join(tier_errors) or out.get("source_twse"))
+    out["latency_ms"] = _ms(t0)
+    return out
+
+
+def _top_rows(stocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{"code": str(s["Symbol"]).replace(".TW", ""), "name": s.get("Name"), "close": s.get("Price"),
+             "trade_value": s.get("TradeValue"), "rank": s.get("rank")} for s in stocks]
+
+
+def get_topn_with_fallback(trade_day: date, top_n: int) -> Dict[str, Any]:
+    """stock_layer（本地快取）→ analyzer.build_topn_by_turnover（網路 + yfinance）"""
+    t0 = time.time()
+    stocks, audit = build_stock_layer(trade_day.strftime("%Y%m%d"), top_n, session=shared_session(retries=1),
+                                      verify=verify_policy(True), timeout=(3, 10))
+    if stocks:
+        return {"ok": True, "source": "STOCK_LAYER", "error": None, "stocks": stocks, "rows": _top_rows(stocks),
+                "inst_status": audit.get("inst_status"), "latency_ms": _ms(t0)}
+    errors = [f"STOCK_LAYER:{audit.get('error')}"]
+    try:
+        from analyzer import build_topn_by_turnover
+
+        df, meta = build_topn_by_turnover(top_n, verify_ssl=True, trade_date=trade_day)
+        if df.empty:
+            raise RuntimeError(meta.get("error") or "TOPN_EMPTY")
+        stocks = [{
+            "Symbol": r["symbol"], "Name": r.get("name"), "Price": r.get("close"), "rank": int(r["rank"]),
+            "TradeValue": None,
+            "institutional": {"inst_status": "UNAVAILABLE", "inst_net_1d": None, "inst_net_3d": None, "inst_days": 0},
+            "risk": {"stop_distance_pct": None, "atr14": None},
+            "signals": {"ret20_pct": r.get("ret20_pct"), "vol_ratio": r.get("vol_ratio"),
+                        "ma_bias_pct": r.get("ma_bias_pct"), "tech_date": r.get("date")},
+        } for r in df.to_dict("records")]
+        return {"ok": True, "source": f"ANALYZER_{meta.get('source')}", "error": errors[0], "stocks": stocks,
+                "rows": _top_rows(stocks), "inst_status": "UNAVAILABLE", "latency_ms": _ms(t0)}
+    except Exception as e:
+        errors.append(f"ANALYZER:{type(e).__name__}:{e}")
+    return {"ok": False, "source": "FAIL", "error": " | ".join(errors), "stocks": [], "rows": [],
+            "inst_status": "UNAVAILABLE", "latency_ms": _ms(t0)}
+
+
+def get_macro_risk(trade_day: date) -> Dict[str, Any]:
+    """SMR（MA200 乖離，indicator_state）+ VIX（trade_day 以前最後一筆）；各自失敗 → None"""
+    t0 = time.time()
+    out: Dict[str, Any] = {"ok": False, "smr": None, "smr_ma5": None, "slope5": None, "vix": None, "error": None}
+    cutoff = pd.Timestamp(trade_day)
+    errors = []
+    try:
+        daily = default_warehouse().history("^TWII", "2y")
+        st = sync_state(daily[daily.index <= cutoff], "^TWII", path=None)
+        out.update({"smr": st.smr, "smr_ma5": st.smr_ma5, "slope5": st.slope5})
+    except Exception as e:
+        errors.append(f"SMR:{type(e).__name__}")
+    try:
+        vix = default_warehouse().history("^VIX", "1mo")["Close"].dropna()
+        vix = vix[vix.index <= cutoff]
+        out["vix"] = float(vix.iloc[-1]) if len(vix) else None
+    except Exception as e:
+        errors.append(f"VIX:{type(e).__name__}")
+    out["ok"] = out["smr"] is not None and out["vix"] is not None
+    out["error"] = " | ".join(errors) or None
+    out["latency_ms"] = _ms(t0)
+    return out
+
+
+# =========================
+# Snapshot
+# =========================
+def _fan_out(tasks: Dict[str, Callable[[], Dict[str, Any]]], deadline_sec: float) -> Dict[str, Dict[str, Any]]:
+    """所有來源一次送出；deadline 到仍未完成 → ok=False / TIMEOUT（不等它們結束）"""
+    ex = ThreadPoolExecutor(max_workers=max(1, len(tasks)), thread_name_prefix="dl-tw")
+    try:
+        futs = {tag: ex.submit(fn) for tag, fn in tasks.items()}
+        wait(list(futs.values()), timeout=deadline_sec)
+        out = {}
+        for tag, fut in futs.items():
+            if not fut.done():
+                out[tag] = {"ok": False, "source": "TIMEOUT", "error": f"DEADLINE_{deadline_sec:.0f}S"}
+            elif fut.exception() is not None:
+                out[tag] = {"ok": False, "source": "FAIL", "error": f"{type(fut.exception()).__name__}: {fut.exception()}"}
+            else:
+                out[tag] = fut.result()
+        return out
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)
+
+
+def _audit_module(name: str, pack: Dict[str, Any], from_cache: bool) -> Dict[str, Any]:
     return {
-        "amount_twse": None,
-        "amount_tpex": None,
-        "amount_total": None,
-        "source_twse": "FAIL",
-        "source_tpex": "FAIL",
+        "name": name,
+        "status": "OK" if pack.get("ok") else "FAIL",
+        "source": pack.get("source"),
+        "error": pack.get("error"),
+        "latency_ms": pack.get("latency_ms"),
+        "from_cache": from_cache,
     }
 
 
-# ------------- 修正 2：產生最小股票宇宙 -------------
-def build_minimal_universe(topn: int) -> List[Dict[str, Any]]:
-    # 暫時產生 TopN 假代碼（避免 empty_universe）
-    # 之後你可接真實成交額排序
-    universe = []
-    for i in range(topn):
-        universe.append({
-            "symbol": f"MOCK{i+1:03d}",
-            "close": None,
-            "volume": None,
-            "integrity_ok": False
-        })
-    return universe
+def build_snapshot(target_dt: datetime, session_name: str = "EOD", top_n: int = 20,
+                   deadline_sec: float = DEADLINE_SEC) -> Dict[str, Any]:
+    """
+    市場快照（workflow_master 讀 twii / market_amount / recency / integrity / trade_date_iso；
+    verify_integrity --snapshot 讀 top.rows）
+    """
+    session = (session_name or "EOD").upper()
+    trade_day, is_prev = resolve_trade_date(target_dt, session)
+    trade_iso = trade_day.isoformat()
+    cache = default_snapshot_cache()
+
+    def key(source: str) -> Tuple[str, str, int]:
+        return (trade_iso, session, int(top_n) if source == "TOPN_STOCKS" else 0)
+
+    # 主來源成功才快取（fallback / 估算結果不快取，下次重抓有機會升級）
+    primary_ok = {
+        "TWII_CLOSE": lambda v: bool(v.get("ok")) and not v.get("stale"),
+        "MARKET_AMOUNT": lambda v: v.get("status_twse") == "OK" and v.get("tpex_tier") == 1,
+        "T86_SUMMARY": lambda v: v.get("source") == "TWSE_T86",
+        "TOPN_STOCKS": lambda v: v.get("source") == "STOCK_LAYER" and v.get("inst_status") == "OK",
+        "MACRO_RISK": lambda v: bool(v.get("ok")),
+    }
+    hits = {src: cache.peek(key(src), src) for src in primary_ok}
 
+    t86_done = threading.Event()
 
-# ------------- 修正 3：build_snapshot -------------
+    def t86_task() -> Dict[str, Any]:
+        try:
+            return get_t86_with_fallback(trade_day)
+        finally:
+            t86_done.set()
 
-def build_snapshot(session: str, target_date: str, topn: int) -> Dict[str, Any]:
+    def topn_task() -> Dict[str, Any]:
+        # 個股法人由 T86 落地檔 join → 等 T86 完成（或逾時）再組 TopN
+        t86_done.wait(timeout=deadline_sec * 0.5)
+        return get_topn_with_fallback(trade_day, int(top_n))
 
-    meta = {
-        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-        "session": session,
-        "effective_trade_date": target_date,
+    fetchers: Dict[str, Callable[[], Dict[str, Any]]] = {
+        "TWII_CLOSE": lambda: get_twii_with_fallback(trade_day),
+        "MARKET_AMOUNT": lambda: get_market_amount(trade_day),
+        "T86_SUMMARY": t86_task,
+        "TOPN_STOCKS": topn_task,
+        "MACRO_RISK": lambda: get_macro_risk(trade_day),
     }
+    if hits["T86_SUMMARY"] is not None:
+        t86_done.set()
+    fresh = _fan_out({src: fn for src, fn in fetchers.items() if hits[src] is None}, deadline_sec)
 
-    twii = get_twii_with_fallback(target_date)
-    amt = get_market_amount_safe()
+    packs: Dict[str, Dict[str, Any]] = {}
+    audit_modules: List[Dict[str, Any]] = []
+    for src, ok in primary_ok.items():
+        if hits[src] is not None:
+            packs[src] = hits[src]["value"]
+        else:
+            packs[src] = fresh[src]
+            if ok(packs[src]):
+                cache.put(key(src), src, packs[src], {"status": "OK"})
+        audit_modules.append(_audit_module(src, packs[src] if src != "MARKET_AMOUNT" else {
+            "ok": packs[src].get("status_twse") == "OK", "source": packs[src].get("source_twse"),
+            "error": packs[src].get("error_twse"), "latency_ms": packs[src].get("latency_ms"),
+        }, hits[src] is not None))
 
-    stocks = build_minimal_universe(topn)
+    twii, amt, t86, top, risk = (packs[s] for s in primary_ok)
+    ma = {k: amt.get(k) for k in ("amount_twse", "amount_tpex", "amount_total", "source_twse", "source_tpex",
+                                 "status_twse", "status_tpex", "confidence_twse", "confidence_tpex", "tpex_tier")}
 
-    macro = {
-        "overview": {
-            "trade_date": target_date,
-            "twii_close": twii["close"],
-            "twii_chg": twii["chg"],
-            "twii_pct": twii["pct"],
+    return {
+        "meta": {
+            "timestamp": now_tpe().strftime("%Y-%m-%d %H:%M:%S"),
+            "session": session,
+            "target_date": to_date(target_dt).isoformat(),
+            "effective_trade_date": trade_iso,
+            "is_using_previous_day": bool(is_prev),
+        },
+        "trade_date_iso": trade_iso,
+        "recency": {
+            "target_date": to_date(target_dt).isoformat(),
+            "effective_trade_date": trade_iso,
+            "is_using_previous_day": bool(is_prev),
         },
-        "market_amount": amt,
-        "institutional": None
+        "twii": twii,
+        "market_amount": ma,
+        "t86": t86,
+        "top": {k: top.get(k) for k in ("ok", "source", "error", "rows", "inst_status")},
+        "stocks": top.get("stocks") or [],
+        "macro_risk": risk,
+        "integrity": {
+            "twii_ok": bool(twii.get("ok")),
+            "twse_amount_ok": amt.get("status_twse") == "OK",
+            "tpex_tier": amt.get("tpex_tier"),
+            "top_ok": bool(top.get("ok")),
+            "t86_ok": bool(t86.get("ok")),
+            # 各主來源都符合 primary_ok（= 全部可快取的結果）→ 整包快照可定案
+            "complete": all(ok(packs[src]) for src, ok in primary_ok.items()),
+        },
+        "audit_modules": audit_modules + list(amt.get("audit_modules") or []),
     }
 
-    audit = {
-        "TWII": twii,
-        "MARKET_AMOUNT": amt,
-        "INSTITUTIONAL": {
-            "source": "NOT_IMPLEMENTED",
-            "error": "DATA_NOT_FETCHED"
+
+# =========================
+# Payload
+# =========================
+def build_v203_min_json(
+    snapshot: Dict[str, Any],
+    system_params: Optional[Dict[str, Any]] = None,
+    portfolio: Optional[Dict[str, Any]] = None,
+    monitoring: Optional[Dict[str, Any]] = None,
+    session: str = "EOD",
+) -> Dict[str, Any]:
+    """
+    V20.3 最小 payload（l1_gate / UCCEngine 讀的欄位）
+    - TWII + 上市成交額都在 → NORMAL/HIGH（其餘缺 → MEDIUM）；否則 DEGRADED/LOW（避免 F3 LOW+NORMAL）
+    - daily_return_pct 以小數表示（-0.03 = -3%）
+    """
+    integ = snapshot.get("integrity") or {}
+    twii = (snapshot.get("twii") or {}).get("data") or {}
+    ma = snapshot.get("market_amount") or {}
+    risk = snapshot.get("macro_risk") or {}
+    rec = snapshot.get("recency") or {}
+
+    core_ok = bool(integ.get("twii_ok")) and bool(integ.get("twse_amount_ok"))
+    all_ok = core_ok and bool(integ.get("top_ok")) and bool(integ.get("t86_ok")) and integ.get("tpex_tier") == 1
+
+    def frac(pct: Any) -> Optional[float]:
+        return None if pct is None else round(float(pct) / 100.0, 6)
+
+    return {
+        "meta": {
+            "timestamp": now_tpe().strftime("%Y-%m-%d %H:%M:%S"),
+            "session": (session or "EOD").upper(),
+            "market_status": "NORMAL" if core_ok else "DEGRADED",
+            "confidence_level": "HIGH" if all_ok else ("MEDIUM" if core_ok else "LOW"),
+            "is_using_previous_day": bool(rec.get("is_using_previous_day")),
+            "effective_trade_date": rec.get("effective_trade_date") or snapshot.get("trade_date_iso"),
+            "war_time_override": False,
+            "audit_modules": snapshot.get("audit_modules") or [],
         },
-        "UNIVERSE": {
-            "count": len(stocks),
-            "mock": True
-        }
+        "macro": {
+            "integrity": {"kill": False},
+            "overview": {
+                "trade_date": twii.get("date"),
+                "twii_close": twii.get("close"),
+                "twii_chg": twii.get("chg"),
+                "twii_chg_pct": twii.get("chg_pct"),
+                "daily_return_pct": frac(twii.get("chg_pct")),
+                "daily_return_pct_prev": frac(twii.get("chg_pct_prev")),
+                "SMR": risk.get("smr"),
+                "smr": risk.get("smr"),
+                "Slope5": risk.get("slope5"),
+                "vix": risk.get("vix"),
+                "max_equity_allowed_pct": 0.05,
+            },
+            "market_amount": {k: ma.get(k) for k in ("amount_twse", "amount_tpex", "amount_total",
+                                                     "source_twse", "source_tpex")},
+            "institutional": (snapshot.get("t86") or {}).get("summary") or {},
+        },
+        "portfolio": dict(portfolio or {"equity": 2_000_000, "drawdown_pct": 0.0, "loss_streak": 0, "alpha_prev": 0.0}),
+        "monitoring": dict(monitoring or {"regime_predictive_score": 0.5, "regime_outcome_score": 0.5,
+                                          "trade_count_20d": 0}),
+        "system_params": dict(system_params or {
+            "k_regime": 1.2,
+            "lambda_drawdown": 2.0,
+            "max_loss_per_trade_pct": 0.02,
+            "l1_price_min": 1,
+            "l1_price_max": 5000,
+            "l1_price_median_mult_hi": 50,
+            "prev_day_allocation_scale": 0.70,
+        }),
+        "stocks": snapshot.get("stocks") or [],
     }
 
-    arb_input = {
-        "meta": meta,
-        "macro": macro,
-        "stocks": stocks,
-    }
 
+def snapshot_usable(snapshot: Dict[str, Any]) -> bool:
+    """L1 關鍵欄位齊全（TWII + 上市成交額）且 TWII 不是 stale 備案"""
+    snapshot = snapshot or {}
+    integ = snapshot.get("integrity") or {}
+    return (bool(integ.get("twii_ok")) and bool(integ.get("twse_amount_ok"))
+            and not (snapshot.get("twii") or {}).get("stale"))
+
+
+def snapshot_status(snapshot: Dict[str, Any]) -> str:
+    """
+    整包快照的快取狀態（main.py / workflow_master / prefetch_daemon 通用；snapshot_cache 依此決定）
+    - OK：各主來源都成功（integrity.complete）→ 可定案
+    - PARTIAL：L1 可用但 T86 / TopN / TPEX 等有降級 → 只快取 TTL，之後重抓升級
+    - DEGRADED：L1 不完整 → 不快取
+    """
+    if not snapshot_usable(snapshot):
+        return "DEGRADED"
+    return "OK" if ((snapshot or {}).get("integrity") or {}).get("complete") else "PARTIAL"
+
+
+def get_market_snapshot(target_iso: str, session: str = "EOD", topn: int = 20) -> Dict[str, Any]:
+    """
+    main.py 用：build_snapshot + 儀表板視圖（macro.overview / audit）+ arb_input
+    twii_pct 以小數表示（UI 以 :+.2% 顯示）
+    """
+    target_dt = datetime.combine(to_date(target_iso), datetime.min.time(), tzinfo=TZ_TPE)
+    snap = build_snapshot(target_dt, session_name=session, top_n=int(topn))
+    arb = build_v203_min_json(snapshot=snap, session=session)
+    twii = snap["twii"]
+    t86 = snap["t86"]
     return {
-        "meta": meta,
-        "macro": macro,
-        "stocks": stocks,
-        "audit": audit,
-        "arb_input": arb_input,
+        **snap,
+        "macro": {
+            "overview": {
+                "trade_date": (twii.get("data") or {}).get("date"),
+                "twii_close": arb["macro"]["overview"]["twii_close"],
+                "twii_chg": arb["macro"]["overview"]["twii_chg"],
+                "twii_pct": arb["macro"]["overview"]["daily_return_pct"],
+            },
+            "market_amount": snap["market_amount"],
+            "institutional": t86.get("summary") or {},
+        },
+        "audit": {
+            "TWII": {"source": twii.get("source"), "error": twii.get("error")},
+            "MARKET_AMOUNT": {"source": snap["market_amount"].get("source_twse"),
+                              "error": snap["market_amount"].get("error_twse")},
+            "INSTITUTIONAL": {"source": t86.get("source"), "error": None if t86.get("ok") else t86.get("error")},
+            "UNIVERSE": {"source": snap["top"].get("source"), "count": len(snap["stocks"]), "error": snap["top"].get("error")},
+        },
+        "arb_input": arb,
     }
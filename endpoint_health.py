@@ -0,0 +1,231 @@
+# endpoint_health.py
+# -*- coding: utf-8 -*-
+"""
+Endpoint Health Ledger — 每個官方端點的熔斷器 + 延遲統計（持久化）
+
+為什麼
+- TWSE 擋 runner IP 的日子，每次執行都要在已知掛掉的端點上耗掉 timeout + retry（30 秒以上）
+- FetchResult 的 latency_ms / status_code 用完就丟，無法跨執行累積
+
+狀態機（每個端點獨立）
+- CLOSED：正常呼叫；連續失敗達 failure_threshold → OPEN
+- OPEN：allow() 直接回 False（呼叫端跳下一層，不付 timeout）；cooldown_sec 後轉 HALF_OPEN
+- HALF_OPEN：只放行一個探測請求；成功 → CLOSED，失敗 → 重新 OPEN
+  （探測本身卡住超過 cooldown_sec → 視為失效，再放行下一個探測）
+
+失敗定義：連線/timeout/HTTP >= 400（端點不可用）
+200 但資料為空 / 數值不合理 → 端點可達，不計入失敗
+
+端點名稱：TWSE_STOCK_DAY_ALL / TWSE_FMTQIK / TPEX_ST43 / TWSE_T86 / TWSE_OPENAPI / TWSE_MI_INDEX
+
+狀態檔（預設）：data/endpoint_health.json
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import statistics
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+DEFAULT_HEALTH_PATH = "data/endpoint_health.json"
+
+CLOSED = "CLOSED"
+OPEN = "OPEN"
+HALF_OPEN = "HALF_OPEN"
+
+
+def is_endpoint_failure(status_code: Optional[int]) -> bool:
+    """None（例外/無回應）或 HTTP >= 400 → 端點失敗"""
+    return status_code is None or int(status_code) >= 400
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, name: str):
+        super().__init__(f"CIRCUIT_OPEN:{name}")
+        self.name = name
+
+
+class EndpointHealth:
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_HEALTH_PATH,
+        failure_threshold: int = 3,
+        cooldown_sec: float = 900.0,
+        latency_samples: int = 100,
+    ):
+        self.path = path
+        self.failure_threshold = int(failure_threshold)
+        self.cooldown_sec = float(cooldown_sec)
+        self.latency_samples = int(latency_samples)
+        self._lock = threading.Lock()
+        self._endpoints: Optional[Dict[str, Dict[str, Any]]] = None
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        # 呼叫端持有 _lock
+        if self._endpoints is None:
+            self._endpoints = {}
+            try:
+                if self.path and os.path.exists(self.path):
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._endpoints = json.load(f).get("endpoints", {}) or {}
+            except Exception:
+                self._endpoints = {}
+        return self._endpoints
+
+    def _save(self) -> None:
+        # 呼叫端持有 _lock
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"endpoints": self._endpoints or {}}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except Exception:
+            pass
+
+    def _entry(self, name: str) -> Dict[str, Any]:
+        eps = self._load()
+        e = eps.get(name)
+        if e is None:
+            e = {
+                "state": CLOSED,
+                "consecutive_failures": 0,
+                "opened_at": None,
+                "probe_started_at": None,
+                "last_ok_at": None,
+                "last_fail_at": None,
+                "last_status_code": None,
+                "last_error": None,
+                "ok_count": 0,
+                "fail_count": 0,
+                "latency_ms": [],
+            }
+            eps[name] = e
+        return e
+
+    # -----------------------------
+    # Circuit
+    # -----------------------------
+    def allow(self, name: str) -> bool:
+        """是否可以對該端點發 request（OPEN → False；HALF_OPEN 只放行一個探測）"""
+        now = time.time()
+        with self._lock:
+            e = self._entry(name)
+            state = e["state"]
+            if state == CLOSED:
+                return True
+            if state == OPEN:
+                if now - float(e.get("opened_at") or 0) < self.cooldown_sec:
+                    return False
+                e["state"] = HALF_OPEN
+                e["probe_started_at"] = now
+                self._save()
+                return True
+            # HALF_OPEN：探測進行中 → 擋；探測卡住超過 cooldown → 再放行一個
+            if now - float(e.get("probe_started_at") or 0) < self.cooldown_sec:
+                return False
+            e["probe_started_at"] = now
+            self._save()
+            return True
+
+    def record(self, name: str, ok: bool, latency_ms: Optional[int] = None,
+               status_code: Optional[int] = None, error: Optional[str] = None) -> None:
+        """
+        ok=True：端點可達（成功延遲記入樣本）
+        ok=False：端點失敗（連續失敗計數 / 熔斷）
+        """
+        now = time.time()
+        with self._lock:
+            e = self._entry(name)
+            e["last_status_code"] = status_code
+            if ok:
+                e["ok_count"] = int(e.get("ok_count", 0)) + 1
+                e["consecutive_failures"] = 0
+                e["state"] = CLOSED
+                e["opened_at"] = None
+                e["probe_started_at"] = None
+                e["last_ok_at"] = now
+                e["last_error"] = error
+                if latency_ms is not None:
+                    xs = list(e.get("latency_ms") or [])
+                    xs.append(int(latency_ms))
+                    e["latency_ms"] = xs[-self.latency_samples:]
+            else:
+                e["fail_count"] = int(e.get("fail_count", 0)) + 1
+                e["consecutive_failures"] = int(e.get("consecutive_failures", 0)) + 1
+                e["last_fail_at"] = now
+                e["last_error"] = error
+                if e["state"] == HALF_OPEN or e["consecutive_failures"] >= self.failure_threshold:
+                    e["state"] = OPEN
+                    e["opened_at"] = now
+                    e["probe_started_at"] = None
+            self._save()
+
+    def call(self, name: str, fn: Callable[[], Any]) -> Any:
+        """
+        例外式呼叫的包裝：熔斷中 → CircuitOpenError；fn 丟例外 → 記失敗後原樣丟出
+        requests.HTTPError 取 response.status_code（4xx/5xx 記失敗）
+        """
+        if not self.allow(name):
+            raise CircuitOpenError(name)
+        t0 = time.time()
+        try:
+            out = fn()
+        except Exception as e:
+            resp = getattr(e, "response", None)
+            sc = getattr(resp, "status_code", None)
+            self.record(name, not is_endpoint_failure(sc), int((time.time() - t0) * 1000), sc, type(e).__name__)
+            raise
+        self.record(name, True, int((time.time() - t0) * 1000), 200)
+        return out
+
+    def state(self, name: str) -> str:
+        with self._lock:
+            return self._entry(name)["state"]
+
+    # -----------------------------
+    # Latency
+    # -----------------------------
+    def percentile(self, name: str, pct: float, min_samples: int = 5) -> Optional[float]:
+        """成功延遲的百分位（ms；pct 以 0~1 表示）；樣本不足 → None"""
+        with self._lock:
+            xs = list(self._entry(name).get("latency_ms") or [])
+        if len(xs) < max(2, int(min_samples)):
+            return None
+        q = statistics.quantiles(xs, n=100, method="inclusive")
+        return float(q[min(98, max(0, int(round(pct * 100)) - 1))])
+
+    def percentiles(self, name: str, pcts: Iterable[float] = (0.5, 0.9, 0.99)) -> Dict[str, Optional[float]]:
+        return {f"p{int(round(p * 100))}": self.percentile(name, p) for p in pcts}
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """給 audit / UI：每端點狀態 + 延遲百分位"""
+        with self._lock:
+            names = sorted(self._load().keys())
+            base = {
+                n: {k: v for k, v in self._entry(n).items() if k != "latency_ms"}
+                for n in names
+            }
+        for n in names:
+            base[n]["latency_ms"] = self.percentiles(n)
+        return base
+
+
+_DEFAULT: Optional[EndpointHealth] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_ledger() -> EndpointHealth:
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = EndpointHealth()
+        return _DEFAULT
@@ -3,9 +3,10 @@
 from __future__ import annotations
 
 from typing import Dict, List, Optional, Tuple
-import requests
 import pandas as pd
 
+from http_client import shared_session
+
 FINMIND_URL = "https://api.finmindtrade.com/api/v4/data"
 
 # 以「三大法人」常用組成：外資 + 投信 + 自營商（含避險）
@@ -22,7 +23,7 @@ def _headers(token: Optional[str]) -> dict:
 
 def _get(dataset: str, params: dict, token: Optional[str]) -> dict:
     p = {"dataset": dataset, **params}
-    r = requests.get(FINMIND_URL, headers=_headers(token), params=p, timeout=30)
+    r = shared_session().get(FINMIND_URL, headers=_headers(token), params=p, timeout=30)
     r.raise_for_status()
     return r.json()
 
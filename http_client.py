@@ -0,0 +1,100 @@
+# http_client.py
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP Client — process-wide pooled session
+
+為什麼
+- analyzer.http_get / finmind_institutional._get 每次 requests.get → 每個 request 都重新 TCP+TLS 握手
+- app.build_session 每次 Streamlit run 建新 session；MarketAmountProvider 自己一個 session
+- 一次快照幾十個 request（TWSE / TPEX / FinMind / Stooq），應該重用熱連線
+
+規則
+- 同一 retry 設定共用同一個 requests.Session（thread-safe 用法：只做 GET，不在執行中改 session 狀態）
+- HTTPAdapter：per-host 連線池（pool_connections 個 host、每 host pool_maxsize 條）+ keep-alive
+- retry/backoff 統一：只重試 GET、429/5xx；retries=0 → 快速失敗（儀表板短 timeout 用）
+- verify 政策：verify_ssl=True → certifi CA bundle（有安裝時），False → 不驗證
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import certifi
+except Exception:
+    certifi = None
+
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+    ),
+    "Accept": "application/json,text/plain,*/*",
+    "Accept-Language": "zh-TW,zh;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Connection": "keep-alive",
+}
+
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.8
+POOL_CONNECTIONS = 16   # 快取幾個 host 的連線池
+POOL_MAXSIZE = 32       # 每個 host 最多幾條連線（TopN/stage 並行）
+
+_SESSIONS: Dict[Tuple[int, float], requests.Session] = {}
+_LOCK = threading.Lock()
+
+
+def verify_policy(verify_ssl: bool = True) -> Any:
+    """requests 的 verify 參數：certifi CA bundle / True / False"""
+    if not verify_ssl:
+        return False
+    return certifi.where() if certifi else True
+
+
+def _build(retries: int, backoff_factor: float) -> requests.Session:
+    s = requests.Session()
+    s.headers.update(DEFAULT_HEADERS)
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+def shared_session(retries: int = DEFAULT_RETRIES, backoff_factor: float = DEFAULT_BACKOFF) -> requests.Session:
+    """同一組 (retries, backoff) 整個 process 共用一個 session"""
+    key = (int(retries), float(backoff_factor))
+    with _LOCK:
+        s = _SESSIONS.get(key)
+        if s is None:
+            s = _build(*key)
+            _SESSIONS[key] = s
+        return s
+
+
+def http_get(
+    url: str,
+    *,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Any = 15,
+    verify_ssl: bool = True,
+    retries: int = DEFAULT_RETRIES,
+    **kwargs: Any,
+) -> requests.Response:
+    """共用連線池的 GET（headers 與 DEFAULT_HEADERS 合併）"""
+    return shared_session(retries).get(
+        url, params=params, headers=headers, timeout=timeout, verify=verify_policy(verify_ssl), **kwargs
+    )
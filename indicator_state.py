@@ -0,0 +1,218 @@
+# indicator_state.py
+# -*- coding: utf-8 -*-
+"""
+Incremental Regime Indicator State (MA200 / SMR / SMR_MA5 / Slope5)
+
+為什麼
+- compute_ma200_and_smr 每次都對 2 年日K 重跑 rolling(200)
+- compute_boolean_status 只拿 40 日K 算 rolling(200) → 永遠是 NaN，斜率旗標形同失效
+
+作法
+- 持久化狀態：最近 200 根收盤（running sum）、最近 5 個 SMR（running sum）、最近 N 個 Slope
+- 每根新 K 棒 O(1) 更新；同一日重跑（盤中收盤值變動）→ 以 before_last 快照回復後重算最後一根
+- 與 pandas rolling 口徑一致：
+    MA200   = mean(last 200 close)
+    SMR     = (close - MA200) / MA200
+    SMR_MA5 = mean(last 5 SMR)
+    Slope5  = SMR_MA5[t] - SMR_MA5[t-1]
+
+狀態檔（預設）：data/indicator_state_twii.json
+"""
+
+from __future__ import annotations
+
+import copy
+import json
+import math
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+MA_WINDOW = 200
+SMR_MA_WINDOW = 5
+SLOPE_HISTORY = 20
+STATE_VERSION = 1
+
+DEFAULT_STATE_PATH = "data/indicator_state_twii.json"
+
+
+@dataclass
+class IndicatorState:
+    symbol: str = "^TWII"
+    last_date: Optional[str] = None         # YYYY-MM-DD
+    n_bars: int = 0                          # 累計套用過的 K 棒數
+    closes: List[float] = field(default_factory=list)      # 最近 MA_WINDOW 根收盤
+    close_sum: float = 0.0
+    smrs: List[float] = field(default_factory=list)        # 最近 SMR_MA_WINDOW 個 SMR
+    smr_sum: float = 0.0
+    smr_ma5: Optional[float] = None
+    slopes: List[float] = field(default_factory=list)      # 最近 SLOPE_HISTORY 個 Slope5
+    before_last: Optional[Dict[str, Any]] = None           # 套用最後一根前的狀態（供同日重算）
+
+    # ---------- derived ----------
+    @property
+    def last_close(self) -> Optional[float]:
+        return self.closes[-1] if self.closes else None
+
+    @property
+    def ma200(self) -> Optional[float]:
+        if len(self.closes) < MA_WINDOW:
+            return None
+        return self.close_sum / MA_WINDOW
+
+    @property
+    def smr(self) -> Optional[float]:
+        ma = self.ma200
+        if ma is None or ma == 0:
+            return None
+        return (self.closes[-1] - ma) / ma
+
+    @property
+    def slope5(self) -> Optional[float]:
+        return self.slopes[-1] if self.slopes else None
+
+    def last_slopes(self, n: int) -> List[float]:
+        return list(self.slopes[-n:]) if n > 0 else []
+
+    # ---------- update ----------
+    def _core(self) -> Dict[str, Any]:
+        d = asdict(self)
+        d.pop("before_last", None)
+        return d
+
+    def _restore(self, core: Dict[str, Any]) -> None:
+        for k, v in copy.deepcopy(core).items():
+            setattr(self, k, v)
+
+    def update(self, day: str, close: float) -> None:
+        """
+        套用一根日K（O(1)）
+        - day > last_date：新 K 棒
+        - day == last_date：同日修正（回復 before_last 後重新套用）
+        - day < last_date：忽略（歷史不回寫）
+        """
+        close = float(close)
+        if math.isnan(close):
+            return
+        if self.last_date is not None and day < self.last_date:
+            return
+        if self.last_date is not None and day == self.last_date:
+            if self.before_last is None:
+                return
+            self._restore(self.before_last)
+
+        self.before_last = self._core()
+
+        self.closes.append(close)
+        self.close_sum += close
+        if len(self.closes) > MA_WINDOW:
+            self.close_sum -= self.closes.pop(0)
+
+        smr = self.smr
+        if smr is not None:
+            self.smrs.append(smr)
+            self.smr_sum += smr
+            if len(self.smrs) > SMR_MA_WINDOW:
+                self.smr_sum -= self.smrs.pop(0)
+
+            if len(self.smrs) == SMR_MA_WINDOW:
+                new_ma5 = self.smr_sum / SMR_MA_WINDOW
+                if self.smr_ma5 is not None:
+                    self.slopes.append(new_ma5 - self.smr_ma5)
+                    if len(self.slopes) > SLOPE_HISTORY:
+                        self.slopes.pop(0)
+                self.smr_ma5 = new_ma5
+
+        self.n_bars += 1
+        self.last_date = day
+
+    def resum(self) -> None:
+        # 重新加總消除浮點累積誤差（載入時呼叫；視窗固定大小，仍是常數成本）
+        self.close_sum = math.fsum(self.closes)
+        self.smr_sum = math.fsum(self.smrs)
+
+    # ---------- persistence ----------
+    def to_dict(self) -> Dict[str, Any]:
+        d = asdict(self)
+        d["version"] = STATE_VERSION
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "IndicatorState":
+        if int(d.get("version", 0)) != STATE_VERSION:
+            return cls(symbol=d.get("symbol", "^TWII"))
+        known = {k: d[k] for k in cls.__dataclass_fields__ if k in d}
+        st = cls(**known)
+        st.resum()
+        return st
+
+
+def load_state(path: str = DEFAULT_STATE_PATH, symbol: str = "^TWII") -> IndicatorState:
+    try:
+        if not os.path.exists(path):
+            return IndicatorState(symbol=symbol)
+        with open(path, "r", encoding="utf-8") as f:
+            st = IndicatorState.from_dict(json.load(f))
+        if st.symbol != symbol:
+            return IndicatorState(symbol=symbol)
+        return st
+    except Exception:
+        return IndicatorState(symbol=symbol)
+
+
+def save_state(st: IndicatorState, path: str = DEFAULT_STATE_PATH) -> None:
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(st.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+def _bars(daily: pd.DataFrame) -> List[tuple]:
+    if daily is None or daily.empty or "Close" not in daily.columns:
+        return []
+    close = daily["Close"].astype(float)
+    days = [ts.strftime("%Y-%m-%d") for ts in close.index]
+    return list(zip(days, close.tolist()))
+
+
+def sync_state(daily: pd.DataFrame, symbol: str = "^TWII", path: Optional[str] = DEFAULT_STATE_PATH,
+               state: Optional[IndicatorState] = None) -> IndicatorState:
+    """
+    以日K 對齊狀態：
+    - 狀態接得上（last_date 在日K 範圍內）→ 只套用 last_date 之後（含同日修正）的 K 棒
+    - 接不上 / 狀態超前（例如 asof 截斷的日K）/ 無狀態 → 由日K 完整重建
+    path=None → 不讀寫檔案（純記憶體，供回放/單次計算）
+    state → 以呼叫端持有的狀態為起點（批次回放逐日推進，不讀檔）
+    """
+    bars = _bars(daily)
+    if state is not None and state.symbol == symbol:
+        st = state
+    else:
+        st = load_state(path, symbol) if path else IndicatorState(symbol=symbol)
+    if not bars:
+        return st
+
+    first_day, last_day = bars[0][0], bars[-1][0]
+    contiguous = st.last_date is not None and first_day <= st.last_date <= last_day
+    if not contiguous:
+        st = IndicatorState(symbol=symbol)
+        todo = bars
+    else:
+        todo = [b for b in bars if b[0] >= st.last_date]
+
+    changed = False
+    for day, close in todo:
+        if day == st.last_date and st.last_close is not None and close == st.last_close:
+            continue
+        st.update(day, close)
+        changed = True
+
+    if path and changed:
+        save_state(st, path)
+    return st
@@ -6,8 +6,9 @@ import json
 from datetime import datetime, date
 import streamlit as st
 
-from downloader_tw import get_market_snapshot  # ✅ 只依賴這個統一入口
+from downloader_tw import get_market_snapshot, snapshot_status  # ✅ 只依賴這個統一入口
 from arbiter import arbiter_run               # ✅ 你的統一裁決入口
+from snapshot_cache import MARKET_SNAPSHOT, default_snapshot_cache
 
 
 # -----------------------------
@@ -33,10 +34,24 @@ refresh = st.sidebar.button("立即更新")
 # -----------------------------
 # Caching snapshot
 # -----------------------------
-@st.cache_data(ttl=180, show_spinner=False)
-def get_snapshot_cached(target_iso: str, session: str, topn: int):
+SNAPSHOT_SOURCE = MARKET_SNAPSHOT  # prefetch_daemon 以同一來源名稱預熱
+
+
+def get_snapshot_cached(target_iso: str, session: str, topn: int, refresh: bool = False):
     # ✅ 這裡的呼叫方式固定為：get_market_snapshot(target_iso, session=..., topn=...)
-    return get_market_snapshot(target_iso, session=session, topn=topn)
+    # 落地快取（snapshot_cache）：跨重啟、多使用者共用；refresh 只清這個 (日期, session, topN)
+    cache = default_snapshot_cache()
+    key = (target_iso, session, int(topn))
+    if refresh:
+        cache.invalidate(key, [SNAPSHOT_SOURCE])
+
+    def fetch():
+        snap = get_market_snapshot(target_iso, session=session, topn=topn)
+        # 降級 / 失敗的快照不快取；主來源不齊的只快取短 TTL（下次自動重抓）
+        return snap, {"status": snapshot_status(snap)}
+
+    snapshot, _ = cache.get_or_fetch(key, SNAPSHOT_SOURCE, fetch)
+    return snapshot
 
 
 # -----------------------------
@@ -50,11 +65,7 @@ with col_left:
     target_iso = target_dt.strftime("%Y-%m-%d")
 
     try:
-        if refresh:
-            # ✅ 強制清掉 cache，避免你一直「改了檔，但 cache 還抓舊函式」
-            st.cache_data.clear()
-
-        snapshot = get_snapshot_cached(target_iso, session, int(topn))
+        snapshot = get_snapshot_cached(target_iso, session, int(topn), refresh=refresh)
     except Exception as e:
         st.error(f"Snapshot 取得失敗：{e}")
         st.stop()
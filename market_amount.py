@@ -28,17 +28,24 @@ from __future__ import annotations
 import os
 import time
 import json
+import bisect
 import statistics
-from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta, timezone
 from typing import Any, Dict, Optional, Tuple, List
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import pandas as pd
+
+from endpoint_health import EndpointHealth, default_ledger, is_endpoint_failure
+from http_client import shared_session
+from tw_parse import int_sum, numeric_frame, parse_roc_date, trade_value_column
+from twse_stock_day_all import StockDayAllError, get_stock_day_all
 
 
 TZ_TPE = timezone(timedelta(hours=8))
+EOD_PUBLISH_HHMM = (15, 30)  # 當日成交額定案時間（台北）
 
 
 def _now_tpe() -> datetime:
@@ -72,6 +79,107 @@ def _ms() -> int:
     return int(time.time() * 1000)
 
 
+class TpexRatioModel:
+    """
+    TPEX / TWSE 成交額比值（Tier2 估算用）
+
+    - 每個「兩邊官方值都成功」的交易日記一筆 (date, ratio)，只保留最近 window 筆
+    - ratio = 滾動中位數；sorted window 以 bisect 增量維護（視窗固定大小 → 每日常數成本）
+    - weekday_blend > 0：與同星期幾的中位數加權（該星期樣本 >= 3 才生效）
+    - 檔案格式向下相容：頂層仍有 {"ratio", "asof"}（舊版只讀這兩欄）
+    """
+
+    def __init__(self, path: str, window: int = 60, weekday_blend: float = 0.0, min_samples: int = 5):
+        self.path = path
+        self.window = int(window)
+        self.weekday_blend = float(weekday_blend)
+        self.min_samples = int(min_samples)
+        self._lock = threading.Lock()
+        self.history: List[Tuple[str, float]] = []   # 依日期排序
+        self._sorted: List[float] = []
+        self.legacy_ratio: Optional[float] = None
+        self._load()
+
+    @staticmethod
+    def _valid(r: Any) -> bool:
+        try:
+            return 0.05 <= float(r) <= 0.60
+        except Exception:
+            return False
+
+    def _load(self) -> None:
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                j = json.load(f)
+            hist = [(str(d), float(r)) for d, r in (j.get("history") or []) if self._valid(r)]
+            self.history = sorted(hist)[-self.window:]
+            self._sorted = sorted(r for _, r in self.history)
+            if self._valid(j.get("ratio")):
+                self.legacy_ratio = float(j["ratio"])
+        except Exception:
+            self.history, self._sorted = [], []
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({
+                    "ratio": round(self.median(), 6) if self.history else self.legacy_ratio,
+                    "asof": self.history[-1][0] if self.history else None,
+                    "n": len(self.history),
+                    "window": self.window,
+                    "history": [[d, round(r, 6)] for d, r in self.history],
+                }, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception:
+            pass
+
+    @property
+    def trusted(self) -> bool:
+        return len(self.history) >= self.min_samples
+
+    def median(self) -> float:
+        xs = self._sorted
+        n = len(xs)
+        return xs[n // 2] if n % 2 else (xs[n // 2 - 1] + xs[n // 2]) / 2.0
+
+    def record(self, day: str, twse: int, tpex: int) -> None:
+        """day=YYYY-MM-DD；同日重跑 → 覆蓋該日"""
+        if not twse or not tpex:
+            return
+        r = float(tpex) / float(twse)
+        if not self._valid(r):
+            return
+        with self._lock:
+            days = [d for d, _ in self.history]
+            i = bisect.bisect_left(days, day)
+            if i < len(days) and days[i] == day:
+                if self.history[i][1] == r:
+                    return
+                old = self.history.pop(i)[1]
+                del self._sorted[bisect.bisect_left(self._sorted, old)]
+            self.history.insert(i, (day, r))
+            bisect.insort(self._sorted, r)
+            while len(self.history) > self.window:
+                old = self.history.pop(0)[1]
+                del self._sorted[bisect.bisect_left(self._sorted, old)]
+            self._save()
+
+    def estimate(self, day: Optional[date] = None) -> Optional[float]:
+        with self._lock:
+            if not self.history:
+                return self.legacy_ratio
+            ratio = self.median()
+            if day is not None and self.weekday_blend > 0:
+                wd = [r for d, r in self.history if datetime.strptime(d, "%Y-%m-%d").weekday() == day.weekday()]
+                if len(wd) >= 3:
+                    ratio = (1.0 - self.weekday_blend) * ratio + self.weekday_blend * statistics.median(wd)
+            return ratio
+
+
 @dataclass
 class FetchResult:
     ok: bool
@@ -82,6 +190,7 @@ class FetchResult:
     latency_ms: int
     status_code: Optional[int]
     final_url: Optional[str]
+    from_cache: bool = False
 
 
 class MarketAmountProvider:
@@ -89,6 +198,26 @@ class MarketAmountProvider:
     只負責成交額（TWSE / TPEX）
     - TWSE: Tier1 STOCK_DAY_ALL sum, Tier2 FMTQIK
     - TPEX: Tier1 st43_result, Tier2 ratio estimate, Tier3 SAFE CONSTANT
+      （兩邊官方值都成功的交易日寫入 TpexRatioModel → Tier2 比值自我維護）
+
+    response cache（response_cache_path；None → 停用）
+    - 以 endpoint + 日期為 key，只存成功結果（value + FetchResult 稽核欄位）
+    - 寫入時決定是否定案（final）：該交易日 EOD_PUBLISH_HHMM 之後才寫入、且 confidence=HIGH
+      定案 → 永不過期；其餘（盤中值 / LOW 降級值）一律 cache_today_ttl_sec 後重抓
+    - 最多保留 cache_max_entries 筆：超過時依 cached_at 淘汰最舊的（不看交易日 → 回補舊日期照樣命中；剛寫入的不淘汰）
+    - 命中時 audit 的 from_cache=true
+
+    endpoint health（endpoint_health；熔斷 + 延遲百分位，跨執行持久化）
+    - 端點熔斷中 → 該層直接 FAIL(CIRCUIT_OPEN)，不付 timeout，往下一層走
+    - STOCK_DAY_ALL 的熔斷在 twse_stock_day_all（analyzer / app 共用同一個端點狀態）
+    - hedge / ST43 等待門檻取自 ledger 的成功延遲百分位
+
+    concurrent=True（競速模式）
+    - TWSE Tier1 與 TPEX ST43 同時發出
+    - TWSE Tier1 超過歷史延遲百分位（hedge_percentile；樣本不足用 hedge_default_sec）仍未回 → 同時發出 Tier2 當 hedge
+    - TWSE 取第一個合格結果；整體上限 race_deadline_sec
+    - 比值模型樣本足夠且 TWSE 已成功 → ST43 只等到其延遲百分位（不足用 tpex_model_wait_sec），逾時直接用 Tier2 估算
+    - audit_modules 仍記錄每個嘗試（被取代 → SUPERSEDED，逾時 → RACE_TIMEOUT）
     """
 
     def __init__(
@@ -97,26 +226,40 @@ class MarketAmountProvider:
         tpex_safe_constant: int = 200_000_000_000,  # 2000億
         tpex_ratio_default: float = 0.22,           # 你原本用 0.22
         ratio_cache_path: str = "data/tpex_ratio_cache.json",
+        ratio_window: int = 60,
+        ratio_weekday_blend: float = 0.0,
+        tpex_model_wait_sec: float = 3.0,
+        response_cache_path: Optional[str] = "data/market_amount_cache.json",
+        cache_today_ttl_sec: int = 600,
+        cache_max_entries: int = 2000,
         timeout_sec: int = 12,
         retries_total: int = 2,
         backoff_factor: float = 0.8,
+        concurrent: bool = False,
+        hedge_percentile: float = 0.90,
+        hedge_default_sec: float = 4.0,
+        race_deadline_sec: float = 25.0,
+        health: Optional[EndpointHealth] = None,
     ):
+        self.health = health or default_ledger()
+        self.concurrent = bool(concurrent)
+        self.hedge_percentile = float(hedge_percentile)
+        self.hedge_default_sec = float(hedge_default_sec)
+        self.race_deadline_sec = float(race_deadline_sec)
         self.tpex_safe_constant = int(tpex_safe_constant)
         self.tpex_ratio_default = float(tpex_ratio_default)
         self.ratio_cache_path = ratio_cache_path
+        self.ratio_model = TpexRatioModel(ratio_cache_path, window=ratio_window, weekday_blend=ratio_weekday_blend)
+        self.tpex_model_wait_sec = float(tpex_model_wait_sec)
+        self.response_cache_path = response_cache_path
+        self.cache_today_ttl_sec = int(cache_today_ttl_sec)
+        self.cache_max_entries = int(cache_max_entries)
+        self._cache_lock = threading.Lock()
+        self._cache_entries: Optional[Dict[str, Dict[str, Any]]] = None
         self.timeout_sec = int(timeout_sec)
 
-        self.session = requests.Session()
-        retry = Retry(
-            total=retries_total,
-            connect=retries_total,
-            read=retries_total,
-            backoff_factor=backoff_factor,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["GET"],
-            raise_on_status=False,
-        )
-        self.session.mount("https://", HTTPAdapter(max_retries=retry))
+        # 共用連線池（http_client）：同 retry 設定的 provider / 其他 fetcher 重用熱連線
+        self.session = shared_session(retries=retries_total, backoff_factor=backoff_factor)
 
         self.headers = {
             "User-Agent": (
@@ -131,35 +274,121 @@ class MarketAmountProvider:
     # -----------------------------
     # Public API
     # -----------------------------
-    def fetch(self, dt: Optional[datetime] = None) -> Dict[str, Any]:
+    def fetch(self, dt: Optional[datetime] = None, concurrent: Optional[bool] = None) -> Dict[str, Any]:
         """
         回傳：market_amount dict + audit_modules
+        concurrent=None → 沿用建構時設定
         """
         dt = dt or _now_tpe()
+        if self.concurrent if concurrent is None else concurrent:
+            return self._fetch_concurrent(dt)
+
         trade_date_yyyymmdd = _yyyymmdd(dt)
         roc_date = _roc_yyy_mm_dd(dt)
 
         audit: List[Dict[str, Any]] = []
 
         # ---- TWSE ----
-        twse_r1 = self._fetch_twse_amount_stock_day_all(trade_date_yyyymmdd)
+        twse_r1 = self._cached_tier("TWSE_STOCK_DAY_ALL", dt, self._fetch_twse_amount_stock_day_all, trade_date_yyyymmdd)
         audit.append(self._as_audit_module("TWSE_STOCK_DAY_ALL", dt, twse_r1))
         twse_best = twse_r1
 
         if not twse_best.ok:
-            twse_r2 = self._fetch_twse_amount_fmtqik(trade_date_yyyymmdd)
+            twse_r2 = self._cached_tier("TWSE_FMTQIK", dt, self._fetch_twse_amount_fmtqik, trade_date_yyyymmdd)
             audit.append(self._as_audit_module("TWSE_FMTQIK", dt, twse_r2))
             if twse_r2.ok:
                 twse_best = twse_r2
 
         # ---- TPEX ----
-        tpex_r1 = self._fetch_tpex_amount_st43(roc_date)
+        tpex_r1 = self._cached_tier("TPEX_ST43", dt, self._fetch_tpex_amount_st43, roc_date)
         audit.append(self._as_audit_module("TPEX_ST43", dt, tpex_r1))
+
+        self._record_ratio(dt, twse_best, tpex_r1)
+        tpex_best = self._tpex_fallback_tiers(dt, twse_best, tpex_r1, audit)
+        return self._assemble(twse_best, tpex_best, audit)
+
+    def fetch_tpex(self, dt: datetime) -> FetchResult:
+        """只抓 TPEX 官方值（ST43，指定日期；走 response cache）— analyzer 回放用"""
+        return self._cached_tier("TPEX_ST43", dt, self._fetch_tpex_amount_st43, _roc_yyy_mm_dd(dt))
+
+    def _fetch_concurrent(self, dt: datetime) -> Dict[str, Any]:
+        trade_date_yyyymmdd = _yyyymmdd(dt)
+        roc_date = _roc_yyy_mm_dd(dt)
+        t_start = time.time()
+
+        def remaining() -> float:
+            return max(0.0, t_start + self.race_deadline_sec - time.time())
+
+        ex = ThreadPoolExecutor(max_workers=3, thread_name_prefix="amount-race")
+        try:
+            f_t1 = ex.submit(self._cached_tier, "TWSE_STOCK_DAY_ALL", dt, self._fetch_twse_amount_stock_day_all, trade_date_yyyymmdd)
+            f_tpex = ex.submit(self._cached_tier, "TPEX_ST43", dt, self._fetch_tpex_amount_st43, roc_date)
+            f_t2 = None
+
+            # TWSE：Tier1 超過 hedge 門檻仍未完成 → 發出 Tier2；Tier1 失敗且尚未 hedge → 立即發出 Tier2
+            wait([f_t1], timeout=min(self._hedge_delay_sec(), remaining()))
+            if not f_t1.done() or not f_t1.result().ok:
+                f_t2 = ex.submit(self._cached_tier, "TWSE_FMTQIK", dt, self._fetch_twse_amount_fmtqik, trade_date_yyyymmdd)
+
+            twse_best: Optional[FetchResult] = None
+            pending = {f for f in (f_t1, f_t2) if f is not None}
+            while pending and twse_best is None:
+                done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                # 同時完成時 Tier1 優先
+                for f in (f_t1, f_t2):
+                    if f in done and f.result().ok:
+                        twse_best = f.result()
+                        break
+
+            audit: List[Dict[str, Any]] = []
+            t1 = self._race_result(f_t1, "TWSE_STOCK_DAY_ALL", twse_best, t_start)
+            audit.append(self._as_audit_module("TWSE_STOCK_DAY_ALL", dt, t1))
+            if f_t2 is not None:
+                t2 = self._race_result(f_t2, "TWSE_FMTQIK", twse_best, t_start)
+                audit.append(self._as_audit_module("TWSE_FMTQIK", dt, t2))
+            if twse_best is None:
+                twse_best = t1
+
+            # ---- TPEX ----
+            # 比值模型可信 → 不為 ST43 的 retry/backoff 空等
+            use_model = twse_best.ok and self.ratio_model.trusted
+            tpex_wait = remaining()
+            if use_model:
+                p = self.health.percentile("TPEX_ST43", self.hedge_percentile)
+                tpex_wait = min(tpex_wait, self.tpex_model_wait_sec if p is None else p / 1000.0)
+            wait([f_tpex], timeout=tpex_wait)
+            tpex_r1 = self._race_result(f_tpex, "TPEX_ST43", None, t_start,
+                                        pending_error="RATIO_MODEL_CUTOFF" if use_model else None)
+            audit.append(self._as_audit_module("TPEX_ST43", dt, tpex_r1))
+        finally:
+            # 被取代/逾時的嘗試不等它結束（thread 自行跑完後丟棄結果）
+            ex.shutdown(wait=False, cancel_futures=True)
+
+        self._record_ratio(dt, twse_best, tpex_r1)
+        tpex_best = self._tpex_fallback_tiers(dt, twse_best, tpex_r1, audit)
+        return self._assemble(twse_best, tpex_best, audit)
+
+    def _hedge_delay_sec(self) -> float:
+        p = self.health.percentile("TWSE_STOCK_DAY_ALL", self.hedge_percentile)
+        return self.hedge_default_sec if p is None else p / 1000.0
+
+    def _race_result(self, fut, source: str, winner: Optional[FetchResult], t_start: float,
+                     pending_error: Optional[str] = None) -> FetchResult:
+        # 競速中每個嘗試的 audit 結果：完成 → 原結果；未完成 → 已有贏家 SUPERSEDED / 否則 RACE_TIMEOUT
+        if fut.done() and not fut.cancelled():
+            return fut.result()
+        err = pending_error or ("SUPERSEDED" if winner is not None else "RACE_TIMEOUT")
+        return FetchResult(False, None, source, "LOW", err, int((time.time() - t_start) * 1000), None, None)
+
+    def _tpex_fallback_tiers(self, dt: datetime, twse_best: FetchResult, tpex_r1: FetchResult,
+                             audit: List[Dict[str, Any]]) -> FetchResult:
         tpex_best = tpex_r1
 
         if not tpex_best.ok:
             # Tier2: ratio estimate
-            ratio = self._load_tpex_ratio_cache() or self.tpex_ratio_default
+            ratio = self._load_tpex_ratio_cache(dt) or self.tpex_ratio_default
             est = None
             if twse_best.ok and twse_best.value:
                 est = int(twse_best.value * ratio)
@@ -193,6 +422,9 @@ class MarketAmountProvider:
             audit.append(self._as_audit_module("TPEX_SAFE_CONSTANT", dt, tpex_r3))
             tpex_best = tpex_r3
 
+        return tpex_best
+
+    def _assemble(self, twse_best: FetchResult, tpex_best: FetchResult, audit: List[Dict[str, Any]]) -> Dict[str, Any]:
         amount_twse = twse_best.value if twse_best.ok else None
         amount_tpex = tpex_best.value if tpex_best.ok else None
 
@@ -219,46 +451,35 @@ class MarketAmountProvider:
     # -----------------------------
     def _fetch_twse_amount_stock_day_all(self, yyyymmdd: str) -> FetchResult:
         """
-        Tier1：逐筆加總 STOCK_DAY_ALL（最抗格式變動）
+        Tier1：逐筆加總 STOCK_DAY_ALL 的成交金額欄（依 fields 表頭定位；表頭缺失才退回尾端掃描）
         endpoint:
         https://www.twse.com.tw/exchangeReport/STOCK_DAY_ALL?response=json&date=YYYYMMDD
         """
         t0 = _ms()
-        url = "https://www.twse.com.tw/exchangeReport/STOCK_DAY_ALL"
-        params = {"response": "json", "date": yyyymmdd}
 
         try:
-            r = self.session.get(url, params=params, headers=self.headers, timeout=self.timeout_sec)
-            sc = r.status_code
-            final_url = r.url
-            if sc != 200:
-                return FetchResult(False, None, "TWSE_STOCK_DAY_ALL", "LOW", f"HTTP_{sc}", _ms() - t0, sc, final_url)
-
-            j = r.json()
-            rows = j.get("data", []) or []
-            if not rows:
-                return FetchResult(False, None, "TWSE_STOCK_DAY_ALL", "LOW", "EMPTY", _ms() - t0, sc, final_url)
-
-            # 從每列尾端找可解析整數（保守法）
-            amount_sum = 0
-            ok_rows = 0
-            for row in rows:
-                best = None
-                for cell in reversed(row):
-                    v = _safe_int(cell)
-                    if v is not None and v > 0:
-                        best = v
-                        break
-                if best is not None:
-                    amount_sum += best
-                    ok_rows += 1
+            # 同交易日的 STOCK_DAY_ALL 與 analyzer / app 共用同一份下載（twse_stock_day_all 快取）
+            try:
+                sda = get_stock_day_all(yyyymmdd, session=self.session, headers=self.headers, timeout=self.timeout_sec)
+            except StockDayAllError as e:
+                err = "EMPTY" if e.code == "STOCK_DAY_ALL_EMPTY" else e.code
+                return FetchResult(False, None, "TWSE_STOCK_DAY_ALL", "LOW", err, _ms() - t0, e.status_code, e.final_url)
+            sc = sda.status_code
+            final_url = sda.final_url
+            rows = sda.rows
+
+            values, method = trade_value_column(sda.fields, rows)
+            amount_sum = int_sum(values)
+            source = "TWSE_STOCK_DAY_ALL_SUM" if method == "HEADER" else "TWSE_STOCK_DAY_ALL_SCAN"
 
             # 合理性門檻（避免抓到錯欄位）
             # 台股上市成交額正常日常見 > 1000億；保守設 800億避免過度誤殺
             if amount_sum < 80_000_000_000:
-                return FetchResult(False, None, "TWSE_STOCK_DAY_ALL", "LOW", f"AMOUNT_TOO_LOW:{amount_sum}", _ms() - t0, sc, final_url)
+                return FetchResult(False, None, source, "LOW", f"AMOUNT_TOO_LOW:{amount_sum}", _ms() - t0, sc, final_url)
 
-            return FetchResult(True, int(amount_sum), "TWSE_STOCK_DAY_ALL_SUM", "HIGH", None, _ms() - t0, sc, final_url)
+            # 尾端掃描可能誤抓欄位 → 信心降為 LOW
+            confidence = "HIGH" if method == "HEADER" else "LOW"
+            return FetchResult(True, int(amount_sum), source, confidence, None, _ms() - t0, sc, final_url)
 
         except Exception as e:
             return FetchResult(False, None, "TWSE_STOCK_DAY_ALL", "LOW", type(e).__name__, _ms() - t0, None, None)
@@ -285,19 +506,20 @@ class MarketAmountProvider:
             if not data:
                 return FetchResult(False, None, "TWSE_FMTQIK", "LOW", "EMPTY", _ms() - t0, sc, final_url)
 
-            # 常見：最後一列有總成交金額欄位；但可能變動
-            # 這裡採「整個 data 掃描最大 int」以保守抓取（避免 index out of range）
-            candidates = []
-            for row in data:
-                for cell in row:
-                    v = _safe_int(cell)
-                    if v is not None:
-                        candidates.append(v)
-
-            if not candidates:
+            # FMTQIK 是「整月逐日」表：第一欄為民國日期
+            # 找得到目標日那一列 → 只掃該列；找不到 → 沿用「整個 data 掃描最大 int」保守抓取
+            num = numeric_frame(data)
+            day = parse_roc_date(pd.Series([row[0] if row else None for row in data], dtype="object"))
+            target = pd.Timestamp(datetime.strptime(yyyymmdd, "%Y%m%d"))
+            hit = (day == target).to_numpy()
+            if hit.any():
+                num = num[hit]
+
+            cells = num.stack().dropna() if not num.empty else pd.Series(dtype="float64")
+            if cells.empty:
                 return FetchResult(False, None, "TWSE_FMTQIK", "LOW", "NO_NUMERIC", _ms() - t0, sc, final_url)
 
-            best = max(candidates)
+            best = int(cells.max())
             if best < 80_000_000_000:
                 return FetchResult(False, None, "TWSE_FMTQIK", "LOW", f"AMOUNT_TOO_LOW:{best}", _ms() - t0, sc, final_url)
 
@@ -348,29 +570,111 @@ class MarketAmountProvider:
         except Exception as e:
             return FetchResult(False, None, "TPEX_ST43", "LOW", type(e).__name__, _ms() - t0, None, None)
 
+    # -----------------------------
+    # Response Cache (date-keyed, on disk)
+    # -----------------------------
+    def _cached_tier(self, endpoint: str, dt: datetime, fn, *args) -> FetchResult:
+        key = f"{endpoint}:{_yyyymmdd(dt)}"
+        hit = self._cache_get(key)
+        if hit is not None:
+            return hit
+        guarded = endpoint != "TWSE_STOCK_DAY_ALL"  # STOCK_DAY_ALL 由 twse_stock_day_all 記錄
+        if guarded and not self.health.allow(endpoint):
+            return FetchResult(False, None, endpoint, "LOW", "CIRCUIT_OPEN", 0, None, None)
+        r = fn(*args)
+        if guarded:
+            self.health.record(endpoint, not is_endpoint_failure(r.status_code), r.latency_ms, r.status_code, r.error)
+        if r.ok:
+            self._cache_put(key, r, dt)
+        return r
+
+    def _cache_load(self) -> Dict[str, Dict[str, Any]]:
+        # 呼叫端持有 _cache_lock
+        if self._cache_entries is None:
+            self._cache_entries = {}
+            try:
+                if self.response_cache_path and os.path.exists(self.response_cache_path):
+                    with open(self.response_cache_path, "r", encoding="utf-8") as f:
+                        self._cache_entries = json.load(f).get("entries", {}) or {}
+            except Exception:
+                self._cache_entries = {}
+        return self._cache_entries
+
+    def _cache_get(self, key: str) -> Optional[FetchResult]:
+        if not self.response_cache_path:
+            return None
+        t0 = _ms()
+        with self._cache_lock:
+            e = self._cache_load().get(key)
+        if not e:
+            return None
+        # 定案與否在寫入時決定（讀取時看日期會把盤中值 / LOW 降級值在隔天變成永久）
+        if not e.get("final") and time.time() - float(e.get("cached_at", 0)) > self.cache_today_ttl_sec:
+            return None
+        try:
+            return FetchResult(
+                ok=True,
+                value=int(e["value"]),
+                source=e["source"],
+                confidence=e["confidence"],
+                error=None,
+                latency_ms=_ms() - t0,
+                status_code=e.get("status_code"),
+                final_url=e.get("final_url"),
+                from_cache=True,
+            )
+        except Exception:
+            return None
+
+    def _cache_put(self, key: str, r: FetchResult, dt: datetime) -> None:
+        if not self.response_cache_path:
+            return
+        day = dt.astimezone(TZ_TPE).date() if dt.tzinfo else dt.date()
+        publish = datetime(day.year, day.month, day.day, *EOD_PUBLISH_HHMM, tzinfo=TZ_TPE)
+        now = time.time()
+        with self._cache_lock:
+            entries = self._cache_load()
+            e = asdict(r)
+            e.pop("from_cache", None)
+            e["cached_at"] = now
+            e["final"] = r.confidence == "HIGH" and now >= publish.timestamp()
+            entries[key] = e
+            # 淘汰：超過 cache_max_entries → 依寫入時間丟掉最舊的（剛寫入的 key 不在候選內）
+            excess = len(entries) - max(1, self.cache_max_entries)
+            if excess > 0:
+                old = sorted((k for k in entries if k != key), key=lambda k: float(entries[k].get("cached_at", 0)))
+                for k in old[:excess]:
+                    del entries[k]
+            try:
+                os.makedirs(os.path.dirname(self.response_cache_path) or ".", exist_ok=True)
+                tmp = self.response_cache_path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"entries": entries}, f, ensure_ascii=False, indent=2)
+                os.replace(tmp, self.response_cache_path)
+            except Exception:
+                pass
+
     # -----------------------------
     # Ratio Cache (optional)
     # -----------------------------
-    def _load_tpex_ratio_cache(self) -> Optional[float]:
+    def _load_tpex_ratio_cache(self, dt: Optional[datetime] = None) -> Optional[float]:
         """
-        ratio cache 格式建議：
-        {"ratio": 0.22, "asof": "2026-02-25"}
+        ratio cache（TpexRatioModel 維護）：
+        {"ratio": 0.22, "asof": "2026-02-25", "n": 60, "window": 60, "history": [["2026-02-25", 0.2213], ...]}
         """
         try:
-            if not os.path.exists(self.ratio_cache_path):
-                return None
-            with open(self.ratio_cache_path, "r", encoding="utf-8") as f:
-                j = json.load(f)
-            r = j.get("ratio")
-            if r is None:
-                return None
-            r = float(r)
-            if not (0.05 <= r <= 0.60):
+            r = self.ratio_model.estimate(dt.date() if dt is not None else None)
+            if r is None or not (0.05 <= r <= 0.60):
                 return None
-            return r
+            return float(r)
         except Exception:
             return None
 
+    def _record_ratio(self, dt: datetime, twse_best: FetchResult, tpex_r1: FetchResult) -> None:
+        # 只記「兩邊官方值都成功」的交易日（估算值/安全常數、LOW 信心的 TWSE 掃描值不回寫）
+        if twse_best.ok and twse_best.confidence == "HIGH" and tpex_r1.ok and "ST43" in tpex_r1.source:
+            self.ratio_model.record(dt.strftime("%Y-%m-%d"), twse_best.value, tpex_r1.value)
+
     # -----------------------------
     # Audit format helper
     # -----------------------------
@@ -385,6 +689,7 @@ class MarketAmountProvider:
             "status_code": r.status_code,
             "final_url": r.final_url,
             "source": r.source,
+            "from_cache": r.from_cache,
         }
 
 
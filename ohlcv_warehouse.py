@@ -0,0 +1,334 @@
+# ohlcv_warehouse.py
+# -*- coding: utf-8 -*-
+"""
+Local OHLCV Warehouse (SQLite) — read-through provider for yfinance daily bars
+
+為什麼
+- analyzer 每次都直接打 yfinance（^TWII 5y / ^VIX / TopN 60d），Dashboard 盤中重跑幾乎全是重複下載
+- 已在磁碟上的 K 棒直接讀；只抓「缺的尾段」並寫回，下一次啟動就是熱的
+
+規則
+- 只處理日K（interval=1d）；其他 interval 由呼叫端直接走 yfinance
+- 覆蓋範圍記在 sync_state（first_date / last_date / fetched_at / partial_date）
+  - 要求的起點早於 first_date → 整段 period 重新下載一次
+  - 尾段：距上次下載 < FRESH_TTL_SEC → 視為最新，不發 request
+  - 台股標的盤後（非盤中）：上次下載已晚於「最近一個應收盤的交易時段」→ 也視為最新；盤中只看 TTL
+  - 否則從 last_date - OVERLAP_DAYS 起補抓（覆蓋最近幾根，吃掉盤中未定值 / 修正）
+- 台股盤中下載到的當日 K 棒是未定值 → 記在 partial_date；只讀磁碟的 final_only 讀取會排除它
+- 網路失敗 → 回傳磁碟上已有的資料（可能略舊），不中斷上層
+
+Schema 與 downloader_hk 的 stock_prices 欄位一致（date, symbol, open, high, low, close, volume），
+主鍵改為 (symbol, date)：查詢型態永遠是「單一 symbol 的一段歷史」
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+import yfinance as yf
+
+TZ_TPE = timezone(timedelta(hours=8))
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, "tw_stock_warehouse.db")
+
+FRESH_TTL_SEC = 15 * 60      # 盤中重跑：15 分鐘內視為最新
+OVERLAP_DAYS = 5             # 補尾段時往回重疊天數
+TW_CLOSE_HHMM = (14, 30)     # 台股收盤後資料（含盤後定價）視為定案
+YF_CHUNK = 50
+
+COLS = ["Open", "High", "Low", "Close", "Volume"]
+
+# stock_prices 別名 p：排除 sync_state.partial_date 標記的盤中 K 棒
+_FINAL_ONLY_SQL = (" AND NOT EXISTS (SELECT 1 FROM sync_state s "
+                   "WHERE s.symbol = p.symbol AND s.partial_date = p.date)")
+
+
+def _now_tpe() -> datetime:
+    return datetime.now(TZ_TPE)
+
+
+def _is_tw_symbol(symbol: str) -> bool:
+    return symbol.endswith(".TW") or symbol.endswith(".TWO") or symbol == "^TWII"
+
+
+def _tw_session_open(now: datetime) -> bool:
+    """平日且尚未收盤（當日 K 棒仍可能變動）"""
+    return now.weekday() < 5 and (now.hour, now.minute) < TW_CLOSE_HHMM
+
+
+def _last_expected_close(now: datetime) -> datetime:
+    """最近一個「應已收盤」的平日收盤時刻（不含國定假日判斷；假日只會多一次補抓）"""
+    d = now.date()
+    close_today = datetime(d.year, d.month, d.day, *TW_CLOSE_HHMM, tzinfo=TZ_TPE)
+    if now.weekday() < 5 and now >= close_today:
+        return close_today
+    d = d - timedelta(days=1)
+    while d.weekday() >= 5:
+        d = d - timedelta(days=1)
+    return datetime(d.year, d.month, d.day, *TW_CLOSE_HHMM, tzinfo=TZ_TPE)
+
+
+def _period_start(period: str, today: date) -> date:
+    n = int("".join(ch for ch in period if ch.isdigit()) or 0)
+    unit = "".join(ch for ch in period if ch.isalpha())
+    if unit == "d":
+        return today - timedelta(days=n)
+    if unit == "wk":
+        return today - timedelta(weeks=n)
+    if unit == "mo":
+        return (pd.Timestamp(today) - pd.DateOffset(months=n)).date()
+    if unit == "y":
+        return (pd.Timestamp(today) - pd.DateOffset(years=n)).date()
+    if period == "max":
+        return date(1990, 1, 1)
+    raise ValueError(f"unsupported period: {period}")
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """yfinance 結果 → index 為 naive 日期、欄位 COLS"""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=COLS)
+    out = df.copy()
+    idx = pd.to_datetime(out.index)
+    if idx.tz is not None:
+        idx = idx.tz_localize(None)
+    out.index = idx.normalize()
+    for c in COLS:
+        if c not in out.columns:
+            out[c] = float("nan")
+    out = out[COLS]
+    return out[out["Close"].notna()]
+
+
+class OHLCVWarehouse:
+    def __init__(self, db_path: str = DB_PATH, fresh_ttl_sec: int = FRESH_TTL_SEC):
+        self.db_path = db_path
+        self.fresh_ttl_sec = int(fresh_ttl_sec)
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    # -----------------------------
+    # DB
+    # -----------------------------
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute('''CREATE TABLE IF NOT EXISTS stock_prices (
+                                        symbol TEXT, date TEXT, open REAL, high REAL,
+                                        low REAL, close REAL, volume INTEGER,
+                                        PRIMARY KEY (symbol, date)) WITHOUT ROWID''')
+                    conn.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                                        symbol TEXT PRIMARY KEY,
+                                        first_date TEXT,
+                                        last_date TEXT,
+                                        fetched_at REAL,
+                                        partial_date TEXT)''')
+                    # 自動升級舊倉庫
+                    cols = [r[1] for r in conn.execute("PRAGMA table_info(sync_state)").fetchall()]
+                    if "partial_date" not in cols:
+                        conn.execute("ALTER TABLE sync_state ADD COLUMN partial_date TEXT")
+                    conn.commit()
+                    self._ready = True
+        return conn
+
+    def _state(self, conn: sqlite3.Connection, symbols: Sequence[str]) -> Dict[str, tuple]:
+        if not symbols:
+            return {}
+        q = f"SELECT symbol, first_date, last_date, fetched_at, partial_date FROM sync_state WHERE symbol IN ({','.join('?' * len(symbols))})"
+        return {r[0]: r[1:] for r in conn.execute(q, list(symbols)).fetchall()}
+
+    def _read(self, conn: sqlite3.Connection, symbol: str, start: date, end: Optional[date] = None,
+              final_only: bool = False) -> pd.DataFrame:
+        q = "SELECT date, open, high, low, close, volume FROM stock_prices p WHERE symbol = ? AND date >= ?"
+        args: List = [symbol, start.isoformat()]
+        if end is not None:
+            q += " AND date <= ?"
+            args.append(end.isoformat())
+        if final_only:
+            q += _FINAL_ONLY_SQL
+        rows = conn.execute(q + " ORDER BY date", args).fetchall()
+        if not rows:
+            return pd.DataFrame(columns=COLS)
+        df = pd.DataFrame(rows, columns=["date"] + COLS)
+        df.index = pd.to_datetime(df.pop("date"))
+        df.index.name = "Date"
+        return df.astype({"Open": float, "High": float, "Low": float, "Close": float, "Volume": float})
+
+    def _write(self, conn: sqlite3.Connection, symbol: str, df: pd.DataFrame, first_date: str) -> None:
+        if df.empty:
+            conn.execute(
+                "INSERT INTO sync_state (symbol, first_date, last_date, fetched_at) VALUES (?, ?, NULL, ?) "
+                "ON CONFLICT(symbol) DO UPDATE SET first_date = MIN(COALESCE(first_date, excluded.first_date), excluded.first_date), "
+                "fetched_at = excluded.fetched_at",
+                (symbol, first_date, time.time()),
+            )
+            return
+        recs = [
+            (symbol, ts.strftime("%Y-%m-%d"), r.Open, r.High, r.Low, r.Close,
+             None if pd.isna(r.Volume) else int(r.Volume))
+            for ts, r in zip(df.index, df.itertuples(index=False))
+        ]
+        conn.executemany(
+            "INSERT OR REPLACE INTO stock_prices (symbol, date, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            recs,
+        )
+        last = df.index[-1].strftime("%Y-%m-%d")
+        now = _now_tpe()
+        partial = last if _is_tw_symbol(symbol) and _tw_session_open(now) and last == now.date().isoformat() else None
+        conn.execute(
+            "INSERT INTO sync_state (symbol, first_date, last_date, fetched_at, partial_date) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(symbol) DO UPDATE SET "
+            "first_date = MIN(COALESCE(first_date, excluded.first_date), excluded.first_date), "
+            "last_date = MAX(COALESCE(last_date, excluded.last_date), excluded.last_date), "
+            "fetched_at = excluded.fetched_at, partial_date = excluded.partial_date",
+            (symbol, first_date, last, time.time(), partial),
+        )
+
+    # -----------------------------
+    # Freshness
+    # -----------------------------
+    def _plan(self, symbol: str, start: date, st: Optional[tuple], now: datetime) -> Optional[date]:
+        """回傳需要從哪一天開始下載；None = 磁碟已足夠"""
+        if st is None or st[0] is None or st[0] > start.isoformat():
+            return start
+        _, last_date, fetched_at, partial_date = st
+        if last_date is None:
+            return start
+        session_open = _is_tw_symbol(symbol) and _tw_session_open(now)
+        # 盤中寫入的未定 K 棒：收盤後一定重抓覆蓋（不吃 TTL）
+        unsettled = partial_date is not None and not session_open
+        if fetched_at is not None and not unsettled:
+            if time.time() - float(fetched_at) < self.fresh_ttl_sec:
+                return None
+            # 盤中當日 K 棒仍在變動 → 只看 TTL；盤後才以「上次下載晚於收盤」判定定案
+            if _is_tw_symbol(symbol) and not session_open:
+                fetched_dt = datetime.fromtimestamp(float(fetched_at), TZ_TPE)
+                if fetched_dt >= _last_expected_close(now):
+                    return None
+        return datetime.strptime(last_date, "%Y-%m-%d").date() - timedelta(days=OVERLAP_DAYS)
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    def history(self, symbol: str, period: str) -> pd.DataFrame:
+        """單檔日K（read-through）"""
+        return self.history_many([symbol], period).get(symbol, pd.DataFrame(columns=COLS))
+
+    def history_many(self, symbols: Sequence[str], period: str, chunk_size: int = YF_CHUNK) -> Dict[str, pd.DataFrame]:
+        """
+        多檔日K（read-through）
+        - 磁碟已足夠的 symbol 不發 request
+        - 需要補的 symbol 依下載起點分組，每組 chunk 一次 yf.download
+        """
+        syms = list(dict.fromkeys(s for s in symbols if s))
+        now = _now_tpe()
+        start = _period_start(period, now.date())
+
+        conn = self._connect()
+        try:
+            states = self._state(conn, syms)
+            plans = {s: self._plan(s, start, states.get(s), now) for s in syms}
+        finally:
+            conn.close()
+
+        groups: Dict[date, List[str]] = {}
+        for s, since in plans.items():
+            if since is not None:
+                groups.setdefault(since, []).append(s)
+
+        fetched: Dict[str, pd.DataFrame] = {}
+        for since, members in sorted(groups.items()):
+            for i in range(0, len(members), max(1, int(chunk_size))):
+                fetched.update(self._download(members[i:i + chunk_size], since))
+
+        conn = self._connect()
+        try:
+            if fetched:
+                with conn:
+                    for s, df in fetched.items():
+                        self._write(conn, s, df, start.isoformat() if plans[s] == start else states[s][0])
+            return {s: self._read(conn, s, start) for s in syms}
+        finally:
+            conn.close()
+
+    def _download(self, symbols: List[str], since: date) -> Dict[str, pd.DataFrame]:
+        """一次 request；失敗的 symbol 不回傳（上層改讀磁碟）"""
+        out: Dict[str, pd.DataFrame] = {}
+        try:
+            if len(symbols) == 1:
+                raw = yf.Ticker(symbols[0]).history(start=since.isoformat(), interval="1d", auto_adjust=False)
+                if raw is not None and not raw.empty:
+                    out[symbols[0]] = _normalize(raw)
+                return out
+            raw = yf.download(symbols, start=since.isoformat(), interval="1d", auto_adjust=False,
+                              group_by="ticker", progress=False, threads=True)
+        except Exception:
+            return out
+        if raw is None or raw.empty or not isinstance(raw.columns, pd.MultiIndex):
+            return out
+        for s in symbols:
+            if s in raw.columns.get_level_values(0):
+                df = _normalize(raw[s])
+                if not df.empty:
+                    out[s] = df
+        return out
+
+    def read(self, symbol: str, start: date, end: Optional[date] = None, final_only: bool = False) -> pd.DataFrame:
+        """只讀磁碟（不觸發下載）；final_only → 排除盤中寫入的未定 K 棒"""
+        conn = self._connect()
+        try:
+            return self._read(conn, symbol, start, end, final_only)
+        finally:
+            conn.close()
+
+    def read_panel(self, symbols: Sequence[str], start: date, end: Optional[date] = None,
+                   final_only: bool = False) -> Dict[str, pd.DataFrame]:
+        """
+        只讀磁碟、多檔一次查詢 → {"Open"/"High"/"Low"/"Close"/"Volume": date×symbol}
+        磁碟沒有的 symbol 欄位不存在（與 analyzer.fetch_yf_panel 同口徑）
+        final_only → 排除盤中寫入的未定 K 棒
+        """
+        syms = list(dict.fromkeys(s for s in symbols if s))
+        if not syms:
+            return {}
+        q = (f"SELECT symbol, date, open, high, low, close, volume FROM stock_prices p "
+             f"WHERE symbol IN ({','.join('?' * len(syms))}) AND date >= ?")
+        args: List = syms + [start.isoformat()]
+        if end is not None:
+            q += " AND date <= ?"
+            args.append(end.isoformat())
+        if final_only:
+            q += _FINAL_ONLY_SQL
+        conn = self._connect()
+        try:
+            rows = conn.execute(q, args).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return {}
+        long = pd.DataFrame(rows, columns=["symbol", "Date"] + COLS)
+        long["Date"] = pd.to_datetime(long["Date"])
+        wide = long.pivot(index="Date", columns="symbol", values=COLS).sort_index()
+        return {fld: wide[fld].astype(float) for fld in COLS}
+
+
+_DEFAULT: Optional[OHLCVWarehouse] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_warehouse() -> OHLCVWarehouse:
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = OHLCVWarehouse()
+        return _DEFAULT
@@ -1,8 +1,10 @@
-import os, sys, json, requests
+import os, sys, json
 import pandas as pd
 import yfinance as yf
 from datetime import datetime
 
+from http_client import shared_session
+
 # 配置：確保路徑與你的 Repo 一致
 CSV_PATH = "data/data_tw-share.csv"
 JSON_OUT = "macro.json"
@@ -12,13 +14,14 @@ def get_data():
     results = {"twse": None, "tpex": None}
     try:
         # 上市金額
-        res = requests.get("https://www.twse.com.tw/exchangeReport/FMTQIK?response=json", timeout=15)
+        http = shared_session()
+        res = http.get("https://www.twse.com.tw/exchangeReport/FMTQIK?response=json", timeout=15)
         results["twse"] = float(res.json()['data'][-1][2].replace(',', ''))
         
         # 上櫃金額 (含 Redirect 修復)
         roc_date = f"{datetime.now().year - 1911}/{datetime.now().strftime('%m/%d')}"
         t_url = f"https://www.tpex.org.tw/web/stock/aftertrading/daily_trading_info/st43_result.php?l=zh-tw&d={roc_date}&se=EW"
-        t_res = requests.get(t_url, timeout=15, allow_redirects=False)
+        t_res = http.get(t_url, timeout=15, allow_redirects=False)
         if t_res.status_code == 200:
             results["tpex"] = float(t_res.json().get("集合成交金額", 0))
     except: pass
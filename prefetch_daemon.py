@@ -0,0 +1,257 @@
+# prefetch_daemon.py
+# -*- coding: utf-8 -*-
+"""
+Prefetch Daemon — 排程前預熱快照（本機常駐）
+
+為什麼
+- workflow_master 每天 08:30 / 11:00 / 16:30（台北）跑，儀表板緊接著被打開
+- 目前每次點擊都從冷啟動開始打 TWSE / TPEX / FinMind
+
+規則
+- 只在週一～五的預熱視窗內工作；視窗外睡到下一個視窗開始
+  - 08:25~08:45、10:55~11:15：對應 08:30 / 11:00 run（EOD guard → 前一交易日，過去日期快取永不過期）
+  - 15:30~16:45：EOD 資料 15:30 後才公布 → 開始輪詢，一路保溫到 16:30 run 之後
+- 視窗內每 poll_sec 跑一輪 warmers；poll_sec < snapshot_cache 今日 TTL → 視窗內今日快照不會過期
+- warmers 全部寫進既有快取層（snapshot_cache / MarketAmountProvider 回應快取），讀取端不必知道 daemon 存在
+  - APP_SNAPSHOT：app.get_snapshot_cached（TWII / STOCK_DAY_ALL / T86 各來源）
+  - MARKET_AMOUNT：MarketAmountProvider.fetch（TWSE/TPEX 成交額 + TPEX 比例歷史）
+  - FINMIND_INST：FinMind 市場法人淨額（snapshot_cache 來源 FINMIND_INST_NET_AB）
+  - MARKET_SNAPSHOT / WORKFLOW_SNAPSHOT：main.py / workflow_master.py 的整包快照
+- 每個 warmer best-effort：例外只記錄在狀態檔，不影響其他 warmer 或下一輪
+
+狀態檔（預設）：data/prefetch_status.json
+用法：python prefetch_daemon.py [--once] [--session EOD] [--topn 20] [--poll-sec 150]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from date_cache import TZ_TPE
+from snapshot_cache import MARKET_SNAPSHOT, TODAY_TTL_SEC, default_snapshot_cache
+
+DEFAULT_STATUS_PATH = "data/prefetch_status.json"
+EOD_PUBLISH_HHMM = (15, 30)
+POLL_SEC = 150
+FINMIND_SOURCE = "FINMIND_INST_NET_AB"
+
+# warmer(target_dt, session, topn) → {"status": "OK"|..., ...}
+Warmer = Callable[[datetime, str, int], Dict[str, Any]]
+
+
+@dataclass(frozen=True)
+class PrefetchWindow:
+    label: str
+    start: Tuple[int, int]  # (hh, mm) 台北
+    end: Tuple[int, int]
+
+    def contains(self, t: datetime) -> bool:
+        return self.start <= (t.hour, t.minute) < self.end
+
+
+DEFAULT_WINDOWS: List[PrefetchWindow] = [
+    PrefetchWindow("RUN_0830", (8, 25), (8, 45)),
+    PrefetchWindow("RUN_1100", (10, 55), (11, 15)),
+    PrefetchWindow("EOD_1630", EOD_PUBLISH_HHMM, (16, 45)),
+]
+
+
+def now_tpe() -> datetime:
+    return datetime.now(TZ_TPE)
+
+
+def effective_trade_date(target_dt: datetime, session: str, now: Optional[datetime] = None) -> date:
+    """與 app.resolve_effective_trade_date 相同的 EOD guard：15:30 前 → 前一日"""
+    t = now or now_tpe()
+    if session.upper() == "EOD" and (t.hour, t.minute) < EOD_PUBLISH_HHMM:
+        return (target_dt - timedelta(days=1)).date()
+    return target_dt.date()
+
+
+# =========================
+# Warmers（延遲 import：單一模組壞掉不影響其他 warmer）
+# =========================
+def warm_app_snapshot(target_dt: datetime, session: str, topn: int) -> Dict[str, Any]:
+    import app
+
+    snap = app.get_snapshot_cached(app.build_session(), target_dt, session, topn)
+    modules = (snap.get("meta") or {}).get("audit_modules") or []
+    failed = [m.get("name") for m in modules if m.get("status") != "OK"]
+    return {
+        "status": "OK" if not failed else "PARTIAL",
+        "failed": failed,
+        "from_cache": [m.get("name") for m in modules if m.get("from_cache")],
+    }
+
+
+def warm_market_amount(target_dt: datetime, session: str, topn: int) -> Dict[str, Any]:
+    from market_amount import MarketAmountProvider
+
+    d = effective_trade_date(target_dt, session)
+    out = MarketAmountProvider().fetch(datetime(d.year, d.month, d.day, tzinfo=TZ_TPE), concurrent=True)
+    ok = out.get("status_twse") == "OK" and out.get("status_tpex") == "OK"
+    return {"status": "OK" if ok else "PARTIAL", "source_twse": out.get("source_twse"),
+            "source_tpex": out.get("source_tpex")}
+
+
+def warm_finmind(target_dt: datetime, session: str, topn: int) -> Dict[str, Any]:
+    from finmind_institutional import fetch_finmind_market_inst_net_ab
+
+    d = effective_trade_date(target_dt, session).isoformat()
+
+    def fetch() -> Tuple[Dict[str, float], Dict[str, Any]]:
+        ab = fetch_finmind_market_inst_net_ab(d, token=os.getenv("FINMIND_TOKEN") or None)
+        # 尚未公布時 FinMind 回空 → A/B 皆 0，不快取
+        return ab, {"status": "OK" if (ab.get("A") or ab.get("B")) else "EMPTY", "asof": d}
+
+    _, audit = default_snapshot_cache().get_or_fetch((d, session.upper(), int(topn)), FINMIND_SOURCE, fetch)
+    return audit
+
+
+def warm_market_snapshot(target_dt: datetime, session: str, topn: int) -> Dict[str, Any]:
+    from downloader_tw import get_market_snapshot, snapshot_status
+
+    target_iso = target_dt.strftime("%Y-%m-%d")
+
+    def fetch() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        snap = get_market_snapshot(target_iso, session=session, topn=topn)
+        # 與 main.py / workflow_master 同一判斷：降級快照不寫進快取；主來源不齊只快取短 TTL，留給排程 run 重抓
+        return snap, {"status": snapshot_status(snap)}
+
+    _, audit = default_snapshot_cache().get_or_fetch((target_iso, session, int(topn)), MARKET_SNAPSHOT, fetch)
+    return audit
+
+
+def warm_workflow_snapshot(target_dt: datetime, session: str, topn: int) -> Dict[str, Any]:
+    from workflow_master import load_snapshot
+
+    _, audit = load_snapshot(target_dt, session, topn)
+    return audit
+
+
+DEFAULT_WARMERS: Dict[str, Warmer] = {
+    "APP_SNAPSHOT": warm_app_snapshot,
+    "MARKET_AMOUNT": warm_market_amount,
+    "FINMIND_INST": warm_finmind,
+    "MARKET_SNAPSHOT": warm_market_snapshot,
+    "WORKFLOW_SNAPSHOT": warm_workflow_snapshot,
+}
+
+
+# =========================
+# Daemon
+# =========================
+@dataclass
+class PrefetchDaemon:
+    sessions: Sequence[str] = ("EOD",)
+    topns: Sequence[int] = (20,)
+    windows: Sequence[PrefetchWindow] = field(default_factory=lambda: list(DEFAULT_WINDOWS))
+    warmers: Dict[str, Warmer] = field(default_factory=lambda: dict(DEFAULT_WARMERS))
+    poll_sec: float = POLL_SEC
+    status_path: Optional[str] = DEFAULT_STATUS_PATH
+
+    def __post_init__(self):
+        # 輪詢間隔必須短於今日快照 TTL，否則視窗內會出現冷快取空窗
+        self.poll_sec = min(float(self.poll_sec), TODAY_TTL_SEC * 0.8)
+
+    def active_window(self, t: datetime) -> Optional[PrefetchWindow]:
+        if t.weekday() >= 5:
+            return None
+        return next((w for w in self.windows if w.contains(t)), None)
+
+    def seconds_until_next(self, t: datetime) -> float:
+        """視窗內 → poll_sec；視窗外 → 距離下一個（週一～五）視窗開始的秒數"""
+        if self.active_window(t) is not None:
+            return self.poll_sec
+        for day in range(8):
+            d = (t + timedelta(days=day)).date()
+            if d.weekday() >= 5:
+                continue
+            for w in sorted(self.windows, key=lambda x: x.start):
+                start = datetime(d.year, d.month, d.day, w.start[0], w.start[1], tzinfo=TZ_TPE)
+                if start > t:
+                    return max(1.0, (start - t).total_seconds())
+        return self.poll_sec
+
+    def run_once(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """跑一輪：每個 (session, topN) × warmer 並行；回傳並落地狀態"""
+        t = now or now_tpe()
+        target_dt = datetime(t.year, t.month, t.day, tzinfo=TZ_TPE)
+        jobs = [(s.upper(), int(n), name, fn)
+                for s in self.sessions for n in self.topns for name, fn in self.warmers.items()]
+
+        def run(job) -> Dict[str, Any]:
+            session, topn, name, fn = job
+            t0 = time.time()
+            try:
+                out = dict(fn(target_dt, session, topn) or {})
+            except Exception as e:
+                out = {"status": "ERROR", "error": f"{type(e).__name__}: {e}"}
+            out["latency_ms"] = int((time.time() - t0) * 1000)
+            return {"warmer": name, "session": session, "topn": topn, **out}
+
+        with ThreadPoolExecutor(max_workers=max(1, len(jobs)), thread_name_prefix="prefetch") as ex:
+            results = list(ex.map(run, jobs))
+
+        window = self.active_window(t)
+        report = {
+            "ran_at": t.strftime("%Y-%m-%d %H:%M:%S"),
+            "window": window.label if window else None,
+            "target_date": target_dt.strftime("%Y-%m-%d"),
+            "all_ok": all(r.get("status") == "OK" for r in results),
+            "results": results,
+        }
+        self._save_status(report)
+        return report
+
+    def run_forever(self, stop: Optional[threading.Event] = None) -> None:
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            t = now_tpe()
+            if self.active_window(t) is not None:
+                report = self.run_once(t)
+                print(f"[{report['ran_at']}] {report['window']} all_ok={report['all_ok']}", flush=True)
+            stop.wait(self.seconds_until_next(now_tpe()))
+
+    def _save_status(self, report: Dict[str, Any]) -> None:
+        if not self.status_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.status_path) or ".", exist_ok=True)
+            tmp = self.status_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+            os.replace(tmp, self.status_path)
+        except Exception:
+            pass
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--once", action="store_true", help="run one warm cycle now (ignores windows)")
+    ap.add_argument("--session", action="append", choices=["EOD", "INTRADAY"], help="repeatable; default EOD")
+    ap.add_argument("--topn", action="append", type=int, help="repeatable; default 20")
+    ap.add_argument("--poll-sec", default=POLL_SEC, type=float)
+    args = ap.parse_args()
+
+    daemon = PrefetchDaemon(
+        sessions=args.session or ["EOD"],
+        topns=args.topn or [20],
+        poll_sec=args.poll_sec,
+    )
+    if args.once:
+        print(json.dumps(daemon.run_once(), ensure_ascii=False, indent=2, default=str))
+        return
+    daemon.run_forever()
+
+
+if __name__ == "__main__":
+    main()
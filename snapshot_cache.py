@@ -0,0 +1,166 @@
+# snapshot_cache.py
+# -*- coding: utf-8 -*-
+"""
+Snapshot Cache (on disk / per source) — Streamlit 儀表板共用
+
+為什麼
+- main.py 的「立即更新」呼叫 st.cache_data.clear() → 全部清掉；app.py 每按一次就全部重抓
+- 多人同時看儀表板時，每次點擊都在打 TWSE
+
+規則
+- key = (effective_trade_date, session, topn)；每個 key 底下每個來源（TWII / STOCK_DAY_ALL / T86 ...）各自一筆
+- 落地：data/snapshot_cache/<date>_<session>_<topn>.json（重啟後仍有效）
+- 寫入時決定是否不可變（immutable）：該日 PUBLISH_HHMM（盤後資料公布）之後才寫入 → 永不過期
+  其餘（盤中 / EOD guard 回退前一日時寫入的快照）一律 today_ttl_sec 後重抓
+- fetch 的 audit.status：OK → 快取；PARTIAL（可用但有降級）→ 只快取 today_ttl_sec、永不定案；其他不快取
+- invalidate(key, sources) 只清指定來源（例如只重抓 T86，不動 TWII / 成交額）
+- 同一來源同時多個呼叫者 → 只有一個真的去抓（其餘等它寫完後讀快取）
+- prefetch_daemon 在排程前預熱同一份快取；儀表板 / workflow_master 只讀現成快照
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from date_cache import TZ_TPE, to_date
+
+DEFAULT_CACHE_DIR = "data/snapshot_cache"
+TODAY_TTL_SEC = 180
+PUBLISH_HHMM = (15, 30)  # 盤後資料（成交額 / T86）公布時間（台北）
+
+SnapshotKey = Tuple[str, str, int]  # (effective_trade_date ISO, session, topn)
+
+# 整包快照的來源名稱（prefetch_daemon 預熱 → main.py / workflow_master.py 直接讀）
+MARKET_SNAPSHOT = "MARKET_SNAPSHOT"      # main.py：downloader_tw.get_market_snapshot
+WORKFLOW_SNAPSHOT = "WORKFLOW_SNAPSHOT"  # workflow_master.py：downloader_tw.build_snapshot
+
+
+class SnapshotCache:
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, today_ttl_sec: float = TODAY_TTL_SEC):
+        self.root = root
+        self.today_ttl_sec = float(today_ttl_sec)
+        self._lock = threading.Lock()
+        self._source_locks: Dict[Tuple[SnapshotKey, str], threading.Lock] = {}
+
+    # -----------------------------
+    # Storage
+    # -----------------------------
+    def _path(self, key: SnapshotKey) -> str:
+        d, session, topn = key
+        name = re.sub(r"[^0-9A-Za-z_\-]", "_", f"{d}_{session}_{int(topn)}")
+        return os.path.join(self.root, f"{name}.json")
+
+    def _read(self, key: SnapshotKey) -> Dict[str, Any]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f).get("sources", {}) or {}
+        except Exception:
+            return {}
+
+    def _write(self, key: SnapshotKey, sources: Dict[str, Any]) -> None:
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            path = self._path(key)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"key": list(key), "sources": sources}, f, ensure_ascii=False, default=str)
+            os.replace(tmp, path)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _immutable(key: SnapshotKey, cached_at: float) -> bool:
+        """寫入時刻已晚於該日公布時間 → 之後不會再變"""
+        try:
+            d = to_date(key[0])
+        except Exception:
+            return False
+        publish = datetime(d.year, d.month, d.day, *PUBLISH_HHMM, tzinfo=TZ_TPE)
+        return cached_at >= publish.timestamp()
+
+    def _fresh(self, key: SnapshotKey, entry: Dict[str, Any]) -> bool:
+        # 不可變與否在 put 時記錄；讀取時看日期會把盤中寫入的快照在隔天變成永久
+        if entry.get("immutable"):
+            return True
+        return time.time() - float(entry.get("cached_at", 0)) <= self.today_ttl_sec
+
+    def _source_lock(self, key: SnapshotKey, source: str) -> threading.Lock:
+        with self._lock:
+            return self._source_locks.setdefault((key, source), threading.Lock())
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+    def peek(self, key: SnapshotKey, source: str) -> Optional[Dict[str, Any]]:
+        """未過期 → {"value", "audit", "cached_at"}；否則 None"""
+        with self._lock:
+            entry = self._read(key).get(source)
+        if entry is None or not self._fresh(key, entry):
+            return None
+        return entry
+
+    def put(self, key: SnapshotKey, source: str, value: Any, audit: Optional[Dict[str, Any]] = None,
+            final: bool = True) -> None:
+        """final=False → 不論寫入時刻都只活 today_ttl_sec（降級結果）"""
+        with self._lock:
+            sources = self._read(key)
+            now = time.time()
+            sources[source] = {"value": value, "audit": audit, "cached_at": now,
+                               "immutable": final and self._immutable(key, now)}
+            self._write(key, sources)
+
+    def get_or_fetch(
+        self,
+        key: SnapshotKey,
+        source: str,
+        fetch: Callable[[], Tuple[Any, Dict[str, Any]]],
+        should_cache: Callable[[Any, Dict[str, Any]], bool] = lambda v, a: a.get("status") in ("OK", "PARTIAL"),
+    ) -> Tuple[Any, Dict[str, Any]]:
+        """
+        fetch() → (value, audit)；命中時回傳快取的 value 與 audit（audit.from_cache=True）
+        audit.status == "PARTIAL" → 以 final=False 寫入（只活 TTL）
+        """
+        hit = self.peek(key, source)
+        if hit is not None:
+            return hit["value"], {**(hit.get("audit") or {}), "from_cache": True}
+
+        with self._source_lock(key, source):
+            hit = self.peek(key, source)
+            if hit is not None:
+                return hit["value"], {**(hit.get("audit") or {}), "from_cache": True}
+            value, audit = fetch()
+            if should_cache(value, audit):
+                self.put(key, source, value, audit, final=audit.get("status") != "PARTIAL")
+            return value, {**audit, "from_cache": False}
+
+    def invalidate(self, key: SnapshotKey, sources: Optional[Iterable[str]] = None) -> None:
+        """sources=None → 清掉整個 key；否則只清指定來源"""
+        with self._lock:
+            if sources is None:
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+                return
+            cur = self._read(key)
+            for s in sources:
+                cur.pop(s, None)
+            self._write(key, cur)
+
+
+_DEFAULT: Optional[SnapshotCache] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_snapshot_cache() -> SnapshotCache:
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = SnapshotCache()
+        return _DEFAULT
@@ -0,0 +1,276 @@
+# stock_layer.py
+# -*- coding: utf-8 -*-
+"""
+TopN Stock Layer — Arbiter payload 的 stocks[]（快速 / 只讀本地資料）
+
+為什麼
+- app.build_arbiter_payload 一直回傳 stocks=[] → L1 永遠 empty_universe，TopN slider 沒作用
+
+流程（市場快照完成後，通常 < 1 秒）
+1) STOCK_DAY_ALL（twse_stock_day_all 行程內快取；快照階段已下載過）
+2) 4 碼普通股、Close >= min_price → TradeValue 以 np.argpartition 取前 N（partial sort），再只排序這 N 檔
+3) 技術面：ohlcv_warehouse 一次 SQL 讀 N 檔日K（不觸發下載）；倉庫落後 → 補上 STOCK_DAY_ALL 當日 K 棒
+4) 法人：T86 個股三大法人買賣超（本地 data/t86_net/YYYYMMDD.json，fetch T86 時順手寫入）
+5) TopN / 技術 / 法人 以 Code 為 index 一次 join → stocks[]
+
+欄位（verify_integrity / ucc_engine 皆可讀）
+- Symbol / Name / Price
+- institutional: inst_status (OK / NO_UPDATE_TODAY / UNAVAILABLE), inst_net_1d, inst_net_3d, inst_days
+  NO_UPDATE_TODAY 時 inst_net_3d 一律 None（L1 F6 規則）
+- risk.stop_distance_pct：2×ATR14 / close（比例，0.05 = 5%）
+- signals: slope5（5 日報酬）, acceleration（slope5 與 5 日前 slope5 之差）, ret20_pct, vol_ratio, ma_bias_pct
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from date_cache import to_date
+from ohlcv_warehouse import OHLCVWarehouse, default_warehouse
+from tw_parse import column_values, resolve_column
+from twse_stock_day_all import get_stock_day_all
+
+T86_NET_DIR = "data/t86_net"
+TECH_CALENDAR_DAYS = 100  # 約 60 個交易日，足夠 MA20 / ATR14 / ret20
+INST_DAYS = 3
+STOP_ATR_MULT = 2.0
+
+
+# =========================
+# T86 per-stock store
+# =========================
+def t86_net_by_code(fields: Sequence[Any], rows: Sequence[Sequence[Any]]) -> Dict[str, int]:
+    """T86 原始表 → {證券代號: 三大法人買賣超股數}（向量化解析）"""
+    code_idx = resolve_column(fields, ["證券代號"])
+    net_idx = resolve_column(fields, ["三大法人", "買賣超"])
+    if code_idx is None or net_idx is None or not rows:
+        return {}
+    codes = pd.Series([str(r[code_idx]).strip() if len(r) > code_idx else "" for r in rows])
+    nets = column_values(rows, net_idx)
+    ok = (codes != "") & nets.notna()
+    return dict(zip(codes[ok], nets[ok].astype(np.int64).tolist()))
+
+
+def save_t86_net(trade_date: str, by_code: Dict[str, int], root: str = T86_NET_DIR) -> None:
+    if not by_code:
+        return
+    try:
+        os.makedirs(root, exist_ok=True)
+        path = os.path.join(root, f"{to_date(trade_date).strftime('%Y%m%d')}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(by_code, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+def load_t86_net(trade_date: str, days: int = INST_DAYS, root: str = T86_NET_DIR) -> pd.DataFrame:
+    """
+    trade_date（含）之前最近 days 個有落地的 T86 交易日 → DataFrame(index=Code, columns=YYYYMMDD)
+    只有交易日才會有檔案，所以「最近 N 個檔案」即「最近 N 個交易日」
+    """
+    cutoff = to_date(trade_date).strftime("%Y%m%d")
+    try:
+        names = sorted(n[:8] for n in os.listdir(root) if n.endswith(".json") and n[:8].isdigit())
+    except FileNotFoundError:
+        return pd.DataFrame()
+    picked = [d for d in names if d <= cutoff][-int(days):]
+    cols = {}
+    for d in picked:
+        try:
+            with open(os.path.join(root, f"{d}.json"), "r", encoding="utf-8") as f:
+                cols[d] = pd.Series(json.load(f), dtype="float64")
+        except Exception:
+            continue
+    return pd.DataFrame(cols)
+
+
+# =========================
+# Technicals
+# =========================
+def _append_today(panel: Dict[str, pd.DataFrame], top: pd.DataFrame, trade_day: date) -> Dict[str, pd.DataFrame]:
+    """倉庫最後一根 < 交易日 → 用 STOCK_DAY_ALL 當日 OHLCV 補一列（只補 TopN 欄位）"""
+    ts = pd.Timestamp(trade_day)
+    today = pd.DataFrame({
+        "Open": top["Open"], "High": top["High"], "Low": top["Low"],
+        "Close": top["Close"], "Volume": top["TradeVolume"],
+    })
+    today.index = top["symbol"]
+    out = {}
+    for fld in ("Open", "High", "Low", "Close", "Volume"):
+        df = panel.get(fld, pd.DataFrame())
+        df = df.reindex(columns=top["symbol"].tolist())
+        if len(df.index) == 0 or df.index[-1] < ts:
+            df.loc[ts] = today[fld].reindex(df.columns).astype(float)
+        out[fld] = df
+    return out
+
+
+def compute_tech_frame(panel: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """date×symbol 面板 → 每檔最新技術欄位（index=symbol）；樣本不足 → NaN"""
+    close, high, low, vol = panel["Close"], panel["High"], panel["Low"], panel["Volume"]
+    prev_close = close.shift(1)
+    tr = np.maximum(high - low, np.maximum((high - prev_close).abs(), (low - prev_close).abs()))
+    atr14 = tr.rolling(14).mean()
+    ma20 = close.rolling(20).mean()
+    vol20 = vol.rolling(20).mean()
+    ret5 = close / close.shift(5) - 1.0
+
+    last = close.iloc[-1]
+    frame = pd.DataFrame({
+        "ret20_pct": (last / close.shift(20).iloc[-1] - 1.0) * 100.0,
+        "vol_ratio": vol.iloc[-1] / vol20.iloc[-1].replace(0.0, np.nan),
+        "ma_bias_pct": (last - ma20.iloc[-1]) / ma20.iloc[-1].replace(0.0, np.nan) * 100.0,
+        "slope5": ret5.iloc[-1],
+        "acceleration": ret5.iloc[-1] - ret5.shift(5).iloc[-1],
+        "atr14": atr14.iloc[-1],
+        "stop_distance_pct": STOP_ATR_MULT * atr14.iloc[-1] / last.replace(0.0, np.nan),
+    })
+    frame = frame.round(6)
+    frame["tech_date"] = close.index[-1]
+    return frame
+
+
+# =========================
+# Builder
+# =========================
+def _select_topn(table: pd.DataFrame, top_n: int, min_price: float) -> pd.DataFrame:
+    df = table[table["Code"].str.match(r"^\d{4}$") & (table["Close"] >= min_price) & table["TradeValue"].notna()]
+    n = min(int(top_n), len(df))
+    if n <= 0:
+        return df.iloc[0:0].assign(symbol="", rank=0).set_index("Code", drop=False)
+    tv = df["TradeValue"].to_numpy()
+    idx = np.argpartition(-tv, n - 1)[:n]
+    idx = idx[np.argsort(-tv[idx], kind="stable")]
+    top = df.iloc[idx].copy()
+    top["symbol"] = top["Code"] + ".TW"
+    top["rank"] = np.arange(1, n + 1)
+    return top.set_index("Code", drop=False)
+
+
+def _none(x: Any) -> Any:
+    if x is None:
+        return None
+    if isinstance(x, (float, np.floating)) and np.isnan(x):
+        return None
+    if isinstance(x, np.integer):
+        return int(x)
+    if isinstance(x, np.floating):
+        return float(x)
+    return x
+
+
+def build_stock_layer(
+    trade_date: str,
+    top_n: int,
+    *,
+    session=None,
+    verify: Any = True,
+    timeout: Any = (2, 3),
+    min_price: float = 1.0,
+    warehouse: Optional[OHLCVWarehouse] = None,
+    t86_root: str = T86_NET_DIR,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    trade_date: YYYYMMDD / YYYY-MM-DD（有效交易日）
+    回傳 (stocks, audit)；任何一層失敗都降級（技術/法人欄位 None），只有 STOCK_DAY_ALL 失敗才回空清單
+    """
+    t0 = time.time()
+    td = to_date(trade_date)
+    yyyymmdd = td.strftime("%Y%m%d")
+    audit: Dict[str, Any] = {"name": "TOPN_STOCK_LAYER", "status": "FAIL", "confidence": "LOW", "error": None}
+
+    try:
+        sda = get_stock_day_all(yyyymmdd, session=session, verify=verify, timeout=timeout)
+    except Exception as e:
+        audit.update({"error": f"{type(e).__name__}: {e}", "latency_ms": int((time.time() - t0) * 1000)})
+        return [], audit
+
+    table = sda.table
+    need = {"Code", "Close", "TradeValue"}
+    if not need.issubset(table.columns):
+        audit.update({"error": "TWSE_SCHEMA_CHANGED", "latency_ms": int((time.time() - t0) * 1000)})
+        return [], audit
+    for c in ("Name", "Open", "High", "Low", "TradeVolume"):
+        if c not in table.columns:
+            table = table.assign(**{c: np.nan})
+    top = _select_topn(table, top_n, min_price)
+
+    # 技術面：倉庫一次讀 N 檔；讀不到不擋 TopN
+    tech = pd.DataFrame(index=top.index)
+    tech_error = None
+    try:
+        wh = warehouse or default_warehouse()
+        panel = wh.read_panel(top["symbol"].tolist(), td - timedelta(days=TECH_CALENDAR_DAYS), td, final_only=True)
+        panel = _append_today(panel, top, td)
+        tech = compute_tech_frame(panel)
+        tech.index = tech.index.str.replace(".TW", "", regex=False)
+    except Exception as e:
+        tech_error = f"{type(e).__name__}: {e}"
+
+    # 法人：最近 INST_DAYS 個 T86 交易日
+    inst = load_t86_net(yyyymmdd, INST_DAYS, root=t86_root)
+    has_today = yyyymmdd in inst.columns
+    inst_cols = pd.DataFrame(columns=["inst_net_1d", "inst_net_3d", "inst_days"])
+    if has_today:
+        inst_cols = pd.DataFrame({
+            "inst_net_1d": inst[yyyymmdd],
+            "inst_net_3d": inst.sum(axis=1, min_count=1),
+            "inst_days": inst.notna().sum(axis=1),
+        })
+
+    joined = top.join(tech, how="left").join(inst_cols, how="left")
+
+    if inst.empty:
+        inst_status = "UNAVAILABLE"
+    elif has_today:
+        inst_status = "OK"
+    else:
+        inst_status = "NO_UPDATE_TODAY"
+
+    stocks: List[Dict[str, Any]] = []
+    for r in joined.to_dict("records"):
+        tech_date = r.get("tech_date")
+        stocks.append({
+            "Symbol": r["symbol"],
+            "Name": r.get("Name"),
+            "Price": _none(r.get("Close")),
+            "rank": int(r["rank"]),
+            "TradeValue": _none(r.get("TradeValue")),
+            "institutional": {
+                "inst_status": inst_status,
+                "inst_net_1d": _none(r.get("inst_net_1d")),
+                "inst_net_3d": _none(r.get("inst_net_3d")),
+                "inst_days": int(_none(r.get("inst_days")) or 0),
+            },
+            "risk": {
+                "stop_distance_pct": _none(r.get("stop_distance_pct")),
+                "atr14": _none(r.get("atr14")),
+            },
+            "signals": {
+                "slope5": _none(r.get("slope5")),
+                "acceleration": _none(r.get("acceleration")),
+                "ret20_pct": _none(r.get("ret20_pct")),
+                "vol_ratio": _none(r.get("vol_ratio")),
+                "ma_bias_pct": _none(r.get("ma_bias_pct")),
+                "tech_date": None if pd.isna(tech_date) else str(pd.Timestamp(tech_date).date()),
+            },
+        })
+
+    audit.update({
+        "status": "OK" if stocks else "FAIL",
+        "confidence": "HIGH" if (stocks and tech_error is None and inst_status == "OK") else "LOW",
+        "error": tech_error if stocks else "TOPN_EMPTY",
+        "count": len(stocks),
+        "inst_status": inst_status,
+        "latency_ms": int((time.time() - t0) * 1000),
+    })
+    return stocks, audit
@@ -0,0 +1,111 @@
+# tw_parse.py
+# -*- coding: utf-8 -*-
+"""
+TWSE / TPEx 欄位解析（向量化）
+
+官方 JSON / OpenAPI 的數字都是字串：千分位逗號、"--" / "N/A" 等空值記號、民國日期。
+所有模組（analyzer / app / market_amount / twse_stock_day_all）都走這裡，
+確保同一個 cell 在各模組解析結果一致，且不再逐 cell 跑 Python。
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 與 analyzer.safe_float / market_amount._safe_int 的空值記號取聯集
+NA_SENTINELS = ("", "-", "--", "—", "N/A", "None", "null", "nan", "NaN")
+
+
+def to_numeric(s: pd.Series) -> pd.Series:
+    """
+    字串欄 → float64（NaN 表示不可解析）
+    "1,234.5" → 1234.5；"--" / "N/A" / "" → NaN
+    """
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        return s.astype("float64")
+    t = s.astype("string").str.replace(",", "", regex=False).str.strip()
+    t = t.mask(t.isin(NA_SENTINELS))
+    return pd.to_numeric(t, errors="coerce").astype("float64")
+
+
+def coerce_numeric_columns(df: pd.DataFrame, cols: Iterable[str]) -> pd.DataFrame:
+    """就地把存在的欄位轉成 float64；回傳同一個 df 方便串接"""
+    for c in cols:
+        if c in df.columns:
+            df[c] = to_numeric(df[c])
+    return df
+
+
+def numeric_frame(rows: Sequence[Sequence[Any]]) -> pd.DataFrame:
+    """官方 data 二維陣列（list of list）→ 全欄 float64 DataFrame（欄位以位置編號）"""
+    if not rows:
+        return pd.DataFrame()
+    df = pd.DataFrame([list(r) for r in rows])
+    return df.apply(to_numeric)
+
+
+def last_positive_per_row(rows: Sequence[Sequence[Any]]) -> pd.Series:
+    """
+    每列「由右往左第一個可解析且 > 0 的數字」（舊版逐 cell reverse scan 的向量化版本）
+    找不到 → NaN
+    """
+    num = numeric_frame(rows)
+    if num.empty:
+        return pd.Series(dtype="float64")
+    return num.where(num > 0).ffill(axis=1).iloc[:, -1]
+
+
+def parse_roc_date(s: pd.Series) -> pd.Series:
+    """
+    民國日期 → datetime64（NaT 表示不可解析）
+    支援："115/01/13"、"115-01-13"、"115.01.13"、"1150113"、"99/12/31"
+    已是西元（"2026-01-13" / "20260113"）也接受
+    """
+    t = s.astype("string").str.strip()
+    parts = t.str.extract(r"^(\d{2,4})[/\-.]?(\d{2})[/\-.]?(\d{2})$")
+    year = pd.to_numeric(parts[0], errors="coerce")
+    year = year.where(year >= 1911, year + 1911)
+    iso = year.astype("Int64").astype("string") + "-" + parts[1] + "-" + parts[2]
+    return pd.to_datetime(iso, format="%Y-%m-%d", errors="coerce")
+
+
+def resolve_column(fields: Sequence[Any], keywords: Sequence[str], exclude: Sequence[str] = ()) -> Optional[int]:
+    """
+    在表頭中找第一個「同時包含所有 keywords、且不含 exclude」的欄位 index
+    """
+    for i, name in enumerate(fields):
+        n = str(name)
+        if all(k in n for k in keywords) and not any(x in n for x in exclude):
+            return i
+    return None
+
+
+def column_values(rows: Sequence[Sequence[Any]], idx: int) -> pd.Series:
+    """取 data 二維陣列的單一欄並數值化（列長不足 → NaN）"""
+    return to_numeric(pd.Series([r[idx] if len(r) > idx else None for r in rows], dtype="object"))
+
+
+# STOCK_DAY_ALL 成交金額欄（中文表頭 / OpenAPI 英文欄名）
+TRADE_VALUE_HEADERS = (("成交金額",), ("TradeValue",))
+
+
+def trade_value_column(fields: Sequence[Any], rows: Sequence[Sequence[Any]]) -> Tuple[pd.Series, str]:
+    """
+    每列成交金額 + 解析方式
+    - 表頭找得到成交金額欄 → 只數值化該欄（"HEADER"）
+    - 表頭缺失 / 找不到 → 退回逐列由右往左掃描（"REVERSE_SCAN"，可能誤抓其他欄）
+    """
+    for keywords in TRADE_VALUE_HEADERS:
+        idx = resolve_column(fields or (), keywords)
+        if idx is not None:
+            return column_values(rows, idx), "HEADER"
+    return last_positive_per_row(rows), "REVERSE_SCAN"
+
+
+def int_sum(s: pd.Series) -> int:
+    """逐值截斷成整數後加總（與舊版 int(float(x)) 逐筆相加口徑一致），NaN 視為 0"""
+    return int(np.trunc(s.fillna(0.0)).sum())
+
@@ -0,0 +1,284 @@
+# twii_provider.py
+# -*- coding: utf-8 -*-
+"""
+TWII Provider — 加權指數收盤（多來源競速 + 前收盤合理性檢查）
+
+為什麼
+- 指數收盤在 L1 關鍵路徑（F1_TWII_CLOSE_MISSING）：它的尾延遲決定整次執行的延遲
+- app 只打 Stooq、analyzer 只打 yfinance、downloader_tw 依序 fallback → 最慢來源拖住全部
+
+規則
+- 四個來源同時發出：TWSE MI_INDEX / yfinance（倉庫 read-through）/ Stooq / 倉庫磁碟（不連網）
+  - 今日（含以後）不讓倉庫磁碟參賽：它沒有網路延遲必勝，磁碟上的當日 K 棒可能是盤中未定值
+    → 網路來源都失敗/逾時才讀磁碟（只讀定案 K 棒），且一律當 stale 備案
+- 先到且通過檢查者勝出，其餘取消（shutdown(cancel_futures=True)，不等執行中的 request）
+  - 日期必須等於交易日（較舊 → 只當 stale 備案）
+  - 與前收盤（倉庫磁碟 trade_day 之前最後一根；沒有 → 來源自帶的前收盤）偏離 <= max_move（台股漲跌幅 10%）
+- 沒有任何來源在 deadline 內給出當日收盤 → 回傳最新的 stale 候選（stale=True，不快取）
+- 每個交易日的答案快取在行程內（date_cache：過去交易日永不過期，今日短 TTL）
+
+輸出
+{"ok", "source", "error", "stale", "latency_ms", "rejected": [...],
+ "data": {date, close, chg, chg_pct, prev_close, chg_pct_prev}}   # chg_pct 以 % 表示
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from date_cache import DateKeyedCache, DateLike, to_date
+from endpoint_health import default_ledger
+from http_client import shared_session, verify_policy
+from ohlcv_warehouse import OHLCVWarehouse, default_warehouse
+from tw_parse import resolve_column
+
+MI_INDEX_URL = "https://www.twse.com.tw/rwd/zh/afterTrading/MI_INDEX"
+STOOQ_TWII_URL = "https://stooq.com/q/d/l/?s=%5Etwii&i=d"
+TWII_NAME = "發行量加權股價指數"
+SYMBOL = "^TWII"
+DISK_SOURCE = "WAREHOUSE"
+TZ_TPE = timezone(timedelta(hours=8))
+
+RACE_DEADLINE_SEC = 8.0
+MAX_MOVE = 0.11
+TODAY_TTL_SEC = 300
+
+# 候選：{"date": date, "close": float, "prev_close": float|None, "prev2_close": float|None}
+Candidate = Dict[str, Any]
+
+
+def _today_tpe() -> date:
+    return datetime.now(TZ_TPE).date()
+
+
+def _num(x: Any) -> Optional[float]:
+    try:
+        return float(re.sub(r"<[^>]*>", "", str(x)).replace(",", "").strip())
+    except Exception:
+        return None
+
+
+def _from_series(close: pd.Series, day: date) -> Candidate:
+    """日K 收盤序列 → day（含）之前最後一根 + 前兩根"""
+    close = close.astype(float).dropna()
+    close = close[close.index.normalize() <= pd.Timestamp(day)]
+    if close.empty:
+        raise RuntimeError("TWII_EMPTY")
+    return {
+        "date": close.index[-1].date(),
+        "close": float(close.iloc[-1]),
+        "prev_close": float(close.iloc[-2]) if len(close) >= 2 else None,
+        "prev2_close": float(close.iloc[-3]) if len(close) >= 3 else None,
+    }
+
+
+def _mi_index_tables(j: Dict[str, Any]) -> List[Tuple[Sequence[Any], Sequence[Sequence[Any]]]]:
+    """新版 tables[] / 舊版 fieldsN + dataN 兩種格式"""
+    out = [(t.get("fields") or [], t.get("data") or []) for t in (j.get("tables") or []) if isinstance(t, dict)]
+    for k, v in j.items():
+        if k.startswith("fields") and isinstance(v, list):
+            out.append((v, j.get("data" + k[len("fields"):]) or []))
+    return out
+
+
+class TwiiProvider:
+    def __init__(
+        self,
+        race_deadline_sec: float = RACE_DEADLINE_SEC,
+        max_move: float = MAX_MOVE,
+        warehouse: Optional[OHLCVWarehouse] = None,
+        today_ttl_sec: float = TODAY_TTL_SEC,
+    ):
+        self.race_deadline_sec = float(race_deadline_sec)
+        self.max_move = float(max_move)
+        self.warehouse = warehouse
+        self._cache = DateKeyedCache(today_ttl_sec=today_ttl_sec)
+
+    def _wh(self) -> OHLCVWarehouse:
+        return self.warehouse or default_warehouse()
+
+    # -----------------------------
+    # Sources
+    # -----------------------------
+    def _from_mi_index(self, day: date) -> Candidate:
+        params = {"date": day.strftime("%Y%m%d"), "type": "IND", "response": "json"}
+
+        def get_json() -> Dict[str, Any]:
+            r = shared_session(retries=0).get(MI_INDEX_URL, params=params, timeout=(2, 5), verify=verify_policy(True))
+            r.raise_for_status()
+            return r.json()
+
+        j = default_ledger().call("TWSE_MI_INDEX", get_json)
+        for fields, rows in _mi_index_tables(j):
+            i_close = resolve_column(fields, ["收盤"])
+            i_sign = resolve_column(fields, ["+/-"])
+            i_pts = resolve_column(fields, ["漲跌點數"])
+            if i_close is None:
+                continue
+            for row in rows:
+                if not row or str(row[0]).strip() != TWII_NAME:
+                    continue
+                close = _num(row[i_close])
+                pts = _num(row[i_pts]) if i_pts is not None else None
+                neg = i_sign is not None and "-" in re.sub(r"<[^>]*>", "", str(row[i_sign]))
+                chg = None if pts is None else (-pts if neg else pts)
+                if close is None:
+                    raise RuntimeError("MI_INDEX_BAD_CLOSE")
+                return {"date": day, "close": close,
+                        "prev_close": None if chg is None else close - chg, "prev2_close": None}
+        raise RuntimeError("MI_INDEX_NO_TWII")
+
+    def _from_yfinance(self, day: date) -> Candidate:
+        return _from_series(self._wh().history(SYMBOL, "1mo")["Close"], day)
+
+    def _from_stooq(self, day: date) -> Candidate:
+        r = shared_session(retries=0).get(STOOQ_TWII_URL, timeout=(2, 5))
+        r.raise_for_status()
+        lines = r.text.strip().splitlines()
+        # header: Date,Open,High,Low,Close,Volume
+        rows = [ln.split(",") for ln in lines[1:] if ln.count(",") >= 4]
+        if not rows:
+            raise RuntimeError("TWII_CSV_EMPTY")
+        s = pd.Series(pd.to_numeric([x[4] for x in rows], errors="coerce"),
+                      index=pd.to_datetime([x[0] for x in rows], errors="coerce"))
+        return _from_series(s[s.index.notna()].sort_index(), day)
+
+    def _from_warehouse(self, day: date) -> Candidate:
+        return _from_series(self._wh().read(SYMBOL, day - timedelta(days=30), day, final_only=True)["Close"], day)
+
+    def sources(self) -> Dict[str, Callable[[date], Candidate]]:
+        return {
+            "TWSE_MI_INDEX": self._from_mi_index,
+            "YFINANCE": self._from_yfinance,
+            "STOOQ": self._from_stooq,
+            DISK_SOURCE: self._from_warehouse,
+        }
+
+    # -----------------------------
+    # Sanity
+    # -----------------------------
+    def _reference(self, day: date) -> Tuple[Optional[float], Optional[float]]:
+        """倉庫磁碟 day 之前最後兩根收盤（不連網；沒有 → None）"""
+        try:
+            s = self._wh().read(SYMBOL, day - timedelta(days=30), day - timedelta(days=1), final_only=True)["Close"].dropna()
+        except Exception:
+            return None, None
+        return (float(s.iloc[-1]) if len(s) >= 1 else None,
+                float(s.iloc[-2]) if len(s) >= 2 else None)
+
+    def _check(self, cand: Candidate, day: date, ref_prev: Optional[float]) -> Optional[str]:
+        """None → 通過；否則拒絕原因（"STALE" 表示數值合理但不是當日）"""
+        close = cand.get("close")
+        if close is None or not close > 0:
+            return "BAD_CLOSE"
+        prev = ref_prev if ref_prev is not None and cand["date"] == day else cand.get("prev_close")
+        if prev is not None and prev > 0 and abs(close / prev - 1.0) > self.max_move:
+            return f"MOVE_{close / prev - 1.0:+.2%}"
+        if cand["date"] != day:
+            return "STALE"
+        return None
+
+    # -----------------------------
+    # Race
+    # -----------------------------
+    def _pack(self, source: str, cand: Candidate, day: date, ref: Tuple[Optional[float], Optional[float]],
+              stale: bool, rejected: List[str], t0: float) -> Dict[str, Any]:
+        close = cand["close"]
+        same_day = cand["date"] == day
+        prev = cand.get("prev_close") or (ref[0] if same_day else None)
+        prev2 = cand.get("prev2_close") or (ref[1] if same_day else None)
+        return {
+            "ok": True,
+            "source": source,
+            "error": None,
+            "stale": stale,
+            "rejected": rejected,
+            "latency_ms": int((time.time() - t0) * 1000),
+            "data": {
+                "date": cand["date"].isoformat(),
+                "close": round(close, 2),
+                "chg": None if prev is None else round(close - prev, 2),
+                "chg_pct": None if not prev else round((close / prev - 1.0) * 100.0, 4),
+                "prev_close": None if prev is None else round(prev, 2),
+                "chg_pct_prev": None if not (prev and prev2) else round((prev / prev2 - 1.0) * 100.0, 4),
+            },
+        }
+
+    def race(self, day: date, deadline_sec: Optional[float] = None) -> Dict[str, Any]:
+        t0 = time.time()
+        deadline = t0 + (self.race_deadline_sec if deadline_sec is None else float(deadline_sec))
+        ref = self._reference(day)
+        rejected: List[str] = []
+        stale: Optional[Tuple[str, Candidate]] = None
+
+        srcs = self.sources()
+        # 今日：磁碟不參賽，只在網路來源全部落空後當 stale 備案
+        disk = srcs.pop(DISK_SOURCE, None) if day >= _today_tpe() else None
+        ex = ThreadPoolExecutor(max_workers=len(srcs), thread_name_prefix="twii-race")
+        try:
+            futs = {ex.submit(fn, day): name for name, fn in srcs.items()}
+            pending = set(futs)
+            while pending:
+                done, pending = wait(pending, timeout=max(0.0, deadline - time.time()), return_when=FIRST_COMPLETED)
+                if not done:
+                    rejected.extend(f"{futs[f]}:TIMEOUT" for f in pending)
+                    break
+                for f in done:
+                    name = futs[f]
+                    try:
+                        cand = f.result()
+                    except Exception as e:
+                        rejected.append(f"{name}:{type(e).__name__}")
+                        continue
+                    reason = self._check(cand, day, ref[0])
+                    if reason is None:
+                        return self._pack(name, cand, day, ref, False, rejected, t0)
+                    rejected.append(f"{name}:{reason}")
+                    if reason == "STALE" and (stale is None or cand["date"] > stale[1]["date"]):
+                        stale = (name, cand)
+        finally:
+            ex.shutdown(wait=False, cancel_futures=True)
+
+        if disk is not None:
+            try:
+                cand = disk(day)
+                reason = self._check(cand, day, ref[0])
+                rejected.append(f"{DISK_SOURCE}:{reason or 'FALLBACK'}")
+                if reason in (None, "STALE") and (stale is None or cand["date"] > stale[1]["date"]):
+                    stale = (DISK_SOURCE, cand)
+            except Exception as e:
+                rejected.append(f"{DISK_SOURCE}:{type(e).__name__}")
+
+        if stale is not None:
+            return self._pack(stale[0], stale[1], day, ref, True, rejected, t0)
+        return {"ok": False, "source": "FAIL", "error": " | ".join(rejected) or "NO_SOURCE", "stale": False,
+                "rejected": rejected, "latency_ms": int((time.time() - t0) * 1000), "data": {}}
+
+    def get(self, trade_date: DateLike, deadline_sec: Optional[float] = None) -> Dict[str, Any]:
+        """trade_date 的收盤（快取優先；只快取當日且通過檢查的結果）"""
+        day = to_date(trade_date)
+        return self._cache.get_or_fetch(
+            ("TWII", day.isoformat()),
+            day,
+            lambda: self.race(day, deadline_sec),
+            should_cache=lambda v: bool(v.get("ok")) and not v.get("stale"),
+        )
+
+
+_DEFAULT: Optional[TwiiProvider] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_twii_provider() -> TwiiProvider:
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = TwiiProvider()
+        return _DEFAULT
@@ -0,0 +1,223 @@
+# twse_stock_day_all.py
+# -*- coding: utf-8 -*-
+"""
+TWSE STOCK_DAY_ALL — 單一下載點 + 行程內共用快取
+
+為什麼
+- 同一次執行裡 analyzer（amount / TopN）、MarketAmountProvider、app.py 都要這份全市場日行情
+- 這是 TWSE 最大的 payload：每個交易日只下載一次，所有使用者讀同一份解析結果
+
+快取規則（date_cache.DateKeyedCache）
+- key = 交易日 YYYYMMDD
+- 過去交易日永不過期；今日短 TTL
+- 同時多個呼叫者共用同一個 in-flight request
+- HTTP 失敗 / 空資料 → 丟 StockDayAllError，不快取
+- 端點熔斷（endpoint_health, TWSE_STOCK_DAY_ALL）：熔斷中直接丟 CIRCUIT_OPEN，不發 request
+- 定案的交易日落地（persist_root，預設 data/stock_day_all/<YYYYMMDD>.json；None → 停用）
+  - 定案：回應日期 = 請求日期，且下載時已過該日 PUBLISH_HHMM（盤中/未公布的今日不落地）
+  - 行程內快取 miss → 先讀磁碟，再發 request；analyzer 回放整段歷史不必逐日重抓
+
+endpoint:
+https://www.twse.com.tw/exchangeReport/STOCK_DAY_ALL?response=json&date=YYYYMMDD
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import requests
+
+from date_cache import TZ_TPE, DateKeyedCache, to_date
+from endpoint_health import default_ledger
+from http_client import shared_session
+from tw_parse import coerce_numeric_columns
+
+STOCK_DAY_ALL_URL = "https://www.twse.com.tw/exchangeReport/STOCK_DAY_ALL"
+
+# 中文表頭 → 與 OpenAPI 一致的英文欄名
+FIELD_MAP = {
+    "證券代號": "Code",
+    "證券名稱": "Name",
+    "成交股數": "TradeVolume",
+    "成交金額": "TradeValue",
+    "開盤價": "Open",
+    "最高價": "High",
+    "最低價": "Low",
+    "收盤價": "Close",
+    "漲跌價差": "Change",
+    "成交筆數": "Transaction",
+}
+NUMERIC_COLS = ["TradeVolume", "TradeValue", "Open", "High", "Low", "Close", "Change", "Transaction"]
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; Sunhero-Predator/1.0; +https://streamlit.app)",
+    "Accept": "application/json,text/plain,*/*",
+}
+
+TODAY_TTL_SEC = 300
+ENDPOINT = "TWSE_STOCK_DAY_ALL"
+PERSIST_ROOT = "data/stock_day_all"
+PUBLISH_HHMM = (15, 30)
+
+_CACHE = DateKeyedCache(today_ttl_sec=TODAY_TTL_SEC)
+
+
+class StockDayAllError(RuntimeError):
+    def __init__(self, code: str, status_code: Optional[int] = None, final_url: Optional[str] = None):
+        super().__init__(code)
+        self.code = code
+        self.status_code = status_code
+        self.final_url = final_url
+
+
+@dataclass
+class StockDayAll:
+    """
+    date: 回應內日期（YYYYMMDD；缺則為請求日期）
+    fields / rows: 原始表頭與資料列（唯讀）
+    table: 英文欄名 + 數值化後的 DataFrame（唯讀，要改請先 copy）
+    """
+    date: str
+    fields: List[str]
+    rows: List[List[Any]]
+    table: pd.DataFrame
+    status_code: Optional[int] = None
+    final_url: Optional[str] = None
+    latency_ms: int = 0
+    fetched_at: float = field(default_factory=time.time)
+
+
+def _build_table(fields: List[str], rows: List[List[Any]]) -> pd.DataFrame:
+    names = [FIELD_MAP.get(str(f).strip(), str(f).strip()) for f in fields]
+    width = len(names)
+    df = pd.DataFrame([list(r)[:width] for r in rows], columns=names)
+    coerce_numeric_columns(df, NUMERIC_COLS)
+    if "Code" in df.columns:
+        df["Code"] = df["Code"].astype(str).str.strip()
+    if "Name" in df.columns:
+        df["Name"] = df["Name"].astype(str).str.strip()
+    return df
+
+
+def _download(yyyymmdd: str, session: Optional[requests.Session], verify: Any, timeout: Any,
+              headers: Optional[Dict[str, str]]) -> StockDayAll:
+    ledger = default_ledger()
+    if not ledger.allow(ENDPOINT):
+        raise StockDayAllError("CIRCUIT_OPEN")
+
+    t0 = time.time()
+    params = {"response": "json", "date": yyyymmdd}
+    getter = (session or shared_session()).get
+    try:
+        r = getter(STOCK_DAY_ALL_URL, params=params, headers=headers or DEFAULT_HEADERS, timeout=timeout, verify=verify)
+    except Exception as e:
+        ledger.record(ENDPOINT, False, None, None, type(e).__name__)
+        raise
+    sc = r.status_code
+    if sc != 200:
+        ledger.record(ENDPOINT, False, None, sc, f"HTTP_{sc}")
+        raise StockDayAllError(f"HTTP_{sc}", sc, r.url)
+
+    try:
+        j = r.json()
+    except Exception as e:
+        # 被擋時常回 200 + HTML 頁面 → 視為端點失敗
+        ledger.record(ENDPOINT, False, None, sc, type(e).__name__)
+        raise
+    ledger.record(ENDPOINT, True, int((time.time() - t0) * 1000), sc)
+
+    rows = j.get("data") or []
+    fields = j.get("fields") or []
+    if not rows:
+        raise StockDayAllError("STOCK_DAY_ALL_EMPTY", sc, r.url)
+
+    return StockDayAll(
+        date=str(j.get("date") or yyyymmdd),
+        fields=list(fields),
+        rows=rows,
+        table=_build_table(fields, rows) if fields else pd.DataFrame(),
+        status_code=sc,
+        final_url=r.url,
+        latency_ms=int((time.time() - t0) * 1000),
+    )
+
+
+def _disk_path(root: str, yyyymmdd: str) -> str:
+    return os.path.join(root, f"{yyyymmdd}.json")
+
+
+def _load_disk(root: Optional[str], yyyymmdd: str) -> Optional[StockDayAll]:
+    if not root:
+        return None
+    try:
+        with open(_disk_path(root, yyyymmdd), "r", encoding="utf-8") as f:
+            j = json.load(f)
+        fields, rows = list(j["fields"]), j["rows"]
+        return StockDayAll(date=str(j["date"]), fields=fields, rows=rows,
+                           table=_build_table(fields, rows) if fields else pd.DataFrame(),
+                           final_url=j.get("final_url"), fetched_at=float(j.get("fetched_at") or 0))
+    except Exception:
+        return None
+
+
+def _final(sda: StockDayAll, yyyymmdd: str) -> bool:
+    if sda.date != yyyymmdd:
+        return False
+    d = to_date(yyyymmdd)
+    publish = datetime(d.year, d.month, d.day, *PUBLISH_HHMM, tzinfo=TZ_TPE)
+    return sda.fetched_at >= publish.timestamp()
+
+
+def _save_disk(root: Optional[str], yyyymmdd: str, sda: StockDayAll) -> None:
+    if not root or not _final(sda, yyyymmdd):
+        return
+    try:
+        os.makedirs(root, exist_ok=True)
+        path = _disk_path(root, yyyymmdd)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"date": sda.date, "fields": sda.fields, "rows": sda.rows,
+                       "final_url": sda.final_url, "fetched_at": sda.fetched_at}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+def _load_or_download(yyyymmdd: str, session: Optional[requests.Session], verify: Any, timeout: Any,
+                      headers: Optional[Dict[str, str]], persist_root: Optional[str]) -> StockDayAll:
+    hit = _load_disk(persist_root, yyyymmdd)
+    if hit is not None:
+        return hit
+    sda = _download(yyyymmdd, session, verify, timeout, headers)
+    _save_disk(persist_root, yyyymmdd, sda)
+    return sda
+
+
+def get_stock_day_all(
+    yyyymmdd: str,
+    *,
+    session: Optional[requests.Session] = None,
+    verify: Any = True,
+    timeout: Any = 20,
+    headers: Optional[Dict[str, str]] = None,
+    persist_root: Optional[str] = PERSIST_ROOT,
+) -> StockDayAll:
+    """
+    回傳該交易日的 STOCK_DAY_ALL（行程內快取 → 落地檔 → 下載）
+    session/timeout/verify 由第一個實際發出 request 的呼叫者決定
+    """
+    return _CACHE.get_or_fetch(
+        ("STOCK_DAY_ALL", yyyymmdd),
+        yyyymmdd,
+        lambda: _load_or_download(yyyymmdd, session, verify, timeout, headers, persist_root),
+    )
+
+
+def invalidate(yyyymmdd: Optional[str] = None) -> None:
+    _CACHE.invalidate(("STOCK_DAY_ALL", yyyymmdd) if yyyymmdd else None)
@@ -12,6 +12,8 @@ Design goals:
   - reports/report_YYYYMMDD_HHMMSS.json
   - reports/report_YYYYMMDD_HHMMSS.txt
   - data/snapshot_YYYYMMDD.json (optional but useful for debugging)
+- Snapshot read-through: prefetch_daemon warms snapshot_cache before the scheduled runs;
+  a warm snapshot is used as-is (--fresh forces a rebuild)
 """
 
 from __future__ import annotations
@@ -21,10 +23,11 @@ import json
 import os
 import sys
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 
-from downloader_tw import build_snapshot, build_v203_min_json
+from downloader_tw import build_snapshot, build_v203_min_json, snapshot_status
 from arbiter import arbiter_run
+from snapshot_cache import WORKFLOW_SNAPSHOT, default_snapshot_cache
 
 TZ_TPE = timezone(timedelta(hours=8))
 
@@ -55,6 +58,23 @@ def dump_text(s: str, path: str) -> None:
         f.write(s)
 
 
+def load_snapshot(target_dt: datetime, session: str, top_n: int, fresh: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    snapshot_cache 讀穿：prefetch_daemon 已預熱 → 直接用；否則 build_snapshot 並寫回快取
+    key = (目標日期, session, topN)；回傳 (snapshot, audit{status, from_cache})
+    """
+    cache = default_snapshot_cache()
+    key = (target_dt.strftime("%Y-%m-%d"), session.upper(), int(top_n))
+    if fresh:
+        cache.invalidate(key, [WORKFLOW_SNAPSHOT])
+
+    def fetch() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        snap = build_snapshot(target_dt, session_name=session, top_n=int(top_n))
+        return snap, {"status": snapshot_status(snap)}
+
+    return cache.get_or_fetch(key, WORKFLOW_SNAPSHOT, fetch)
+
+
 def build_default_system_params() -> Dict[str, Any]:
     # 你可以把這些搬到 config json；此處先提供穩定預設，避免外推
     return {
@@ -188,6 +208,7 @@ def main():
     ap.add_argument("--date", default="", help="YYYY-MM-DD in Asia/Taipei. empty => today")
     ap.add_argument("--topn", default=20, type=int)
     ap.add_argument("--equity", default=2_000_000, type=int)
+    ap.add_argument("--fresh", action="store_true", help="ignore prefetched snapshot and rebuild")
 
     args = ap.parse_args()
 
@@ -198,8 +219,9 @@ def main():
         d = now_tpe().date()
         target_dt = datetime(d.year, d.month, d.day, tzinfo=TZ_TPE)
 
-    # Build snapshot (data-layer)
-    snapshot = build_snapshot(target_dt, session_name=args.session, top_n=int(args.topn))
+    # Build snapshot (data-layer; prefetched snapshot if warm)
+    snapshot, snap_audit = load_snapshot(target_dt, args.session, int(args.topn), fresh=args.fresh)
+    print(f"[INFO] snapshot status={snap_audit.get('status')} from_cache={snap_audit.get('from_cache')}")
 
     # Assemble payload (V20.3-compatible minimal JSON builder)
     system_params = build_default_system_params()